@@ -1,6 +1,9 @@
 """afs_early_years_labour_market_analysis."""
+import atexit
 import logging
 import logging.config
+import logging.handlers
+import queue
 from pathlib import Path
 from typing import Optional
 
@@ -16,6 +19,21 @@ def get_yaml_config(file_path: Path) -> Optional[dict]:
             return yaml.load(f.read(), Loader=yaml.FullLoader)
 
 
+def queue_handlers(logger: logging.Logger) -> logging.handlers.QueueListener:
+    """Move a logger's handlers behind a queue written by a background thread,
+    so logging calls don't block on file or console I/O."""
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(
+        log_queue, *logger.handlers, respect_handler_level=True
+    )
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    listener.start()
+    # flush queued records on exit
+    atexit.register(listener.stop)
+
+    return listener
+
+
 # Define project base directory
 PROJECT_DIR = Path(__file__).resolve().parents[1]
 
@@ -31,6 +49,8 @@ if _logging_config:
 
 # Define module logger
 logger = logging.getLogger(__name__)
+if logger.handlers:
+    _log_listener = queue_handlers(logger)
 
 # base/global config
 _base_config_path = Path(__file__).parent.resolve() / "config/base.yaml"
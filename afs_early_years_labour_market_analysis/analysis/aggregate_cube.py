@@ -0,0 +1,225 @@
+"""
+Functions to precompute an aggregate cube of job advert counts and salaries.
+
+Every report table and chart is a groupby over a handful of dimensions of the
+cleaned job adverts. The cube computes advert counts and salary quantiles for
+each of those groupings (grouping sets) once, so report tables become cheap
+slices of a small table that can be saved and reloaded as parquet.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from afs_early_years_labour_market_analysis import logger
+
+# grouping sets needed for the report tables and charts
+report_grouping_sets = [
+    ["profession"],
+    ["profession", "qualification_level"],
+    ["profession", "month_year"],
+    ["profession", "created"],
+    ["profession", "itl_3_name"],
+    ["profession", "job_title_raw"],
+]
+
+salary_cols = ["inflation_adj_min_salary", "inflation_adj_max_salary"]
+
+salary_quantiles = [0.25, 0.5, 0.75]
+
+
+def get_quantile_col(salary_col: str, quantile: float) -> str:
+    """Get the name of the cube column of a salary quantile.
+
+    Args:
+        salary_col (str): Salary column.
+        quantile (float): Quantile, e.g. 0.5 for the median.
+
+    Returns:
+        str: Cube column name, e.g. "inflation_adj_min_salary_q50".
+    """
+    return f"{salary_col}_q{round(quantile * 100)}"
+
+
+def get_grouped_quantiles(
+    group_ids: np.ndarray,
+    n_groups: int,
+    sorted_values: np.ndarray,
+    quantiles: List[float],
+) -> np.ndarray:
+    """Compute quantiles of values per group.
+
+    Values are sorted once up front, so grouping them only takes a stable
+    integer sort of their group ids. Quantiles are linearly interpolated, as
+    in pandas' default quantile.
+
+    Args:
+        group_ids (np.ndarray): Group of each value, from 0 to n_groups - 1.
+        n_groups (int): Number of groups.
+        sorted_values (np.ndarray): Values sorted in ascending order, without
+            missing values.
+        quantiles (List[float]): Quantiles to compute.
+
+    Returns:
+        np.ndarray: (n_groups x quantiles) array of quantiles, NaN for groups
+            without any values.
+    """
+    # a stable sort keeps values sorted within contiguous runs of each group,
+    # and is a fast radix sort for group ids that fit in 16 bits
+    group_ids = group_ids.astype(np.min_scalar_type(n_groups))
+    values = sorted_values[np.argsort(group_ids, kind="stable")]
+    counts = np.bincount(group_ids, minlength=n_groups)
+    starts = np.cumsum(counts) - counts
+    has_values = counts > 0
+
+    group_quantiles = np.full((n_groups, len(quantiles)), np.nan)
+    for i, quantile in enumerate(quantiles):
+        position = (counts[has_values] - 1) * quantile
+        lower = np.floor(position).astype(int)
+        upper = np.ceil(position).astype(int)
+        fraction = position - lower
+        group_starts = starts[has_values]
+        group_quantiles[has_values, i] = (
+            values[group_starts + lower] * (1 - fraction)
+            + values[group_starts + upper] * fraction
+        )
+
+    return group_quantiles
+
+
+def build_aggregate_cube(
+    jobs: pd.DataFrame,
+    grouping_sets: List[List[str]] = report_grouping_sets,
+    salary_cols: List[str] = salary_cols,
+    quantiles: List[float] = salary_quantiles,
+    id_col: str = "id",
+) -> pd.DataFrame:
+    """Compute advert counts and salary quantiles for every grouping set.
+
+    Dimensions are factorized and salaries sorted once. For every grouping set
+    the dimension codes are combined into a single group id, and all counts
+    and quantiles are then computed with NumPy. As with a pandas
+    groupby, rows with a missing value in any dimension of a grouping set are
+    left out of that grouping set, and groups are sorted by dimension values.
+
+    Args:
+        jobs (pd.DataFrame): Cleaned job adverts.
+        grouping_sets (List[List[str]], optional): Lists of dimensions to group
+            by. Defaults to report_grouping_sets.
+        salary_cols (List[str], optional): Salary columns to get quantiles of.
+            Defaults to salary_cols.
+        quantiles (List[float], optional): Salary quantiles to compute.
+            Defaults to salary_quantiles.
+        id_col (str, optional): Advert id column. Defaults to "id".
+
+    Returns:
+        pd.DataFrame: Aggregate cube with a grouping_set column naming the
+            dimensions of each row, a column per dimension (missing where the
+            dimension is not in the grouping set), an advert_count column and a
+            column per salary quantile.
+    """
+    dimensions = list(dict.fromkeys(dim for dims in grouping_sets for dim in dims))
+
+    dim_codes, dim_values = {}, {}
+    for dim in dimensions:
+        dim_codes[dim], dim_values[dim] = pd.factorize(jobs[dim], sort=True)
+
+    has_id = jobs[id_col].notna().values
+
+    # sort each salary column once, dropping missing salaries
+    sorted_salaries = {}
+    for salary_col in salary_cols:
+        salary = jobs[salary_col].values.astype(float)
+        salary_order = np.argsort(salary, kind="stable")
+        salary_order = salary_order[~np.isnan(salary[salary_order])]
+        sorted_salaries[salary_col] = (salary_order, salary[salary_order])
+
+    cube = []
+    for dims in grouping_sets:
+        # -1 codes are missing values, which groupby leaves out
+        has_dims = np.all([dim_codes[dim] >= 0 for dim in dims], axis=0)
+        shape = tuple(len(dim_values[dim]) for dim in dims)
+        group_keys, group_ids = np.unique(
+            np.ravel_multi_index([dim_codes[dim][has_dims] for dim in dims], shape),
+            return_inverse=True,
+        )
+        n_groups = len(group_keys)
+
+        grouping_set_cube = {
+            dim: dim_values[dim].take(codes)
+            for dim, codes in zip(dims, np.unravel_index(group_keys, shape))
+        }
+        grouping_set_cube["advert_count"] = np.bincount(
+            group_ids, weights=has_id[has_dims], minlength=n_groups
+        ).astype(int)
+
+        row_group_ids = np.full(len(jobs), -1)
+        row_group_ids[has_dims] = group_ids
+        for salary_col, (salary_order, sorted_salary) in sorted_salaries.items():
+            salary_group_ids = row_group_ids[salary_order]
+            in_group = salary_group_ids >= 0
+            group_quantiles = get_grouped_quantiles(
+                salary_group_ids[in_group],
+                n_groups,
+                sorted_salary[in_group],
+                quantiles,
+            )
+            for i, quantile in enumerate(quantiles):
+                quantile_col = get_quantile_col(salary_col, quantile)
+                grouping_set_cube[quantile_col] = group_quantiles[:, i]
+
+        grouping_set_cube = pd.DataFrame(grouping_set_cube)
+        grouping_set_cube.insert(0, "grouping_set", get_grouping_set_name(dims))
+        cube.append(grouping_set_cube)
+
+    measure_cols = ["advert_count"] + [
+        get_quantile_col(salary_col, quantile)
+        for quantile in quantiles
+        for salary_col in salary_cols
+    ]
+    cube = pd.concat(cube, ignore_index=True)[
+        ["grouping_set"] + dimensions + measure_cols
+    ]
+    logger.info(
+        f"Built aggregate cube of {len(cube)} rows from {len(jobs)} job adverts"
+    )
+
+    return cube
+
+
+def get_grouping_set_name(dims: List[str]) -> str:
+    """Get the name of a grouping set, e.g. "profession|month_year".
+
+    Args:
+        dims (List[str]): Dimensions of the grouping set.
+
+    Returns:
+        str: Grouping set name.
+    """
+    return "|".join(dims)
+
+
+def slice_cube(
+    cube: pd.DataFrame,
+    dims: List[str],
+    filters: Optional[Dict[str, List]] = None,
+) -> pd.DataFrame:
+    """Slice the rows of a grouping set out of the aggregate cube.
+
+    Args:
+        cube (pd.DataFrame): Aggregate cube.
+        dims (List[str]): Dimensions of the grouping set.
+        filters (Optional[Dict[str, List]], optional): Values to keep per
+            dimension. Defaults to None.
+
+    Returns:
+        pd.DataFrame: Dimensions and measures of the grouping set.
+    """
+    cube_slice = cube[cube["grouping_set"] == get_grouping_set_name(dims)]
+    for dim, values in (filters or {}).items():
+        cube_slice = cube_slice[cube_slice[dim].isin(values)]
+
+    # measures follow the dimension columns, starting with advert_count
+    measure_cols = list(cube.columns[cube.columns.get_loc("advert_count") :])
+
+    return cube_slice[dims + measure_cols].reset_index(drop=True)
@@ -1,9 +1,19 @@
 """
 Functions to generate Nesta branch compliant generation of graphs
+
+Distribution charts are built from summaries computed in pandas, so chart
+specs embed a row per group rather than a row per job advert. The
+"hashed_files" data transformer writes chart data to files named by the hash
+of their content rather than inlining it in specs and notebooks.
 """
+import hashlib
+import os
+from typing import Dict, List, Optional, Union
 
 import altair as alt
 import pandas as pd
+from altair.utils import sanitize_dataframe
+from toolz import curried
 
 NESTA_COLOURS = [
     "#0000FF",
@@ -43,6 +53,99 @@ def nestafont(font: str = "Century Gothic"):
 alt.themes.register("nestafont", nestafont)
 alt.themes.enable("nestafont")
 
+# charts are built from aggregates, so a chart with more rows than this is
+# likely embedding job adverts
+chart_max_rows = 20000
+
+chart_data_dir = "chart_data"
+
+
+@curried.curry
+def to_hashed_file(
+    data: Union[pd.DataFrame, Dict],
+    data_dir: str = chart_data_dir,
+    data_format: str = "json",
+) -> Dict:
+    """Write chart data to a file named by its content hash.
+
+    Each unique dataset is written once, however many charts or notebook
+    runs use it, and specs reference it by URL.
+
+    Args:
+        data (Union[pd.DataFrame, Dict]): Chart data.
+        data_dir (str, optional): Directory to write data files to, relative
+            to where charts are rendered. Defaults to chart_data_dir.
+        data_format (str, optional): "json", which keeps column types,
+            or "csv". Defaults to "json".
+
+    Returns:
+        Dict: URL data model referencing the data file.
+    """
+    if hasattr(data, "__geo_interface__") or not isinstance(data, pd.DataFrame):
+        # geographies and values are kept inline
+        return alt.to_values(data)
+
+    # sanitising stores booleans as objects
+    bool_cols = [col for col in data.columns if pd.api.types.is_bool_dtype(data[col])]
+    data = sanitize_dataframe(data)
+    data_spec_format = {"type": data_format}
+    if data_format == "csv":
+        # csv values are strings, so booleans are written as vega parses them
+        # ("true"/"false") and parsed back
+        data = data.assign(
+            **{col: data[col].map({True: "true", False: "false"}) for col in bool_cols}
+        )
+        if bool_cols:
+            data_spec_format["parse"] = {col: "boolean" for col in bool_cols}
+        data_str = data.to_csv(index=False)
+    elif data_format == "json":
+        data_str = data.to_json(orient="records", double_precision=15)
+    else:
+        raise ValueError(f"data_format must be csv or json, not {data_format}")
+
+    data_hash = hashlib.sha1(data_str.encode()).hexdigest()[:16]
+    data_path = os.path.join(data_dir, f"{data_hash}.{data_format}")
+    if not os.path.exists(data_path):
+        os.makedirs(data_dir, exist_ok=True)
+        with open(data_path, "w") as f:
+            f.write(data_str)
+
+    return {"url": data_path, "format": data_spec_format}
+
+
+def hashed_files_data_transformer(
+    data: Union[pd.DataFrame, Dict],
+    max_rows: int = chart_max_rows,
+    data_dir: str = chart_data_dir,
+    data_format: str = "json",
+) -> Dict:
+    """Altair data transformer writing chart data to content hashed files.
+
+    Enable with alt.data_transformers.enable("hashed_files"), or use
+    alt.data_transformers.enable("data_server") to serve chart data from
+    altair-data-server instead.
+
+    Args:
+        data (Union[pd.DataFrame, Dict]): Chart data.
+        max_rows (int, optional): Maximum rows of chart data.
+            Defaults to chart_max_rows.
+        data_dir (str, optional): Directory to write data files to.
+            Defaults to chart_data_dir.
+        data_format (str, optional): "json", which keeps column types,
+            or "csv". Defaults to "json".
+
+    Returns:
+        Dict: URL data model referencing the data file.
+    """
+    return curried.pipe(
+        data,
+        alt.limit_rows(max_rows=max_rows),
+        to_hashed_file(data_dir=data_dir, data_format=data_format),
+    )
+
+
+alt.data_transformers.register("hashed_files", hashed_files_data_transformer)
+
 
 def configure_plots(
     fig,
@@ -77,3 +180,79 @@ def configure_plots(
         )
         .configure_view(strokeWidth=0)
     )
+
+
+def get_boxplot_summary(
+    df: pd.DataFrame, group_cols: List[str], value_col: str, extent: float = 1.5
+) -> pd.DataFrame:
+    """Compute the quartiles and whiskers of a boxplot per group.
+
+    Quartiles are linearly interpolated and whiskers extend to the most
+    extreme values within extent times the interquartile range of the box,
+    as in Vega-Lite's boxplot mark.
+
+    Args:
+        df (pd.DataFrame): DataFrame with group_cols and value_col columns.
+        group_cols (List[str]): Columns to group by, a box per group.
+        value_col (str): Column of values to summarise.
+        extent (float, optional): Whisker extent as a multiple of the
+            interquartile range. Defaults to 1.5.
+
+    Returns:
+        pd.DataFrame: Group columns and the count, lower whisker, q1, median,
+            q3 and upper whisker of each group.
+    """
+    df = df.dropna(subset=group_cols + [value_col])
+    grouped_values = df.groupby(group_cols, observed=True)[value_col]
+    summary = grouped_values.quantile([0.25, 0.5, 0.75]).unstack()
+    summary.columns = ["q1", "median", "q3"]
+    summary.insert(0, "count", grouped_values.size())
+
+    # gather each row's whisker fences by the index of its (sorted) group
+    group_ids = grouped_values.ngroup().values
+    iqr = summary["q3"] - summary["q1"]
+    lower_fence = (summary["q1"] - extent * iqr).values[group_ids]
+    upper_fence = (summary["q3"] + extent * iqr).values[group_ids]
+    values = df[value_col]
+    summary["lower"] = (
+        values.where(values >= lower_fence).groupby(group_ids).min().values
+    )
+    summary["upper"] = (
+        values.where(values <= upper_fence).groupby(group_ids).max().values
+    )
+
+    return summary[["count", "lower", "q1", "median", "q3", "upper"]].reset_index()
+
+
+def summary_boxplot(
+    summary: pd.DataFrame,
+    x: str,
+    y_title: str,
+    x_title: Optional[str] = None,
+    size: int = 50,
+) -> alt.LayerChart:
+    """Draw boxplots from quartiles and whiskers computed in pandas.
+
+    Args:
+        summary (pd.DataFrame): Boxplot summary from get_boxplot_summary.
+        x (str): Column to draw and colour a box per value of.
+        y_title (str): Title of the y axis.
+        x_title (Optional[str], optional): Title of the x axis and colour
+            legend. Defaults to None, to use x.
+        size (int, optional): Width of the boxes. Defaults to 50.
+
+    Returns:
+        alt.LayerChart: Whisker, box and median marks.
+    """
+    x_title = x if x_title is None else x_title
+    base = alt.Chart(summary).encode(alt.X(f"{x}:N", title=x_title))
+    whiskers = base.mark_rule().encode(
+        alt.Y("lower:Q", title=y_title, scale=alt.Scale(zero=False)),
+        alt.Y2("upper:Q"),
+    )
+    boxes = base.mark_bar(size=size).encode(
+        alt.Y("q1:Q"), alt.Y2("q3:Q"), alt.Color(f"{x}:N", title=x_title)
+    )
+    medians = base.mark_tick(color="white", size=size).encode(alt.Y("median:Q"))
+
+    return alt.layer(whiskers, boxes, medians)
@@ -0,0 +1,175 @@
+"""
+Functions to export report charts as images.
+
+Each chart's spec is serialised with its data inlined and hashed, so charts
+whose spec and data are unchanged since the last export are skipped. The
+remaining charts are rendered with vl-convert across a process pool. The
+manifest of chart hashes is saved even if a render fails, so charts that did
+render are skipped on the next export.
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import altair as alt
+import pandas as pd
+
+from afs_early_years_labour_market_analysis import logger
+
+chart_manifest_file = "chart_manifest.json"
+
+
+def get_chart_spec(chart: alt.TopLevelMixin) -> str:
+    """Serialise a chart to a Vega-Lite spec with its data inlined.
+
+    Args:
+        chart (alt.TopLevelMixin): Altair chart.
+
+    Returns:
+        str: Vega-Lite spec as json.
+    """
+    # inline data so the spec hash covers the data and renders need no files
+    with alt.data_transformers.enable("default", max_rows=None):
+        return chart.to_json(indent=None)
+
+
+def get_chart_hash(spec: str, image_format: str, scale: float) -> str:
+    """Hash a chart spec and its render settings.
+
+    Args:
+        spec (str): Vega-Lite spec as json.
+        image_format (str): "png" or "svg".
+        scale (float): Image scale factor.
+
+    Returns:
+        str: Hash of the spec and render settings.
+    """
+    return hashlib.sha1(f"{spec}|{image_format}|{scale}".encode()).hexdigest()
+
+
+def render_chart(spec: str, image_path: str, image_format: str, scale: float) -> float:
+    """Render a chart spec to an image file.
+
+    Args:
+        spec (str): Vega-Lite spec as json.
+        image_path (str): Path to save the image to.
+        image_format (str): "png" or "svg".
+        scale (float): Image scale factor for png images.
+
+    Returns:
+        float: Render time in seconds.
+    """
+    import vl_convert as vlc
+
+    start = time.perf_counter()
+    if image_format == "png":
+        with open(image_path, "wb") as f:
+            f.write(vlc.vegalite_to_png(spec, scale=scale))
+    elif image_format == "svg":
+        with open(image_path, "w") as f:
+            f.write(vlc.vegalite_to_svg(spec))
+    else:
+        raise ValueError(f"image_format must be png or svg, not {image_format}")
+
+    return time.perf_counter() - start
+
+
+def export_charts(
+    charts: Dict[str, alt.TopLevelMixin],
+    output_dir: str,
+    image_formats: List[str] = ["png"],
+    scale: float = 2,
+    max_workers: Optional[int] = None,
+    force: bool = False,
+) -> pd.DataFrame:
+    """Export charts to images, only re-rendering charts that have changed.
+
+    Args:
+        charts (Dict[str, alt.TopLevelMixin]): Charts keyed by image file name,
+            without the file extension.
+        output_dir (str): Directory to save images and the chart manifest to.
+        image_formats (List[str], optional): Image formats to export, "png"
+            and/or "svg". Defaults to ["png"].
+        scale (float, optional): Image scale factor for png images.
+            Defaults to 2.
+        max_workers (Optional[int], optional): Number of render processes.
+            Defaults to the number of CPUs.
+        force (bool, optional): Whether to re-render unchanged charts.
+            Defaults to False.
+
+    Raises:
+        Exception: The first render error, once the other charts have been
+            rendered and the manifest saved.
+
+    Returns:
+        pd.DataFrame: Image path, whether it was rendered and the render time
+            in seconds of each exported chart.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, chart_manifest_file)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    exports, to_render = [], {}
+    for chart_name, chart in charts.items():
+        spec = get_chart_spec(chart)
+        for image_format in image_formats:
+            image_file = f"{chart_name}.{image_format}"
+            image_path = os.path.join(output_dir, image_file)
+            chart_hash = get_chart_hash(spec, image_format, scale)
+            exports.append({"chart": chart_name, "image_path": image_path})
+            if (
+                force
+                or manifest.get(image_file) != chart_hash
+                or not os.path.exists(image_path)
+            ):
+                to_render[image_file] = (spec, image_path, image_format, chart_hash)
+
+    render_times, render_error = {}, None
+    if to_render:
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {}
+                for image_file, render_args in to_render.items():
+                    spec, image_path, image_format, _ = render_args
+                    future = executor.submit(
+                        render_chart, spec, image_path, image_format, scale
+                    )
+                    futures[future] = image_file
+                for future in as_completed(futures):
+                    image_file = futures[future]
+                    try:
+                        render_times[image_file] = future.result()
+                    except Exception as error:
+                        # keep rendering, so the other charts are recorded
+                        logger.error(f"Failed to render {image_file}: {error}")
+                        manifest.pop(image_file, None)
+                        render_error = render_error or error
+                        continue
+                    manifest[image_file] = to_render[image_file][-1]
+                    logger.info(
+                        f"Rendered {image_file} in {render_times[image_file]:.2f}s"
+                    )
+        finally:
+            # charts rendered before a failure or interrupt are not re-rendered
+            with open(manifest_path, "w") as f:
+                json.dump(manifest, f, indent=4, sort_keys=True)
+    if render_error is not None:
+        raise render_error
+
+    exports = pd.DataFrame(exports)
+    image_files = exports["image_path"].map(os.path.basename)
+    exports["rendered"] = image_files.isin(list(render_times))
+    exports["render_seconds"] = image_files.map(render_times)
+    logger.info(
+        f"Exported {len(exports)} chart images, "
+        f"{exports['rendered'].sum()} rendered and "
+        f"{(~exports['rendered']).sum()} unchanged"
+    )
+
+    return exports
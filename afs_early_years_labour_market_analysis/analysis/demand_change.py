@@ -0,0 +1,285 @@
+"""
+Functions to compute period over period changes in job advert demand.
+
+Demand is proxied by the percent change in advert counts and median salaries
+between periods, e.g. early_date_range and late_date_range. get_demand_change
+computes both for any grouping columns in a single grouped pass: adverts are
+sliced into periods with utils.time_index.TimeIndex, each advert's group and
+period are combined into one segment id, and the counts and medians of every
+segment are computed with NumPy, as in analysis.aggregate_cube.
+
+Percent changes come with bootstrap confidence intervals, resampled without
+looping over groups or resamples in Python. Advert counts are resampled as
+Poisson draws. Salaries are resampled within each segment as positions into
+the salaries sorted by segment, so sorting the positions of a batch of
+resamples sorts every segment's resampled salaries at once, and their medians
+are read off at fixed offsets.
+"""
+from typing import Dict, List, Tuple
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from afs_early_years_labour_market_analysis import logger
+from afs_early_years_labour_market_analysis.analysis.aggregate_cube import (
+    salary_cols,
+)
+from afs_early_years_labour_market_analysis.utils.time_index import Date, TimeIndex
+
+# resampled salaries to hold in memory at once
+max_bootstrap_batch_values = 5_000_000
+
+
+def get_pct_change(base: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Compute the percent change from base to values.
+
+    Args:
+        base (np.ndarray): Base values.
+        values (np.ndarray): Values, broadcastable with base.
+
+    Returns:
+        np.ndarray: Percent changes, NaN where base is 0 or missing.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct_change = (values - base) / base * 100
+
+    return np.where(np.isfinite(pct_change), pct_change, np.nan)
+
+
+def get_confidence_interval(
+    replicates: np.ndarray, confidence: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Get percentile confidence intervals from bootstrap replicates.
+
+    Args:
+        replicates (np.ndarray): Bootstrap replicates along the last axis.
+            Missing replicates are ignored.
+        confidence (float): Confidence level, e.g. 0.95.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Lower and upper bounds, NaN where all
+            replicates are missing.
+    """
+    alpha = (1 - confidence) / 2
+    with warnings.catch_warnings():
+        # all-NaN slices are expected for groups without base period adverts
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lower, upper = np.nanquantile(replicates, [alpha, 1 - alpha], axis=-1)
+
+    return lower, upper
+
+
+def get_segment_medians(
+    sorted_values: np.ndarray, starts: np.ndarray, counts: np.ndarray
+) -> np.ndarray:
+    """Get the medians of contiguous, sorted segments of values.
+
+    Args:
+        sorted_values (np.ndarray): Values sorted within each segment, with
+            segments laid out one after another. May be 2D, with rows of
+            independently sorted values sharing the same segments.
+        starts (np.ndarray): Position of the first value of each segment.
+        counts (np.ndarray): Number of values of each segment.
+
+    Returns:
+        np.ndarray: Median of each segment (along the last axis), NaN for
+            empty segments.
+    """
+    has_values = counts > 0
+    lower = starts[has_values] + (counts[has_values] - 1) // 2
+    upper = starts[has_values] + counts[has_values] // 2
+    medians = np.full(sorted_values.shape[:-1] + counts.shape, np.nan)
+    medians[..., has_values] = (
+        sorted_values[..., lower] + sorted_values[..., upper]
+    ) / 2
+
+    return medians
+
+
+def bootstrap_segment_medians(
+    sorted_values: np.ndarray,
+    starts: np.ndarray,
+    counts: np.ndarray,
+    n_bootstrap: int,
+    rng: np.random.Generator,
+    max_batch_values: int = max_bootstrap_batch_values,
+) -> np.ndarray:
+    """Bootstrap the medians of contiguous, sorted segments of values.
+
+    Each resample draws as many values as a segment has, with replacement, from
+    that segment. Draws are positions in sorted_values, and the positions of
+    different segments are disjoint, increasing ranges, so sorting all of a
+    resample's positions sorts each segment's resampled values in place.
+
+    Args:
+        sorted_values (np.ndarray): Values sorted within each segment, with
+            segments laid out one after another.
+        starts (np.ndarray): Position of the first value of each segment.
+        counts (np.ndarray): Number of values of each segment.
+        n_bootstrap (int): Number of resamples.
+        rng (np.random.Generator): Random number generator.
+        max_batch_values (int, optional): Resampled values to hold in memory
+            at once. Defaults to max_bootstrap_batch_values.
+
+    Returns:
+        np.ndarray: (segments x n_bootstrap) array of resampled medians, NaN
+            for empty segments.
+    """
+    value_starts = np.repeat(starts, counts)
+    value_counts = np.repeat(counts, counts)
+    n_values = len(sorted_values)
+    batch_size = max(1, max_batch_values // max(n_values, 1))
+
+    medians = np.empty((len(counts), n_bootstrap))
+    for batch_start in range(0, n_bootstrap, batch_size):
+        n_resamples = min(batch_size, n_bootstrap - batch_start)
+        positions = value_starts + rng.integers(
+            0, value_counts, size=(n_resamples, n_values)
+        )
+        positions.sort(axis=1)
+        medians[:, batch_start : batch_start + n_resamples] = get_segment_medians(
+            sorted_values[positions], starts, counts
+        ).T
+
+    return medians
+
+
+def get_demand_change(
+    jobs: pd.DataFrame,
+    periods: Dict[str, Tuple[Date, Date]],
+    group_cols: List[str] = ["profession"],
+    salary_cols: List[str] = salary_cols,
+    date_col: str = "created",
+    n_bootstrap: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 42,
+) -> pd.DataFrame:
+    """Compute advert counts, median salaries and their percent change from the
+    first period, per group and period, with bootstrap confidence intervals.
+
+    As with a pandas groupby, adverts with a missing value in any group column
+    are left out, and groups are sorted by group values. Groups with adverts in
+    any period get a row for every period. Adverts in overlapping periods count
+    towards each of them.
+
+    Args:
+        jobs (pd.DataFrame): Cleaned job adverts, ideally sorted by date_col.
+        periods (Dict[str, Tuple[Date, Date]]): Name and (start, end) range of
+            each period, with end excluded, e.g. {"early": early_date_range,
+            "late": late_date_range}. Changes are from the first period.
+        group_cols (List[str], optional): Columns to group by, or [] for all
+            adverts. Defaults to ["profession"].
+        salary_cols (List[str], optional): Salary columns to get medians of.
+            Defaults to salary_cols.
+        date_col (str, optional): Date column. Defaults to "created".
+        n_bootstrap (int, optional): Number of bootstrap resamples. Defaults
+            to 1000.
+        confidence (float, optional): Confidence level of the intervals.
+            Defaults to 0.95.
+        seed (int, optional): Random seed of the resamples. Defaults to 42.
+
+    Returns:
+        pd.DataFrame: A row per group and period, with the group columns, a
+            period column, an advert_count column, a median column per salary
+            column ("<salary_col>_median"), and for each of those a
+            "_pct_change" column with "_pct_change_lower" and
+            "_pct_change_upper" confidence bounds, missing for the first
+            period.
+    """
+    if len(periods) < 2:
+        raise ValueError("At least two periods are needed to compute changes")
+
+    try:
+        time_index = TimeIndex(jobs, date_col)
+    except ValueError:
+        time_index = TimeIndex.from_unsorted(jobs, date_col)
+    jobs = time_index.df
+
+    period_names = list(periods)
+    n_periods = len(period_names)
+    period_slices = time_index.get_period_slices(list(periods.values()))
+    rows = np.concatenate([np.arange(rows.start, rows.stop) for rows in period_slices])
+    period_ids = np.repeat(
+        np.arange(n_periods), [rows.stop - rows.start for rows in period_slices]
+    )
+
+    # combine group columns into a single group id, as in the aggregate cube
+    group_codes, group_values = [], []
+    for group_col in group_cols:
+        codes, values = pd.factorize(jobs[group_col].values[rows], sort=True)
+        group_codes.append(codes)
+        group_values.append(values)
+    # -1 codes are missing values, which groupby leaves out
+    has_groups = np.ones(len(rows), dtype=bool)
+    for codes in group_codes:
+        has_groups &= codes >= 0
+    shape = tuple(len(values) for values in group_values)
+    group_keys, group_ids = np.unique(
+        np.ravel_multi_index([codes[has_groups] for codes in group_codes], shape)
+        if group_cols
+        else np.zeros(has_groups.sum(), dtype=int),
+        return_inverse=True,
+    )
+    n_groups = len(group_keys)
+    rows, period_ids = rows[has_groups], period_ids[has_groups]
+    segment_ids = group_ids * n_periods + period_ids
+    n_segments = n_groups * n_periods
+
+    rng = np.random.default_rng(seed)
+    demand_change = {
+        group_col: np.repeat(values.take(codes), n_periods)
+        for group_col, values, codes in zip(
+            group_cols,
+            group_values,
+            np.unravel_index(group_keys, shape) if group_cols else [],
+        )
+    }
+    demand_change["period"] = np.tile(period_names, n_groups)
+
+    # (groups x periods) measures and (groups x periods x n_bootstrap) resamples
+    counts = np.bincount(segment_ids, minlength=n_segments).reshape(n_groups, n_periods)
+    measures = {
+        "advert_count": (
+            counts,
+            rng.poisson(counts[..., None], size=counts.shape + (n_bootstrap,)),
+        )
+    }
+    for salary_col in salary_cols:
+        salary = jobs[salary_col].values.astype(float)[rows]
+        has_salary = ~np.isnan(salary)
+        salary_segment_ids = segment_ids[has_salary]
+        salary = salary[has_salary]
+        order = np.lexsort((salary, salary_segment_ids))
+        sorted_salary = salary[order]
+        salary_counts = np.bincount(salary_segment_ids, minlength=n_segments)
+        salary_starts = np.cumsum(salary_counts) - salary_counts
+        measures[f"{salary_col}_median"] = (
+            get_segment_medians(sorted_salary, salary_starts, salary_counts).reshape(
+                n_groups, n_periods
+            ),
+            bootstrap_segment_medians(
+                sorted_salary, salary_starts, salary_counts, n_bootstrap, rng
+            ).reshape(n_groups, n_periods, n_bootstrap),
+        )
+
+    for measure_col, (values, resamples) in measures.items():
+        pct_change = get_pct_change(values[:, :1], values)
+        lower, upper = get_confidence_interval(
+            get_pct_change(resamples[:, :1], resamples), confidence
+        )
+        # changes are relative to the first period
+        for change in (pct_change, lower, upper):
+            change[:, 0] = np.nan
+        demand_change[measure_col] = values.ravel()
+        demand_change[f"{measure_col}_pct_change"] = pct_change.ravel()
+        demand_change[f"{measure_col}_pct_change_lower"] = lower.ravel()
+        demand_change[f"{measure_col}_pct_change_upper"] = upper.ravel()
+
+    demand_change = pd.DataFrame(demand_change)
+    logger.info(
+        f"Computed demand change of {n_groups} groups over {n_periods} periods "
+        f"from {len(rows)} job adverts"
+    )
+
+    return demand_change
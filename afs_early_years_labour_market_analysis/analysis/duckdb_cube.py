@@ -0,0 +1,382 @@
+"""
+Functions to build the aggregate cube with DuckDB directly over the enriched
+job advert parquet datasets.
+
+An optional alternative to cleaning the job adverts and building the cube in
+pandas. Cleaning (deduplication, date, England and profession filters, time
+columns and inflation adjustment) is expressed as a SQL view over the parquet
+datasets, only reading the sector/year/month partitions it keeps, and every
+grouping set is then aggregated in a single parallel, out of core GROUPING
+SETS query. Only the small cube is returned to pandas.
+
+The cube matches aggregate_cube.build_aggregate_cube on the output of
+utils.advert_cleaning.clean_job_adverts and
+utils.inflation.inflation_adjust_salaries, up to row order within a grouping
+set and dimension dtypes.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from afs_early_years_labour_market_analysis import BUCKET_NAME, logger
+import afs_early_years_labour_market_analysis.getters.ojd_daps as od
+from afs_early_years_labour_market_analysis.analysis.aggregate_cube import (
+    get_grouping_set_name,
+    get_quantile_col,
+    report_grouping_sets,
+    salary_cols,
+    salary_quantiles,
+)
+from afs_early_years_labour_market_analysis.utils.advert_cleaning import dedupe_cols
+from afs_early_years_labour_market_analysis.utils.geography import itl_1_countries
+from afs_early_years_labour_market_analysis.utils.inflation import (
+    get_yearly_inflation_factors,
+)
+
+# enriched EYP and similar job adverts, in the order they are concatenated
+enriched_job_advert_datasets = [
+    od.enriched_eyp_job_adverts_path,
+    od.enriched_sim_job_adverts_path,
+]
+
+# raw salary columns, mapped to their inflation adjusted column
+inflation_salary_cols = {
+    "min_annualised_salary": "inflation_adj_min_salary",
+    "max_annualised_salary": "inflation_adj_max_salary",
+}
+
+
+def sync_s3_dataset(fs, remote_path: str, local_path: str) -> Dict[str, str]:
+    """Sync a local copy of an s3 dataset, only downloading files that are new
+    or changed and deleting files that were removed, e.g. by an upsert.
+
+    Files are compared by their s3 ETag, recorded in a manifest next to the
+    local copy.
+
+    Args:
+        fs: s3 filesystem.
+        remote_path (str): s3 directory of the dataset, without the scheme.
+        local_path (str): Local directory to sync to.
+
+    Returns:
+        Dict[str, str]: ETag of each file, keyed by its path in the dataset.
+    """
+    remote_path = remote_path.rstrip("/")
+    remote_versions = {
+        os.path.relpath(path, remote_path): str(
+            info.get("ETag") or (info.get("size"), info.get("LastModified"))
+        )
+        for path, info in fs.find(remote_path, detail=True).items()
+    }
+
+    manifest_path = f"{local_path.rstrip('/')}.manifest.json"
+    local_versions = {}
+    if os.path.exists(manifest_path) and os.path.exists(local_path):
+        with open(manifest_path) as f:
+            local_versions = json.load(f)
+
+    changed_files = [
+        file
+        for file, version in remote_versions.items()
+        if local_versions.get(file) != version
+        or not os.path.exists(os.path.join(local_path, file))
+    ]
+    removed_files = set(local_versions) - set(remote_versions)
+    logger.info(
+        f"Syncing s3://{remote_path} to {local_path}: {len(changed_files)} new or "
+        f"changed and {len(removed_files)} removed of {len(remote_versions)} files"
+    )
+    for file in changed_files:
+        file_path = os.path.join(local_path, file)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        fs.get(f"{remote_path}/{file}", file_path)
+    for file in removed_files:
+        file_path = os.path.join(local_path, file)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+    with open(manifest_path, "w") as f:
+        json.dump(remote_versions, f, sort_keys=True)
+
+    return remote_versions
+
+
+def cache_enriched_job_adverts(
+    cache_dir: str, dataset_paths: List[str] = enriched_job_advert_datasets
+) -> Tuple[List[str], str]:
+    """Sync local copies of the enriched job advert parquet datasets on s3.
+
+    Only files that are new or changed since the last sync are downloaded, so
+    appended and upserted partitions are picked up cheaply.
+
+    Args:
+        cache_dir (str): Directory to cache the datasets in.
+        dataset_paths (List[str], optional): s3 directories of the datasets.
+            Defaults to enriched_job_advert_datasets.
+
+    Returns:
+        Tuple[List[str], str]: Local directories of the cached datasets, and a
+            fingerprint of the s3 files they were synced from, to key cached
+            results built from them by.
+    """
+    import fsspec
+
+    fs = fsspec.filesystem("s3")
+    local_paths, dataset_versions = [], {}
+    for dataset_path in dataset_paths:
+        local_path = os.path.join(cache_dir, os.path.basename(dataset_path.rstrip("/")))
+        dataset_versions[dataset_path] = sync_s3_dataset(
+            fs, f"{BUCKET_NAME}/{dataset_path}", local_path
+        )
+        local_paths.append(local_path)
+    datasets_fingerprint = hashlib.sha1(
+        json.dumps(dataset_versions, sort_keys=True).encode()
+    ).hexdigest()
+
+    return local_paths, datasets_fingerprint
+
+
+def _sql_list(values: List) -> str:
+    """Format values as a SQL list of literals."""
+    return ", ".join("'{}'".format(str(value).replace("'", "''")) for value in values)
+
+
+def _normalise_key_sql(col: str) -> str:
+    """SQL equivalent of utils.advert_cleaning.normalise_keys."""
+    return (
+        f"regexp_replace(regexp_replace(lower({col}), '^\\s+|\\s+$', '', 'g'), "
+        "'\\s+', ' ', 'g')"
+    )
+
+
+def get_inflation_factor_sql(
+    year_col: str, inflation_rate_dict: Dict[Union[str, int], float]
+) -> str:
+    """SQL equivalent of utils.inflation.gather_yearly_factors.
+
+    Args:
+        year_col (str): Integer year column.
+        inflation_rate_dict (Dict[Union[str, int], float]): Annual inflation
+            rates keyed by year.
+
+    Returns:
+        str: SQL CASE expression of each year's inflation factor.
+    """
+    factors = get_yearly_inflation_factors(inflation_rate_dict)
+    cases = " ".join(
+        f"WHEN {year_col} >= {year} THEN {factor!r}"
+        for year, factor in factors.iloc[:0:-1].items()
+    )
+
+    return f"CASE {cases} ELSE {factors.iloc[0]!r} END"
+
+
+def get_clean_job_adverts_sql(
+    dataset_paths: List[str],
+    professions_to_include: List[str],
+    min_date: str = "2021-04-01",
+    inflation_rate_dict: Optional[Dict[Union[str, int], float]] = None,
+    key_cols: List[str] = dedupe_cols,
+) -> str:
+    """Get a SQL query of cleaned, inflation adjusted job adverts.
+
+    Args:
+        dataset_paths (List[str]): Enriched job advert parquet datasets, in
+            the order they would be concatenated. Adverts in earlier datasets
+            are kept over their duplicates in later datasets.
+        professions_to_include (List[str]): Professions (sectors) to keep.
+        min_date (str, optional): Earliest date to keep adverts from.
+            Defaults to "2021-04-01".
+        inflation_rate_dict (Optional[Dict[Union[str, int], float]], optional):
+            Annual inflation rates keyed by year. Defaults to None, to leave
+            salaries unadjusted.
+        key_cols (List[str], optional): Columns identifying duplicate adverts,
+            of which the first is kept. Defaults to dedupe_cols.
+
+    Returns:
+        str: SQL query.
+    """
+    min_date = pd.Timestamp(min_date)
+    job_adverts = " UNION ALL BY NAME ".join(
+        f"SELECT *, {i} AS dataset_index FROM read_parquet("
+        f"'{path.rstrip('/')}/**/*.parquet', hive_partitioning = true, "
+        "filename = true, file_row_number = true)"
+        for i, path in enumerate(dataset_paths)
+    )
+    england_itl_1_codes = [
+        itl_1_code
+        for itl_1_code, country in itl_1_countries.items()
+        if country == "England"
+    ]
+    salary_sql = ""
+    if inflation_rate_dict is not None:
+        factor = get_inflation_factor_sql("year(created)", inflation_rate_dict)
+        salary_sql = "".join(
+            f", round(nullif(CAST({col} AS DOUBLE), 0) * {factor}, 2) AS {output_col}"
+            for col, output_col in inflation_salary_cols.items()
+        )
+
+    key_sql = ", ".join(
+        col if col == "created" else _normalise_key_sql(f"CAST({col} AS VARCHAR)")
+        for col in key_cols
+    )
+
+    return f"""
+        WITH job_adverts AS (
+            SELECT * REPLACE (CAST(created AS TIMESTAMP) AS created)
+            FROM ({job_adverts})
+            -- partition filters skip the files of other sectors and months
+            WHERE sector IN ({_sql_list(professions_to_include)})
+                AND (
+                    year > {min_date.year}
+                    OR (year = {min_date.year} AND month >= {min_date.month})
+                )
+                AND CAST(created AS TIMESTAMP) >= TIMESTAMP '{min_date}'
+        ),
+        first_job_adverts AS (
+            SELECT
+                *,
+                row_number() OVER (
+                    PARTITION BY {key_sql}
+                    ORDER BY dataset_index, filename, file_row_number
+                ) AS advert_number
+            FROM job_adverts
+        )
+        SELECT
+            * EXCLUDE (
+                dataset_index,
+                filename,
+                file_row_number,
+                advert_number,
+                sector,
+                year,
+                month
+            ),
+            sector AS profession,
+            CAST(year(created) AS VARCHAR) AS year,
+            date_trunc('month', created) AS month_year
+            {salary_sql}
+        FROM first_job_adverts
+        WHERE advert_number = 1
+            AND substr(regexp_replace(itl_3_code, '^UK', 'TL'), 1, 3)
+                IN ({_sql_list(england_itl_1_codes)})
+    """
+
+
+def build_aggregate_cube_duckdb(
+    dataset_paths: List[str],
+    professions_to_include: List[str],
+    inflation_rate_dict: Dict[Union[str, int], float],
+    min_date: str = "2021-04-01",
+    grouping_sets: List[List[str]] = report_grouping_sets,
+    salary_cols: List[str] = salary_cols,
+    quantiles: List[float] = salary_quantiles,
+    id_col: str = "id",
+    threads: Optional[int] = None,
+    memory_limit: Optional[str] = None,
+    key_cols: List[str] = dedupe_cols,
+) -> pd.DataFrame:
+    """Clean enriched job adverts and compute advert counts and salary quantiles
+    for every grouping set in DuckDB.
+
+    Args:
+        dataset_paths (List[str]): Enriched job advert parquet datasets, in
+            the order they would be concatenated.
+        professions_to_include (List[str]): Professions (sectors) to keep.
+        inflation_rate_dict (Dict[Union[str, int], float]): Annual inflation
+            rates keyed by year.
+        min_date (str, optional): Earliest date to keep adverts from.
+            Defaults to "2021-04-01".
+        grouping_sets (List[List[str]], optional): Lists of dimensions to group
+            by. Defaults to report_grouping_sets.
+        salary_cols (List[str], optional): Inflation adjusted salary columns to
+            get quantiles of. Defaults to salary_cols.
+        quantiles (List[float], optional): Salary quantiles to compute.
+            Defaults to salary_quantiles.
+        id_col (str, optional): Advert id column. Defaults to "id".
+        threads (Optional[int], optional): Number of DuckDB threads.
+            Defaults to the number of CPUs.
+        memory_limit (Optional[str], optional): DuckDB memory limit, e.g.
+            "4GB", beyond which it spills to disk. Defaults to DuckDB's default.
+        key_cols (List[str], optional): Columns identifying duplicate adverts,
+            of which the first is kept. Defaults to dedupe_cols.
+
+    Returns:
+        pd.DataFrame: Aggregate cube, as returned by
+            aggregate_cube.build_aggregate_cube.
+    """
+    import duckdb
+
+    dimensions = list(dict.fromkeys(dim for dims in grouping_sets for dim in dims))
+    measure_cols = ["advert_count"] + [
+        get_quantile_col(salary_col, quantile)
+        for quantile in quantiles
+        for salary_col in salary_cols
+    ]
+    quantile_sql = ", ".join(
+        f"quantile_cont({salary_col}, {quantile}) AS "
+        f"{get_quantile_col(salary_col, quantile)}"
+        for quantile in quantiles
+        for salary_col in salary_cols
+    )
+
+    # grouping(...) sets a bit for every dimension not in a row's grouping set
+    grouping_set_masks = {}
+    for dims in grouping_sets:
+        mask = sum(
+            1 << (len(dimensions) - 1 - i)
+            for i, dim in enumerate(dimensions)
+            if dim not in dims
+        )
+        grouping_set_masks[mask] = get_grouping_set_name(dims)
+    grouping_set_sql = " ".join(
+        f"WHEN {mask} THEN '{name}'" for mask, name in grouping_set_masks.items()
+    )
+    dims_sql = ", ".join(dimensions)
+
+    query = f"""
+        SELECT
+            CASE grouping({dims_sql}) {grouping_set_sql} END AS grouping_set,
+            {dims_sql},
+            count({id_col}) AS advert_count,
+            {quantile_sql}
+        FROM ({get_clean_job_adverts_sql(
+            dataset_paths,
+            professions_to_include,
+            min_date,
+            inflation_rate_dict,
+            key_cols,
+        )})
+        GROUP BY GROUPING SETS ({
+            ", ".join(f"({', '.join(dims)})" for dims in grouping_sets)
+        })
+    """
+
+    with duckdb.connect() as con:
+        if threads is not None:
+            con.execute(f"SET threads = {int(threads)}")
+        if memory_limit is not None:
+            con.execute(f"SET memory_limit = '{memory_limit}'")
+        cube = con.execute(query).df()
+
+    # as with a pandas groupby, leave out groups with missing dimension values
+    # and sort groups by dimension values
+    cube = pd.concat(
+        [
+            cube[cube["grouping_set"] == get_grouping_set_name(dims)]
+            .dropna(subset=dims)
+            .sort_values(dims)
+            for dims in grouping_sets
+        ],
+        ignore_index=True,
+    )[["grouping_set"] + dimensions + measure_cols]
+    cube["advert_count"] = cube["advert_count"].astype(int)
+    logger.info(
+        f"Built aggregate cube of {len(cube)} rows for "
+        f"{len(grouping_sets)} grouping sets with DuckDB"
+    )
+
+    return cube
@@ -0,0 +1,173 @@
+"""
+Functions to compare the skill profiles of professions, regions or adverts.
+
+Skill counts are held in a sparse (group x skill) matrix built in a single
+pass over the skills table, so all-pairs cosine similarity is one sparse
+matrix multiplication however many groups are compared. Top skills are
+likewise computed for every profession in one grouped pass.
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def get_skill_count_matrix(
+    skills: pd.DataFrame, group_col: str = "profession", skill_col: str = "esco_id"
+) -> Tuple[sparse.csr_matrix, pd.Index, pd.Index]:
+    """Build a sparse matrix of skill counts per group.
+
+    Args:
+        skills (pd.DataFrame): DataFrame of skills, one row per skill per advert.
+        group_col (str, optional): Column to group skills by, e.g. "profession",
+            "itl_3_name" or "id" for an advert x skill matrix.
+            Defaults to "profession".
+        skill_col (str, optional): Column of skill ids. Defaults to "esco_id".
+
+    Returns:
+        Tuple[sparse.csr_matrix, pd.Index, pd.Index]: (group x skill) count
+            matrix, group labels of its rows and skill ids of its columns.
+    """
+    group_codes, groups = pd.factorize(skills[group_col], sort=True)
+    skill_codes, skill_ids = pd.factorize(skills[skill_col], sort=True)
+
+    # drop rows with a missing group or skill
+    is_valid = (group_codes >= 0) & (skill_codes >= 0)
+    group_codes, skill_codes = group_codes[is_valid], skill_codes[is_valid]
+
+    # duplicate (group, skill) entries are summed into counts
+    skill_counts = sparse.csr_matrix(
+        (np.ones(len(group_codes)), (group_codes, skill_codes)),
+        shape=(len(groups), len(skill_ids)),
+    )
+    skill_counts.sum_duplicates()
+
+    return skill_counts, pd.Index(groups, name=group_col), pd.Index(skill_ids)
+
+
+def get_tfidf_weights(skill_counts: sparse.csr_matrix) -> sparse.csr_matrix:
+    """Weight skill counts by their (smoothed) inverse group frequency.
+
+    Skills found in every group, e.g. "communication", are down weighted so
+    similarity reflects the skills that distinguish groups.
+
+    Args:
+        skill_counts (sparse.csr_matrix): (group x skill) count matrix.
+
+    Returns:
+        sparse.csr_matrix: TF-IDF weighted (group x skill) matrix.
+    """
+    n_groups = skill_counts.shape[0]
+    group_frequency = np.bincount(skill_counts.indices, minlength=skill_counts.shape[1])
+    idf = np.log((1 + n_groups) / (1 + group_frequency)) + 1
+
+    return sparse.csr_matrix(skill_counts.multiply(idf[None, :]))
+
+
+def get_cosine_similarity(skill_counts: sparse.csr_matrix) -> sparse.csr_matrix:
+    """Calculate the cosine similarity between all pairs of rows.
+
+    Args:
+        skill_counts (sparse.csr_matrix): (group x skill) matrix.
+
+    Returns:
+        sparse.csr_matrix: (group x group) cosine similarity matrix.
+    """
+    norms = np.sqrt(np.asarray(skill_counts.multiply(skill_counts).sum(axis=1)))
+    norms[norms == 0] = 1
+    normalised = sparse.csr_matrix(skill_counts.multiply(1 / norms))
+
+    return normalised @ normalised.T
+
+
+def get_skill_similarity_matrix(
+    skills: pd.DataFrame,
+    group_col: str = "profession",
+    skill_col: str = "esco_id",
+    tfidf: bool = False,
+) -> pd.DataFrame:
+    """Calculate the skill profile similarity between every pair of groups.
+
+    Args:
+        skills (pd.DataFrame): DataFrame of skills, one row per skill per advert.
+        group_col (str, optional): Column to group skills by.
+            Defaults to "profession".
+        skill_col (str, optional): Column of skill ids. Defaults to "esco_id".
+        tfidf (bool, optional): Whether to TF-IDF weight skill counts.
+            Defaults to False.
+
+    Returns:
+        pd.DataFrame: (group x group) cosine similarity of skill profiles.
+    """
+    skill_counts, groups, _ = get_skill_count_matrix(skills, group_col, skill_col)
+    if tfidf:
+        skill_counts = get_tfidf_weights(skill_counts)
+
+    similarity = get_cosine_similarity(skill_counts).toarray()
+
+    return pd.DataFrame(similarity, index=groups, columns=groups)
+
+
+def get_top_skills_per_profession(
+    skills: pd.DataFrame,
+    k: int = 10,
+    reference_profession: str = "Early Years Practitioner",
+    min_esco_id_len: int = 10,
+) -> pd.DataFrame:
+    """Get the k skills found in the most adverts of each profession.
+
+    Advert counts, skill shares and top skills of all professions are
+    computed with grouped operations rather than a query per profession.
+
+    Args:
+        skills (pd.DataFrame): DataFrame of skills, one row per skill per advert,
+            with id, profession, esco_id and esco_label columns.
+        k (int, optional): Number of top skills per profession. Defaults to 10.
+        reference_profession (str, optional): Profession whose top skills the
+            other professions' top skills are compared to.
+            Defaults to "Early Years Practitioner".
+        min_esco_id_len (int, optional): Skill ids must be longer than this to
+            keep skills and drop skill groups. Defaults to 10.
+
+    Returns:
+        pd.DataFrame: Top skills of each profession, with the count and percent
+            of the profession's adverts with the skill, whether the skill is in
+            the reference profession's top skills and the number of professions
+            whose top skills it is in.
+    """
+    advert_counts = skills.groupby("profession")["id"].nunique()
+
+    skill_counts = (
+        skills[skills["esco_id"].str.len() > min_esco_id_len]
+        .groupby(["profession", "esco_id"])
+        .size()
+        .rename("count")
+        .reset_index()
+    )
+    skill_counts["job_ad_percent"] = (
+        skill_counts["count"] / skill_counts["profession"].map(advert_counts) * 100
+    )
+
+    top_skills = (
+        skill_counts.sort_values(
+            ["profession", "job_ad_percent"], ascending=[True, False], kind="stable"
+        )
+        .groupby("profession")
+        .head(k)
+        .reset_index(drop=True)
+    )
+    skill_labels = skills.drop_duplicates("esco_id", keep="last").set_index("esco_id")[
+        "esco_label"
+    ]
+    top_skills["esco_label"] = top_skills["esco_id"].map(skill_labels)
+
+    reference_skills = top_skills.loc[
+        top_skills["profession"] == reference_profession, "esco_id"
+    ]
+    top_skills["in_reference_top_skills"] = top_skills["esco_id"].isin(reference_skills)
+    top_skills["n_professions_with_top_skill"] = top_skills.groupby("esco_id")[
+        "profession"
+    ].transform("size")
+
+    return top_skills
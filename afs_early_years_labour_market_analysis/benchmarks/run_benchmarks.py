@@ -0,0 +1,450 @@
+"""
+Benchmark the pipeline and notebook hot paths on synthetic OJO data.
+
+Benchmarks the refine and enrich flows' steps, text cleaning, qualification
+extraction and the notebook's cleaning and aggregations, and saves timings as
+json. Process pool paths are timed with 1 worker and with every CPU, and their
+speedups recorded. Pass a previous results file as a baseline to flag
+regressions.
+
+python afs_early_years_labour_market_analysis/benchmarks/run_benchmarks.py --n-adverts 100000
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from afs_early_years_labour_market_analysis import PROJECT_DIR, logger
+import afs_early_years_labour_market_analysis.analysis.aggregate_cube as ac
+import afs_early_years_labour_market_analysis.analysis.skills_analysis as sa
+import afs_early_years_labour_market_analysis.benchmarks.synthetic_data as sd
+import afs_early_years_labour_market_analysis.pipeline.data_collection.refine_relevant_jobs as rrj
+import afs_early_years_labour_market_analysis.pipeline.data_enrichment.enrich_relevant_jobs as erj
+import afs_early_years_labour_market_analysis.utils.advert_cleaning as cl
+import afs_early_years_labour_market_analysis.utils.inflation as inf
+import afs_early_years_labour_market_analysis.utils.quantile_sketch as qs
+import afs_early_years_labour_market_analysis.utils.text_cleaning as tc
+from afs_early_years_labour_market_analysis.utils.checkpoint import checkpointed_map
+from afs_early_years_labour_market_analysis.utils.parallel import parallel_apply
+from afs_early_years_labour_market_analysis.utils.text_cleaning import clean_job_title
+from afs_early_years_labour_market_analysis.utils.title_classifier import (
+    JobTitleClassifier,
+)
+
+benchmark_output_path = str(PROJECT_DIR / "outputs/benchmarks/")
+
+# benchmarks slower than the baseline by more than this are regressions
+regression_tolerance = 0.1
+
+# process pool benchmarks, timed with each number of workers
+parallel_benchmarks = ["clean_job_title", "clean_job_descriptions", "checkpointed_map"]
+
+# inflation rates used by the notebook
+inflation_rate_dict = {"2020": 0.01, "2021": 0.025, "2022": 0.079, "2023": 0.0896667}
+
+
+def time_benchmark(
+    results: Dict[str, Dict],
+    name: str,
+    func: Callable,
+    n_rows: int,
+    repeats: int = 1,
+):
+    """Time a benchmark, recording the best and mean of repeated runs.
+
+    Args:
+        results (Dict[str, Dict]): Benchmark results to add to.
+        name (str): Name of the benchmark.
+        func (Callable): Function to time, called without arguments.
+        n_rows (int): Number of input rows, to report throughput.
+        repeats (int, optional): Number of times to run func. Defaults to 1.
+
+    Returns:
+        Any: Output of the last run of func.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        output = func()
+        timings.append(time.perf_counter() - start)
+
+    results[name] = {
+        "n_rows": int(n_rows),
+        "seconds": min(timings),
+        "mean_seconds": float(np.mean(timings)),
+        "rows_per_second": n_rows / min(timings) if min(timings) > 0 else None,
+    }
+    logger.info(f"{name}: {min(timings):.3f}s for {n_rows} rows")
+
+    return output
+
+
+def get_parallel_speedups(
+    results: Dict[str, Dict], worker_counts: List[int]
+) -> Dict[str, Dict[str, float]]:
+    """Get the speedup of each process pool benchmark over its 1 worker run.
+
+    Args:
+        results (Dict[str, Dict]): Benchmark results, with process pool
+            benchmarks named "<name>_<n_workers>_workers".
+        worker_counts (List[int]): Numbers of workers benchmarked.
+
+    Returns:
+        Dict[str, Dict[str, float]]: Speedup of each benchmark by number of
+            workers, e.g. {"clean_job_title": {"8": 5.2}}.
+    """
+    speedups = {}
+    for name in parallel_benchmarks:
+        serial = results.get(f"{name}_1_workers")
+        if serial is None:
+            continue
+        speedups[name] = {
+            str(n_workers): serial["seconds"]
+            / results[f"{name}_{n_workers}_workers"]["seconds"]
+            for n_workers in worker_counts
+            if n_workers > 1 and f"{name}_{n_workers}_workers" in results
+        }
+
+    return speedups
+
+
+def get_git_commit() -> Optional[str]:
+    """Get the current git commit, if in a git repository."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=PROJECT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    n_adverts: int = 100_000,
+    seed: int = 42,
+    repeats: int = 1,
+    n_qualification_descriptions: int = 1_000,
+    skip: List[str] = [],
+    worker_counts: Optional[List[int]] = None,
+) -> Dict:
+    """Run every benchmark on synthetic OJO data.
+
+    Args:
+        n_adverts (int, optional): Number of synthetic job adverts.
+            Defaults to 100_000.
+        seed (int, optional): Random seed. Defaults to 42.
+        repeats (int, optional): Number of runs per benchmark. Defaults to 1.
+        n_qualification_descriptions (int, optional): Number of descriptions to
+            extract qualification levels from. Defaults to 1_000.
+        skip (List[str], optional): Names of benchmarks to skip, e.g.
+            "qualification_extraction" without a spacy model. Defaults to [].
+        worker_counts (Optional[List[int]], optional): Numbers of workers to
+            time the process pool benchmarks with. Defaults to 1 and the
+            number of CPUs.
+
+    Returns:
+        Dict: Metadata of the run and results of each benchmark.
+    """
+    results = {}
+    worker_counts = sorted(set(worker_counts or [1, os.cpu_count() or 1]))
+
+    def benchmark(name: str, func: Callable, n_rows: int):
+        if name not in skip:
+            return time_benchmark(results, name, func, n_rows, repeats)
+
+    ojo_data = time_benchmark(
+        results,
+        "generate_synthetic_data",
+        lambda: sd.generate_ojo_data(n_adverts, seed),
+        n_adverts,
+    )
+    job_adverts = ojo_data["job_adverts"]
+
+    # RefineRelevantJobs
+    eyp_jobs = time_benchmark(
+        results,
+        "refine_eyp_job_adverts",
+        lambda: rrj.refine_eyp_job_adverts(job_adverts),
+        len(job_adverts),
+        repeats,
+    )
+    sim_jobs = time_benchmark(
+        results,
+        "refine_similar_job_adverts",
+        lambda: rrj.refine_similar_job_adverts(job_adverts, eyp_jobs),
+        len(job_adverts),
+        repeats,
+    )
+    title_classifier = JobTitleClassifier.from_config()
+    benchmark(
+        "refine_eyp_job_adverts_title_classifier",
+        lambda: rrj.refine_eyp_job_adverts(job_adverts, title_classifier),
+        len(job_adverts),
+    )
+    benchmark(
+        "refine_similar_job_adverts_title_classifier",
+        lambda: rrj.refine_similar_job_adverts(job_adverts, eyp_jobs, title_classifier),
+        len(job_adverts),
+    )
+    for n_workers in worker_counts:
+        # map every unique title in the pool, however few there are
+        benchmark(
+            f"clean_job_title_{n_workers}_workers",
+            lambda: parallel_apply(
+                job_adverts["job_title_raw"],
+                clean_job_title,
+                n_workers,
+                min_parallel_size=0,
+            ),
+            len(job_adverts),
+        )
+
+    # EnrichRelevantJobs
+    for n_workers in worker_counts:
+        # every advert's description, so the pool is used at any n_adverts
+        all_descriptions = time_benchmark(
+            results,
+            f"clean_job_descriptions_{n_workers}_workers",
+            lambda: erj.clean_job_descriptions(
+                ojo_data["descriptions"], job_adverts["id"].unique(), n_workers
+            ),
+            len(job_adverts),
+            repeats,
+        )
+    eyp_descriptions = all_descriptions[all_descriptions["id"].isin(eyp_jobs["id"])]
+
+    def clean_descriptions_checkpointed(n_workers: int):
+        # as the qualification extraction map, from an empty checkpoint
+        with tempfile.TemporaryDirectory() as checkpoint_path:
+            return checkpointed_map(
+                tc.clean_text,
+                ojo_data["descriptions"]["description"].unique(),
+                checkpoint_path,
+                description="Cleaning descriptions",
+                n_workers=n_workers,
+            )
+
+    for n_workers in worker_counts:
+        benchmark(
+            f"checkpointed_map_{n_workers}_workers",
+            lambda: clean_descriptions_checkpointed(n_workers),
+            ojo_data["descriptions"]["description"].nunique(),
+        )
+    rural_urban_nuts = erj.prepare_rural_urban_nuts(ojo_data["rural_urban_nuts"])
+
+    def enrich_job_adverts():
+        enriched_jobs = {}
+        for profession_type, jobs in {"eyp": eyp_jobs, "sim": sim_jobs}.items():
+            enriched_jobs[profession_type] = erj.add_rural_urban_classification(
+                erj.add_salaries_and_locations(
+                    jobs, ojo_data["salaries"], ojo_data["locations"]
+                ),
+                rural_urban_nuts,
+            )
+            enriched_jobs[f"{profession_type}_skills"] = erj.get_relevant_skills(
+                jobs, ojo_data["skills"]
+            )
+        return enriched_jobs
+
+    enriched_jobs = time_benchmark(
+        results,
+        "enrich_job_adverts",
+        enrich_job_adverts,
+        len(eyp_jobs) + len(sim_jobs),
+        repeats,
+    )
+    clean_descriptions = eyp_descriptions["clean_description"].head(
+        n_qualification_descriptions
+    )
+    benchmark(
+        "qualification_extraction",
+        lambda: erj.get_qualification_levels(clean_descriptions),
+        len(clean_descriptions),
+    )
+
+    # notebook cleaning and aggregations, with synthetic qualification levels
+    rng = np.random.default_rng(seed)
+    all_jobs = pd.concat(
+        [
+            enriched_jobs["eyp"].assign(
+                qualification_level=rng.choice(
+                    np.array(["2", "3", "6", None], dtype=object),
+                    len(enriched_jobs["eyp"]),
+                )
+            ),
+            enriched_jobs["sim"],
+        ]
+    ).rename(columns={"sector": "profession"})
+    all_skills = pd.concat([enriched_jobs["eyp_skills"], enriched_jobs["sim_skills"]])
+    all_skills["profession"] = all_skills["id"].map(
+        all_jobs.drop_duplicates("id").set_index("id")["profession"]
+    )
+
+    all_jobs_clean = time_benchmark(
+        results,
+        "clean_combined_job_adverts",
+        lambda: cl.clean_job_adverts(
+            all_jobs, all_jobs["profession"].unique().tolist(), log_memory=False
+        ),
+        len(all_jobs),
+        repeats,
+    )
+    all_jobs_clean = time_benchmark(
+        results,
+        "inflation_adjust_salaries",
+        lambda: inf.inflation_adjust_salaries(
+            all_jobs_clean,
+            salary_cols={
+                "min_annualised_salary": "inflation_adj_min_salary",
+                "max_annualised_salary": "inflation_adj_max_salary",
+            },
+            inflation_rate_dict=inflation_rate_dict,
+        ),
+        len(all_jobs_clean),
+        repeats,
+    )
+    benchmark(
+        "build_aggregate_cube",
+        lambda: ac.build_aggregate_cube(all_jobs_clean),
+        len(all_jobs_clean),
+    )
+
+    def merge_saved_quantile_sketches():
+        # sketch two shards, save and reload one, and merge it into the other
+        group_cols = ["profession", "month_year"]
+        shard_sketches = [
+            qs.GroupedQuantileSketch(group_cols, seed=seed).update(
+                shard, "inflation_adj_min_salary"
+            )
+            for shard in np.array_split(all_jobs_clean, 2)
+        ]
+        with tempfile.TemporaryDirectory() as sketch_dir:
+            sketch_path = os.path.join(sketch_dir, "quantile_sketch.json")
+            shard_sketches[1].save(sketch_path)
+            merged = shard_sketches[0].merge(qs.GroupedQuantileSketch.load(sketch_path))
+        return merged.quantiles()
+
+    benchmark(
+        "merge_saved_quantile_sketches",
+        merge_saved_quantile_sketches,
+        len(all_jobs_clean),
+    )
+    benchmark(
+        "top_skills_per_profession",
+        lambda: sa.get_top_skills_per_profession(all_skills),
+        len(all_skills),
+    )
+    benchmark(
+        "skill_similarity_matrix",
+        lambda: sa.get_skill_similarity_matrix(all_skills),
+        len(all_skills),
+    )
+
+    metadata = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": get_git_commit(),
+        "n_adverts": n_adverts,
+        "seed": seed,
+        "repeats": repeats,
+        "python_version": platform.python_version(),
+        "pandas_version": pd.__version__,
+        "numpy_version": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "worker_counts": worker_counts,
+    }
+
+    return {
+        "metadata": metadata,
+        "benchmarks": results,
+        "parallel_speedups": get_parallel_speedups(results, worker_counts),
+    }
+
+
+def compare_benchmarks(
+    baseline: Dict, current: Dict, tolerance: float = regression_tolerance
+) -> pd.DataFrame:
+    """Compare benchmark results against a baseline.
+
+    Args:
+        baseline (Dict): Baseline benchmark results.
+        current (Dict): Current benchmark results.
+        tolerance (float, optional): Relative slow down allowed before a
+            benchmark is a regression. Defaults to regression_tolerance.
+
+    Returns:
+        pd.DataFrame: Baseline and current seconds, their ratio and whether
+            each benchmark regressed.
+    """
+    comparison = pd.DataFrame(
+        {
+            "baseline_seconds": {
+                name: result["seconds"]
+                for name, result in baseline["benchmarks"].items()
+            },
+            "current_seconds": {
+                name: result["seconds"]
+                for name, result in current["benchmarks"].items()
+            },
+        }
+    )
+    comparison["ratio"] = comparison["current_seconds"] / comparison["baseline_seconds"]
+    comparison["is_regression"] = comparison["ratio"] > 1 + tolerance
+
+    return comparison
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--n-adverts", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--n-qualification-descriptions", type=int, default=1_000)
+    parser.add_argument("--skip", nargs="*", default=[])
+    parser.add_argument(
+        "--n-workers",
+        type=int,
+        nargs="*",
+        help="Numbers of workers to time process pool benchmarks with",
+    )
+    parser.add_argument("--output-path", default=benchmark_output_path)
+    parser.add_argument("--baseline", help="Benchmark results json to compare to")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmarks(
+        n_adverts=args.n_adverts,
+        seed=args.seed,
+        repeats=args.repeats,
+        n_qualification_descriptions=args.n_qualification_descriptions,
+        skip=args.skip,
+        worker_counts=args.n_workers,
+    )
+
+    os.makedirs(args.output_path, exist_ok=True)
+    results_path = os.path.join(
+        args.output_path,
+        f"benchmarks_{args.n_adverts}_{datetime.now():%Y%m%d_%H%M%S}.json",
+    )
+    with open(results_path, "w") as f:
+        json.dump(benchmark_results, f, indent=4)
+    logger.info(f"Saved benchmark results to {results_path}")
+
+    for name, speedups in benchmark_results["parallel_speedups"].items():
+        for n_workers, speedup in speedups.items():
+            logger.info(f"{name}: {speedup:.2f}x speedup with {n_workers} workers")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline_results = json.load(f)
+        print(compare_benchmarks(baseline_results, benchmark_results).to_string())
@@ -0,0 +1,438 @@
+"""
+Functions to generate synthetic OJO data for benchmarking.
+
+Synthetic job adverts, salaries, locations, skills and descriptions share the
+schemas of the ojd_daps extracts, and mix EYP, similar and unrelated adverts
+so every filter and enrichment in the pipeline does real work. Tables are
+generated with vectorised draws from small vocabularies, and can be generated
+in chunks of ids to write 50M+ adverts to parquet without holding them all
+in memory.
+"""
+import os
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from afs_early_years_labour_market_analysis import logger
+from afs_early_years_labour_market_analysis.pipeline.data_collection.refine_relevant_jobs import (
+    eyp_job_titles,
+    eyp_occupation_titles,
+    job_titles_to_match_on,
+    relevant_knowledge_domains,
+    relevant_occupations,
+    relevant_parent_sectors,
+    relevant_sectors,
+)
+from afs_early_years_labour_market_analysis.utils.geography import itl_1_regions
+
+# share of EYP, similar and unrelated adverts
+advert_type_shares = {"eyp": 0.05, "similar": 0.2, "other": 0.75}
+
+other_job_titles = [
+    "care assistant",
+    "support worker",
+    "warehouse operative",
+    "delivery driver",
+    "software engineer",
+    "accountant",
+    "registered nurse",
+    "chef de partie",
+    "customer service advisor",
+    "administrator",
+    "project manager",
+    "cleaner",
+]
+other_occupations = [
+    "Care Assistant",
+    "Warehouse Operative",
+    "Software Developer",
+    "Accountant",
+    "Nurse",
+    "Chef",
+    "Administrator",
+]
+other_sectors = ["Healthcare", "Logistics", "IT", "Finance", "Admin", "Catering"]
+other_parent_sectors = ["Health", "Transport", "IT &amp; Telecoms", "Accountancy"]
+other_knowledge_domains = ["Health", "Engineering", "Business", "Computing"]
+eyp_sectors = ["Nursery", "Nursery Nurse", "Childcare", "Other Education"]
+
+# variants of job titles as they appear in raw adverts
+job_title_prefixes = ["", "", "", "Senior ", "Trainee ", "Aspiring "]
+job_title_suffixes = ["", "", "", " - Level 3", " (Full Time)", " 2023", "!"]
+
+description_sentences = [
+    "We are looking for a caring and enthusiastic practitioner to join our team.",
+    "You will hold a Level 3 qualification in childcare.",
+    "Applicants must have a level 2 qualification or above.",
+    "A relevant degree and QTS are essential.",
+    "You must hold EYTS or QTS.",
+    "NVQ 3 or equivalent is desirable.",
+    "The successful candidate will have a CACHE 3 diploma.",
+    "Experience of the EYFS is essential.",
+    "Competitive salary and 28 days holiday.",
+    "Free training and career progressionOpportunities to grow.",
+    "• Free childcare • Pension scheme • Staff discounts",
+    "We are an Ofsted rated Outstanding nursery.",
+    "Full time, Monday to Friday: 8am-6pm.",
+    "You will plan engaging activities for children aged 0-5.",
+    "Please apply with your CV [no agencies].",
+    "Our company is a leading retailer with stores across the UK.",
+    "Serve food & drink to customers in a busy restaurant.",
+]
+
+# qualifications matched by utils.data_enrichment.get_qualification_level
+qualifications = ["QTS", "EYTS", "PGCE", "NNEB", "a foundation degree", "QTLS"]
+
+# skills, with a long esco_id, and skill groups, with a short esco_id
+skill_labels = [
+    "communication",
+    "childcare",
+    "teamwork",
+    "safeguarding",
+    "customer service",
+    "planning",
+    "first aid",
+    "teaching",
+    "food hygiene",
+    "cash handling",
+    "leadership",
+    "literacy",
+    "numeracy",
+    "patience",
+    "creativity",
+    "time management",
+    "special educational needs",
+    "sales",
+    "stock control",
+    "computer literacy",
+]
+
+towns = [
+    "Manchester",
+    "Leeds",
+    "Birmingham",
+    "Bristol",
+    "London",
+    "Camden",
+    "Cardiff",
+    "Glasgow",
+    "Belfast",
+    "Norwich",
+    "Brighton",
+    "Newcastle",
+    "Nottingham",
+    "Sheffield",
+]
+
+
+def _choice(rng: np.random.Generator, values: list, size: int) -> np.ndarray:
+    """Draw values uniformly at random as an object array."""
+    return np.asarray(values, dtype=object)[rng.integers(0, len(values), size)]
+
+
+def get_itl_3_codes(n_per_region: int = 6) -> pd.DataFrame:
+    """Get synthetic ITL 3 codes and names, in the old UK and new TL formats.
+
+    Args:
+        n_per_region (int, optional): ITL 3 codes per ITL 1 region.
+            Defaults to 6.
+
+    Returns:
+        pd.DataFrame: itl_3_code and itl_3_name columns.
+    """
+    itl_3_codes = []
+    for itl_1_code, region in itl_1_regions.items():
+        for i in range(n_per_region):
+            # alternate between old (UK) and new (TL) code prefixes
+            prefix = "TL" if i % 2 else "UK"
+            itl_3_codes.append(
+                {
+                    "itl_3_code": f"{prefix}{itl_1_code[2]}{i // 3 + 1}{i % 3 + 1}",
+                    "itl_3_name": region if region == "London" else f"{region} {i + 1}",
+                }
+            )
+
+    return pd.DataFrame(itl_3_codes)
+
+
+def generate_job_adverts(
+    n_adverts: int, seed: int = 42, id_offset: int = 0
+) -> pd.DataFrame:
+    """Generate synthetic raw job adverts.
+
+    Args:
+        n_adverts (int): Number of job adverts.
+        seed (int, optional): Random seed. Defaults to 42.
+        id_offset (int, optional): First advert id, to generate adverts in
+            chunks. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: Job adverts with the schema of the adverts extract.
+    """
+    rng = np.random.default_rng([seed, id_offset])
+    advert_types = rng.choice(
+        list(advert_type_shares), size=n_adverts, p=list(advert_type_shares.values())
+    )
+    vocabularies = {
+        "eyp": (eyp_job_titles, eyp_occupation_titles, eyp_sectors),
+        "similar": (job_titles_to_match_on, relevant_occupations, relevant_sectors),
+        "other": (other_job_titles, other_occupations, other_sectors),
+    }
+
+    job_titles = np.empty(n_adverts, dtype=object)
+    occupations = np.empty(n_adverts, dtype=object)
+    sectors = np.empty(n_adverts, dtype=object)
+    for advert_type, (titles, type_occupations, type_sectors) in vocabularies.items():
+        is_type = advert_types == advert_type
+        n_type = int(is_type.sum())
+        job_titles[is_type] = _choice(rng, titles, n_type)
+        # adverts only sometimes carry an occupation or sector of their type
+        occupations[is_type] = np.where(
+            rng.random(n_type) < 0.5,
+            _choice(rng, type_occupations, n_type),
+            _choice(rng, other_occupations, n_type),
+        )
+        sectors[is_type] = np.where(
+            rng.random(n_type) < 0.5,
+            _choice(rng, type_sectors, n_type),
+            _choice(rng, other_sectors, n_type),
+        )
+
+    # mix the case of job titles and add prefixes and suffixes
+    is_title_case = rng.random(n_adverts) < 0.7
+    job_titles = pd.Series(job_titles).where(
+        ~is_title_case, pd.Series(job_titles).str.title()
+    )
+    job_titles = (
+        _choice(rng, job_title_prefixes, n_adverts)
+        + job_titles.values
+        + _choice(rng, job_title_suffixes, n_adverts)
+    )
+
+    dates = pd.date_range("2021-01-01", "2023-06-30").strftime("%Y-%m-%d")
+
+    return pd.DataFrame(
+        {
+            "id": np.arange(id_offset, id_offset + n_adverts),
+            "job_title_raw": job_titles,
+            "job_location_raw": _choice(rng, towns, n_adverts),
+            "created": _choice(rng, list(dates), n_adverts),
+            "occupation": occupations,
+            "sector": sectors,
+            "parent_sector": _choice(
+                rng, relevant_parent_sectors + other_parent_sectors, n_adverts
+            ),
+            "knowledge_domain": _choice(
+                rng, relevant_knowledge_domains + other_knowledge_domains, n_adverts
+            ),
+        }
+    )
+
+
+def generate_salaries(job_adverts: pd.DataFrame, seed: int = 42) -> pd.DataFrame:
+    """Generate synthetic annualised salaries of job adverts.
+
+    Args:
+        job_adverts (pd.DataFrame): Job adverts.
+        seed (int, optional): Random seed. Defaults to 42.
+
+    Returns:
+        pd.DataFrame: Salaries with the schema of the salaries extract.
+    """
+    rng = np.random.default_rng([seed, int(job_adverts["id"].iloc[0]), 1])
+    n_adverts = len(job_adverts)
+    min_salary = np.round(rng.lognormal(np.log(22000), 0.3, n_adverts), 2)
+    max_salary = np.round(min_salary * (1 + rng.uniform(0, 0.3, n_adverts)), 2)
+    # some adverts have no salary, or a zero salary
+    has_salary = rng.random(n_adverts) < 0.8
+    is_zero = rng.random(n_adverts) < 0.01
+
+    return pd.DataFrame(
+        {
+            "id": job_adverts["id"].values,
+            "min_annualised_salary": np.where(
+                has_salary, np.where(is_zero, 0, min_salary), np.nan
+            ),
+            "max_annualised_salary": np.where(
+                has_salary, np.where(is_zero, 0, max_salary), np.nan
+            ),
+        }
+    )
+
+
+def generate_locations(job_adverts: pd.DataFrame, seed: int = 42) -> pd.DataFrame:
+    """Generate synthetic ITL 3 locations of job adverts.
+
+    Args:
+        job_adverts (pd.DataFrame): Job adverts.
+        seed (int, optional): Random seed. Defaults to 42.
+
+    Returns:
+        pd.DataFrame: Locations with the schema of the locations extract.
+    """
+    rng = np.random.default_rng([seed, int(job_adverts["id"].iloc[0]), 2])
+    n_adverts = len(job_adverts)
+    itl_3_codes = get_itl_3_codes()
+    location_codes = rng.integers(0, len(itl_3_codes), n_adverts)
+    # some adverts cannot be located
+    is_located = rng.random(n_adverts) < 0.95
+
+    locations = pd.DataFrame(
+        {
+            "id": job_adverts["id"].values,
+            "job_location_raw": job_adverts["job_location_raw"].values,
+            "itl_3_code": itl_3_codes["itl_3_code"].values[location_codes],
+            "itl_3_name": itl_3_codes["itl_3_name"].values[location_codes],
+            "is_large_geo": rng.random(n_adverts) < 0.1,
+        }
+    )
+    locations.loc[~is_located, ["itl_3_code", "itl_3_name"]] = None
+    locations.insert(
+        2, "location", locations["job_location_raw"] + ", " + locations["itl_3_name"]
+    )
+
+    return locations
+
+
+def generate_skills(
+    job_adverts: pd.DataFrame, mean_skills: float = 8, seed: int = 42
+) -> pd.DataFrame:
+    """Generate synthetic skills of job adverts.
+
+    Args:
+        job_adverts (pd.DataFrame): Job adverts.
+        mean_skills (float, optional): Mean number of skills per advert.
+            Defaults to 8.
+        seed (int, optional): Random seed. Defaults to 42.
+
+    Returns:
+        pd.DataFrame: Skills with the schema of the skills extract, one row
+            per skill per advert.
+    """
+    rng = np.random.default_rng([seed, int(job_adverts["id"].iloc[0]), 3])
+    n_skills = rng.poisson(mean_skills, len(job_adverts))
+    skill_ids = np.array(
+        [f"http://data.europa.eu/esco/skill/{i:08d}" for i in range(len(skill_labels))]
+        + [f"S{i}.{i}" for i in range(1, 5)],
+        dtype=object,
+    )
+    labels = np.array(skill_labels + [f"skill group {i}" for i in range(1, 5)])
+    # a few skills are much more common than others
+    popularity = 1 / np.arange(1, len(skill_ids) + 1)
+    skill_codes = rng.choice(
+        len(skill_ids), size=n_skills.sum(), p=popularity / popularity.sum()
+    )
+
+    return pd.DataFrame(
+        {
+            "id": np.repeat(job_adverts["id"].values, n_skills),
+            "esco_id": skill_ids[skill_codes],
+            "esco_label": labels[skill_codes],
+        }
+    )
+
+
+def generate_descriptions(
+    job_adverts: pd.DataFrame, n_sentences: int = 6, seed: int = 42
+) -> pd.DataFrame:
+    """Generate synthetic job descriptions, mentioning qualifications.
+
+    Args:
+        job_adverts (pd.DataFrame): Job adverts.
+        n_sentences (int, optional): Sentences per description. Defaults to 6.
+        seed (int, optional): Random seed. Defaults to 42.
+
+    Returns:
+        pd.DataFrame: Job advert ids and descriptions.
+    """
+    rng = np.random.default_rng([seed, int(job_adverts["id"].iloc[0]), 4])
+    n_adverts = len(job_adverts)
+    qualification_sentences = [
+        f"{qualification} is required." for qualification in qualifications
+    ]
+    sentences = description_sentences + qualification_sentences
+
+    descriptions = _choice(rng, sentences, n_adverts)
+    for _ in range(n_sentences - 1):
+        descriptions = descriptions + " " + _choice(rng, sentences, n_adverts)
+
+    return pd.DataFrame(
+        {"id": job_adverts["id"].values, "description": descriptions.astype(str)}
+    )
+
+
+def generate_rural_urban_nuts() -> pd.DataFrame:
+    """Generate a synthetic rural/urban classification of NUTS 3 regions.
+
+    Returns:
+        pd.DataFrame: Classification with the schema of rural_urban_nuts.csv.
+    """
+    itl_3_codes = get_itl_3_codes()["itl_3_code"]
+    nuts_codes = itl_3_codes.str.replace("^TL", "UK", regex=True).drop_duplicates()
+    is_urban = np.arange(len(nuts_codes)) % 3 != 0
+
+    return pd.DataFrame(
+        {
+            "NUTS315CD": nuts_codes.values,
+            "RUC11CD": np.where(is_urban, "4", "1"),
+            "RUC11": np.where(
+                is_urban, "Urban with Significant Rural", "Predominantly Rural"
+            ),
+            "Broad_RUC11": np.where(is_urban, "Urban", "Rural"),
+        }
+    )
+
+
+def generate_ojo_data(
+    n_adverts: int, seed: int = 42, id_offset: int = 0
+) -> Dict[str, pd.DataFrame]:
+    """Generate every synthetic OJO table for a number of job adverts.
+
+    Args:
+        n_adverts (int): Number of job adverts.
+        seed (int, optional): Random seed. Defaults to 42.
+        id_offset (int, optional): First advert id. Defaults to 0.
+
+    Returns:
+        Dict[str, pd.DataFrame]: job_adverts, salaries, locations, skills,
+            descriptions and rural_urban_nuts tables.
+    """
+    job_adverts = generate_job_adverts(n_adverts, seed, id_offset)
+
+    return {
+        "job_adverts": job_adverts,
+        "salaries": generate_salaries(job_adverts, seed),
+        "locations": generate_locations(job_adverts, seed),
+        "skills": generate_skills(job_adverts, seed=seed),
+        "descriptions": generate_descriptions(job_adverts, seed=seed),
+        "rural_urban_nuts": generate_rural_urban_nuts(),
+    }
+
+
+def save_ojo_data(
+    n_adverts: int, output_path: str, chunk_size: int = 1_000_000, seed: int = 42
+):
+    """Generate synthetic OJO tables in chunks and save them as parquet parts.
+
+    Args:
+        n_adverts (int): Number of job adverts.
+        output_path (str): Directory to save a folder of parquet parts per
+            table to.
+        chunk_size (int, optional): Job adverts per chunk.
+            Defaults to 1_000_000.
+        seed (int, optional): Random seed. Defaults to 42.
+    """
+    for chunk, id_offset in enumerate(range(0, n_adverts, chunk_size)):
+        ojo_data = generate_ojo_data(
+            min(chunk_size, n_adverts - id_offset), seed, id_offset
+        )
+        for table_name, table in ojo_data.items():
+            if table_name == "rural_urban_nuts" and chunk > 0:
+                continue
+            table_path = os.path.join(output_path, table_name)
+            os.makedirs(table_path, exist_ok=True)
+            table.to_parquet(
+                os.path.join(table_path, f"part_{chunk:05d}.parquet"), index=False
+            )
+        logger.info(f"Saved {id_offset + len(ojo_data['job_adverts'])} adverts ...")
@@ -3,6 +3,8 @@ import json
 import pickle
 import gzip
 import os
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import quote
 
 import pandas as pd
 from pandas import DataFrame
@@ -94,6 +96,10 @@ def save_to_s3(bucket_name, output_var, output_file_dir):
         output_var.to_csv("s3://" + bucket_name + "/" + output_file_dir, index=False)
     elif fnmatch(output_file_dir, "*.pkl") or fnmatch(output_file_dir, "*.pickle"):
         obj.put(Body=pickle.dumps(output_var))
+    elif fnmatch(output_file_dir, "*.parquet"):
+        output_var.to_parquet(
+            "s3://" + bucket_name + "/" + output_file_dir, index=False
+        )
     elif fnmatch(output_file_dir, "*.gz"):
         obj.put(Body=gzip.compress(json.dumps(output_var).encode()))
     elif fnmatch(output_file_dir, "*.txt"):
@@ -155,6 +161,188 @@ def load_s3_data(bucket_name, file_name):
         )
 
 
+def add_date_partition_cols(df: DataFrame, date_col: str = "created") -> DataFrame:
+    """Add integer year and month columns to partition a dataset by.
+
+    Args:
+        df (DataFrame): DataFrame with a date column.
+        date_col (str, optional): Date column. Defaults to "created".
+
+    Returns:
+        DataFrame: df with year and month columns.
+    """
+    dates = pd.to_datetime(df[date_col])
+
+    return df.assign(year=dates.dt.year.astype(int), month=dates.dt.month.astype(int))
+
+
+def get_date_partition_filters(min_date: str) -> List[List[Tuple]]:
+    """Get parquet filters selecting the year/month partitions from a date on.
+
+    Args:
+        min_date (str): Earliest date, e.g. "2021-04-01".
+
+    Returns:
+        List[List[Tuple]]: Filters in disjunctive normal form.
+    """
+    min_date = pd.Timestamp(min_date)
+
+    return [
+        [("year", ">", min_date.year)],
+        [("year", "==", min_date.year), ("month", ">=", min_date.month)],
+    ]
+
+
+def save_parquet_dataset(
+    df: DataFrame,
+    dataset_path: str,
+    partition_cols: List[str],
+    sort_cols: List[str] = [],
+    max_rows_per_group: int = 1_000_000,
+):
+    """Save a DataFrame as a hive partitioned parquet dataset.
+
+    Partitions in df replace their existing files, while other partitions are
+    left untouched, so new partitions (e.g. months) can be appended without
+    rewriting the rest of the dataset. Rows are sorted within each partition so
+    row group statistics can be used to skip row groups when reading.
+
+    Args:
+        df (DataFrame): DataFrame to save.
+        dataset_path (str): Local or s3 directory of the dataset.
+        partition_cols (List[str]): Columns to partition by, in order.
+        sort_cols (List[str], optional): Columns to sort rows by within each
+            partition. Defaults to [].
+        max_rows_per_group (int, optional): Maximum rows per parquet row group.
+            Defaults to 1_000_000.
+    """
+    import fsspec
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    fs, path = fsspec.core.url_to_fs(dataset_path)
+    table = pa.Table.from_pandas(
+        df.sort_values(partition_cols + sort_cols), preserve_index=False
+    )
+    ds.write_dataset(
+        table,
+        path,
+        filesystem=fs,
+        format="parquet",
+        partitioning=partition_cols,
+        partitioning_flavor="hive",
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching",
+        max_rows_per_group=max_rows_per_group,
+    )
+    logger.info(
+        f"Saved {len(df)} rows to {dataset_path} partitioned by {partition_cols}"
+    )
+
+
+def load_parquet_dataset(
+    dataset_path: str,
+    filters: Optional[List] = None,
+    columns: Optional[List[str]] = None,
+) -> DataFrame:
+    """Load a hive partitioned parquet dataset, only reading the partitions and
+    row groups that match filters.
+
+    Args:
+        dataset_path (str): Local or s3 directory of the dataset.
+        filters (Optional[List], optional): Parquet filters, e.g.
+            [("sector", "in", ["Waiter"]), ("year", ">=", 2022)]. Defaults to
+            None, to load the whole dataset.
+        columns (Optional[List[str]], optional): Columns to load. Defaults to
+            None, to load all columns.
+
+    Returns:
+        DataFrame: Loaded data. Partition columns are categoricals.
+    """
+    return pd.read_parquet(dataset_path, filters=filters, columns=columns)
+
+
+def upsert_parquet_dataset(
+    df: DataFrame,
+    dataset_path: str,
+    partition_cols: List[str],
+    sort_cols: List[str] = [],
+    key_col: str = "id",
+    keys: Optional[Iterable] = None,
+):
+    """Insert or replace rows of a hive partitioned parquet dataset by key.
+
+    Only the partitions holding rows of df, or old versions of them, are read
+    and rewritten, so the cost of an upsert is proportional to the size of the
+    partitions it touches rather than the whole dataset.
+
+    Args:
+        df (DataFrame): New and updated rows.
+        dataset_path (str): Local or s3 directory of the dataset.
+        partition_cols (List[str]): Columns the dataset is partitioned by.
+        sort_cols (List[str], optional): Columns to sort rows by within each
+            partition. Defaults to [].
+        key_col (str, optional): Column identifying rows to replace.
+            Defaults to "id".
+        keys (Optional[Iterable], optional): Keys whose existing rows are
+            replaced, e.g. when a key has several or no rows in df.
+            Defaults to the keys of df.
+    """
+    import fsspec
+
+    fs, path = fsspec.core.url_to_fs(dataset_path)
+    keys = df[key_col].unique() if keys is None else pd.unique(pd.Series(keys))
+    if df.empty and len(keys) == 0:
+        logger.info(f"No rows to upsert into {dataset_path}")
+        return
+    if not fs.exists(path):
+        save_parquet_dataset(df, dataset_path, partition_cols, sort_cols)
+        return
+
+    existing_keys = load_parquet_dataset(
+        dataset_path, columns=[key_col] + partition_cols
+    )
+    # partition columns load as categoricals, so restore df's dtypes
+    for col in partition_cols:
+        existing_keys[col] = existing_keys[col].astype(df[col].dtype)
+    partitions = pd.concat(
+        [
+            df[partition_cols],
+            existing_keys.loc[existing_keys[key_col].isin(keys), partition_cols],
+        ]
+    ).drop_duplicates()
+    if partitions.empty:
+        logger.info(f"None of the keys to upsert are in {dataset_path}")
+        return
+
+    existing = load_parquet_dataset(
+        dataset_path,
+        filters=[
+            [(col, "==", value) for col, value in zip(partition_cols, partition)]
+            for partition in partitions.itertuples(index=False)
+        ],
+    )
+    for col in partition_cols:
+        existing[col] = existing[col].astype(df[col].dtype)
+    upserted = pd.concat([existing[~existing[key_col].isin(keys)], df])
+
+    # partitions emptied by the upsert are deleted rather than rewritten
+    emptied = partitions.merge(
+        upserted[partition_cols].drop_duplicates(), how="left", indicator=True
+    ).query("_merge == 'left_only'")
+    for partition in emptied[partition_cols].itertuples(index=False):
+        partition_dir = "/".join(
+            f"{col}={quote(str(value), safe='')}"
+            for col, value in zip(partition_cols, partition)
+        )
+        fs.rm(f"{path.rstrip('/')}/{partition_dir}", recursive=True)
+
+    save_parquet_dataset(upserted, dataset_path, partition_cols, sort_cols)
+    logger.info(
+        f"Upserted {len(keys)} keys into {len(partitions)} partitions of {dataset_path}"
+    )
+
+
 def get_s3_data_paths(s3, bucket_name, root, file_types=["*.jsonl"]):
     """
     Get all paths to particular file types in a S3 root location
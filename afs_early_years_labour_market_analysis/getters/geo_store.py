@@ -0,0 +1,103 @@
+"""
+Getters for a local store of processed geometries.
+
+Processed GeoDataFrames are saved as GeoParquet files keyed by the URL of the
+source data and its version, so once the store is populated geometries load
+straight from disk without any network access.
+"""
+import hashlib
+import os
+from typing import Callable, Optional
+
+import geopandas as gpd
+
+from afs_early_years_labour_market_analysis import logger
+
+
+def get_geo_store_path(
+    store_path: str, name: str, source_url: str, version: str
+) -> str:
+    """Get the path of a stored GeoDataFrame.
+
+    Args:
+        store_path (str): Directory of the geometry store.
+        name (str): Name of the stored geometries.
+        source_url (str): URL the geometries were built from.
+        version (str): Version of the source data or processing.
+
+    Returns:
+        str: Path to the GeoParquet file.
+    """
+    source_key = hashlib.sha1(f"{source_url}|{version}".encode()).hexdigest()[:12]
+    return os.path.join(store_path, f"{name}_{version}_{source_key}.parquet")
+
+
+def load_geo_store(
+    store_path: str, name: str, source_url: str, version: str
+) -> Optional[gpd.GeoDataFrame]:
+    """Load a stored GeoDataFrame, if it exists.
+
+    Args:
+        store_path (str): Directory of the geometry store.
+        name (str): Name of the stored geometries.
+        source_url (str): URL the geometries were built from.
+        version (str): Version of the source data or processing.
+
+    Returns:
+        Optional[gpd.GeoDataFrame]: Stored geometries, or None if not stored.
+    """
+    geo_path = get_geo_store_path(store_path, name, source_url, version)
+    if os.path.exists(geo_path):
+        return gpd.read_parquet(geo_path)
+
+
+def save_geo_store(
+    geo_df: gpd.GeoDataFrame, store_path: str, name: str, source_url: str, version: str
+):
+    """Save a processed GeoDataFrame to the store.
+
+    Args:
+        geo_df (gpd.GeoDataFrame): Processed geometries.
+        store_path (str): Directory of the geometry store.
+        name (str): Name of the stored geometries.
+        source_url (str): URL the geometries were built from.
+        version (str): Version of the source data or processing.
+    """
+    os.makedirs(store_path, exist_ok=True)
+    geo_path = get_geo_store_path(store_path, name, source_url, version)
+    geo_df.to_parquet(geo_path, index=False)
+    logger.info(f"Saved {name} geometries to {geo_path} ...")
+
+
+def get_stored_geometries(
+    build_geometries: Callable[[], gpd.GeoDataFrame],
+    store_path: str,
+    name: str,
+    source_url: str,
+    version: str,
+    refresh: bool = False,
+) -> gpd.GeoDataFrame:
+    """Load geometries from the store, building and storing them if missing.
+
+    Args:
+        build_geometries (Callable[[], gpd.GeoDataFrame]): Function to build the
+            geometries from source_url if they are not stored.
+        store_path (str): Directory of the geometry store.
+        name (str): Name of the stored geometries.
+        source_url (str): URL the geometries are built from.
+        version (str): Version of the source data or processing.
+        refresh (bool, optional): Whether to rebuild stored geometries.
+            Defaults to False.
+
+    Returns:
+        gpd.GeoDataFrame: Processed geometries.
+    """
+    if not refresh:
+        geo_df = load_geo_store(store_path, name, source_url, version)
+        if geo_df is not None:
+            return geo_df
+
+    geo_df = build_geometries()
+    save_geo_store(geo_df, store_path, name, source_url, version)
+
+    return geo_df
@@ -2,10 +2,26 @@
 Getters for OJD DAPS data
 """
 import pandas as pd
-from typing import Mapping, Union, Dict, List
+from typing import Mapping, Union, Dict, List, Optional
 from afs_early_years_labour_market_analysis import BUCKET_NAME
 
-from afs_early_years_labour_market_analysis.getters.data_getters import load_s3_data
+from afs_early_years_labour_market_analysis.getters.data_getters import (
+    load_parquet_dataset,
+    load_s3_data,
+)
+
+# enriched job adverts and skills are parquet datasets partitioned by
+# enriched_partition_cols
+enriched_eyp_job_adverts_path = (
+    "inputs/ojd_daps_extract/enriched_relevant_job_adverts_eyp/"
+)
+enriched_sim_job_adverts_path = (
+    "inputs/ojd_daps_extract/enriched_relevant_job_adverts_sim_occs/"
+)
+eyp_skills_path = "inputs/ojd_daps_extract/relevant_skills_eyp/"
+sim_skills_path = "inputs/ojd_daps_extract/relevant_skills_sim_occs/"
+
+enriched_partition_cols = ["sector", "year", "month"]
 
 
 def get_job_adverts() -> pd.DataFrame:
@@ -56,34 +72,33 @@ def get_skills() -> pd.DataFrame:
     )
 
 
-def get_eyp_relevant_enriched_job_adverts() -> pd.DataFrame:
-    """Returns dataframe of relevant enriched job adverts for EYP job ads"""
-    return load_s3_data(
-        BUCKET_NAME,
-        "inputs/ojd_daps_extract/enriched_relevant_job_adverts_eyp.parquet",
+def get_eyp_relevant_enriched_job_adverts(
+    filters: Optional[List] = None,
+) -> pd.DataFrame:
+    """Returns dataframe of relevant enriched job adverts for EYP job ads,
+    optionally only from the sector/year/month partitions matching filters"""
+    return load_parquet_dataset(
+        f"s3://{BUCKET_NAME}/{enriched_eyp_job_adverts_path}", filters
     )
 
 
-def get_similar_enriched_job_adverts() -> pd.DataFrame:
-    """Returns dataframe of relevant enriched job adverts for similar job ads"""
-
-    return load_s3_data(
-        BUCKET_NAME,
-        "inputs/ojd_daps_extract/enriched_relevant_job_adverts_sim_occs.parquet",
+def get_similar_enriched_job_adverts(
+    filters: Optional[List] = None,
+) -> pd.DataFrame:
+    """Returns dataframe of relevant enriched job adverts for similar job ads,
+    optionally only from the sector/year/month partitions matching filters"""
+    return load_parquet_dataset(
+        f"s3://{BUCKET_NAME}/{enriched_sim_job_adverts_path}", filters
     )
 
 
-def get_eyp_relevant_skills() -> pd.DataFrame:
-    """Returns dataframe of relevant skills from EYP job ads"""
-    return load_s3_data(
-        BUCKET_NAME,
-        "inputs/ojd_daps_extract/relevant_skills_eyp.parquet",
-    )
+def get_eyp_relevant_skills(filters: Optional[List] = None) -> pd.DataFrame:
+    """Returns dataframe of relevant skills from EYP job ads, optionally only
+    from the sector/year/month partitions matching filters"""
+    return load_parquet_dataset(f"s3://{BUCKET_NAME}/{eyp_skills_path}", filters)
 
 
-def get_similar_skills() -> pd.DataFrame:
-    """Returns dataframe of relevant skills from similar job ads"""
-    return load_s3_data(
-        BUCKET_NAME,
-        "inputs/ojd_daps_extract/relevant_skills_sim_occs.parquet",
-    )
+def get_similar_skills(filters: Optional[List] = None) -> pd.DataFrame:
+    """Returns dataframe of relevant skills from similar job ads, optionally only
+    from the sector/year/month partitions matching filters"""
+    return load_parquet_dataset(f"s3://{BUCKET_NAME}/{sim_skills_path}", filters)
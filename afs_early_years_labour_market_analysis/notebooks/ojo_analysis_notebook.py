@@ -12,10 +12,17 @@
 
 
 # import relevant libraries
-import afs_early_years_labour_market_analysis.getters.ojd_daps as od
 import afs_early_years_labour_market_analysis.analysis.analysis_utils as au
+import afs_early_years_labour_market_analysis.analysis.aggregate_cube as ac
+import afs_early_years_labour_market_analysis.analysis.chart_export as ce
+import afs_early_years_labour_market_analysis.analysis.demand_change as dch
+import afs_early_years_labour_market_analysis.analysis.duckdb_cube as dc
+import afs_early_years_labour_market_analysis.analysis.skills_analysis as sa
+import afs_early_years_labour_market_analysis.utils.advert_cleaning as cl
 from afs_early_years_labour_market_analysis import BUCKET_NAME
 from afs_early_years_labour_market_analysis.getters.data_getters import save_to_s3
+from afs_early_years_labour_market_analysis.utils.stage_runner import StageRunner
+from afs_early_years_labour_market_analysis.utils.time_index import TimeIndex
 
 import ojo_analysis_utils as oau
 import numpy as np
@@ -32,8 +39,10 @@ from colour import Color
 # In[3]:
 
 
-# disable max rows for altair graphs
-alt.data_transformers.disable_max_rows()
+# charts embed aggregates rather than job adverts, so keep a max rows guard.
+# Chart data is written once to content hashed files rather than inlined in
+# the notebook (or use alt.data_transformers.enable("data_server"))
+alt.data_transformers.enable("hashed_files", max_rows=au.chart_max_rows)
 
 
 # This notebook contains the graphs needed to expore the current staff shortage based on relevant online job adverts.
@@ -51,23 +60,86 @@ alt.data_transformers.disable_max_rows()
 # In[4]:
 
 
-# 0.1 Load datasets
-
-# First, load in Early Year Practitioner (EYP) and similar job adverts
-eyp_jobs = od.get_eyp_relevant_enriched_job_adverts()
-sim_jobs = od.get_similar_enriched_job_adverts()
-
-# concatenate the two dataframes then clean up the data
-all_jobs = pd.concat([eyp_jobs, sim_jobs]).rename(columns={"sector": "profession"})
+# 0.1 Define the data stages, each cached on disk and only rerun when its code,
+# parameters or upstream outputs change. Rerun a load stage with refresh=True
+# when the enriched job adverts or skills are updated.
+
+stages = (
+    StageRunner(oau.stage_cache_path)
+    # First, load in Early Year Practitioner (EYP) and similar job adverts,
+    # only reading the partitions of the professions and months analysed
+    .add_stage(
+        "jobs",
+        oau.load_job_adverts,
+        params={
+            "sample_fraction": oau.sample_fraction,
+            "professions_to_include": oau.professions_to_include,
+            "min_date": oau.min_date,
+        },
+    )
+    # Load in skills data
+    .add_stage("skills", oau.load_skills, inputs=["jobs"])
+    .add_stage(
+        "jobs_clean",
+        cl.clean_job_adverts,
+        inputs=["jobs"],
+        params={
+            "professions_to_include": oau.professions_to_include,
+            "min_date": oau.min_date,
+            "key_cols": oau.dedupe_cols,
+        },
+    )
+    .add_stage(
+        "jobs_inflation_adjusted",
+        oau.inflation_adjust_job_adverts,
+        inputs=["jobs_clean"],
+        params={"inflation_rate_dict": oau.inflation_rate_dict},
+    )
+    .add_stage("jobs_split", oau.split_job_adverts, inputs=["jobs_inflation_adjusted"])
+    .add_stage(
+        "skills_clean", oau.clean_skills, inputs=["skills", "jobs_inflation_adjusted"]
+    )
+    .add_stage(
+        "report_cube", ac.build_aggregate_cube, inputs=["jobs_inflation_adjusted"]
+    )
+    .add_stage(
+        "demand_change",
+        dch.get_demand_change,
+        inputs=["jobs_inflation_adjusted"],
+        params={"periods": oau.demand_periods, "group_cols": ["profession"]},
+    )
+)
 
-# Load in skills data
-eyp_skills = od.get_eyp_relevant_skills()
-sim_skills = od.get_similar_skills()
+# Optionally build the report cube with DuckDB directly over locally cached
+# enriched parquet files, without loading all job adverts into pandas. The
+# cache is synced with s3 first, and the cube is keyed by the synced files.
+# The DuckDB cube isn't sampled, so would not match the other tables
+if oau.use_duckdb_report_cube:
+    if oau.sample_fraction < 1:
+        raise ValueError(
+            "The DuckDB report cube covers all job adverts, so can't be used "
+            f"with sample_fraction = {oau.sample_fraction}. Set sample_fraction "
+            "to 1 or use_duckdb_report_cube to False"
+        )
+    enriched_dataset_paths, enriched_fingerprint = dc.cache_enriched_job_adverts(
+        oau.enriched_cache_path
+    )
+    stages.add_stage(
+        "report_cube",
+        dc.build_aggregate_cube_duckdb,
+        params={
+            "dataset_paths": enriched_dataset_paths,
+            "professions_to_include": oau.professions_to_include,
+            "inflation_rate_dict": oau.inflation_rate_dict,
+            "key_cols": oau.dedupe_cols,
+        },
+        fingerprint=enriched_fingerprint,
+    )
 
 
 # ### 0.2 Clean up the datasets
 # Clean up all job adverts by:
-# - dropping duplicates as defined by the job advert being posted on the same day, with the same title in the same location;
+# - dropping duplicates as defined by the job advert being posted on the same day, with the same title in the same location (or, with `oau.near_duplicate_dedupe`, having a near duplicate title and description in the same location);
 # - dropping adverts posted before april 2021;
 # - creating a series of time variables to allow for time series analysis;
 # - drop adverts that are not in England;
@@ -78,67 +150,17 @@ sim_skills = od.get_similar_skills()
 # In[5]:
 
 
-# 0.2 Clean up the dataset
-
-professions_to_include = [
-    "Early Years Practitioner",
-    "Primary School Teacher",
-    "Secondary School Teacher",
-    "Retail Assistant",
-    "Waiter",
-]
-
-all_jobs_clean = (
-    all_jobs.drop_duplicates(subset=["location", "job_title_raw", "created"])
-    # make sure its after april given feedback
-    .query("created >= '2021-04-01'")
-    # Create a series of time variables to help with analysis
-    .assign(created=lambda x: pd.to_datetime(x["created"]))
-    .assign(year=lambda x: x["created"].dt.year.astype(str))
-    .assign(month_year=lambda x: x["created"].dt.to_period("M"))
-    .assign(month_year=lambda x: pd.to_datetime(x["month_year"].astype(str)))
-    # flag whether in england or not
-    .assign(england_geo=lambda x: x["itl_3_code"].apply(oau.is_england_geo))
-    .query("england_geo == True")
-    .query("profession in @professions_to_include")
-    .drop(columns=["is_large_geo", "england_geo"])
-)
-
-# accomodate for inflation
-sal_cols = "min", "max"
-for col in sal_cols:
-    col_name = f"{col}_annualised_salary"
-    inflation_col_name = f"inflation_adj_{col}_salary"
-    all_jobs_clean[inflation_col_name] = all_jobs_clean.apply(
-        lambda x: oau.calculate_inflation_adjusted_salary(
-            original_salary=x[col_name], original_year=x.year
-        ),
-        axis=1,
-    )
-    all_jobs_clean[inflation_col_name] = all_jobs_clean[inflation_col_name].astype(
-        float
-    )
-#
+# 0.2 Run (or load) the cleaning stages
+
+all_jobs_clean = stages["jobs_inflation_adjusted"]
 
 # Now that we have cleaned up the data, we can re-split it into EYP and similar jobs
 # for future analysis
-eyp_jobs_clean = (
-    all_jobs_clean.query("profession == 'Early Years Practitioner'")
-    # make sure qualifications are only up to level 6
-    .query("qualification_level <= '6' | qualification_level.isna()").reset_index(
-        drop=True
-    )
-)
-
-sim_jobs_clean = all_jobs_clean.query(
-    "profession != 'Early Years Practitioner'"
-).reset_index(drop=True)
+eyp_jobs_clean = stages["jobs_split"]["eyp"]
+sim_jobs_clean = stages["jobs_split"]["sim"]
 
 # Clean up skills data
-id_2_profession_mapper = all_jobs_clean.set_index("id").profession.to_dict()
-all_skills = pd.concat([eyp_skills, sim_skills])
-all_skills["profession"] = all_skills.id.map(id_2_profession_mapper)
-all_skills.dropna(subset=["profession"], inplace=True)
+all_skills = stages["skills_clean"]
 
 
 # ## 1. Generate tables for report
@@ -174,6 +196,13 @@ low_sal = eyp_jobs_clean[eyp_jobs_clean.inflation_adj_max_salary < 15000]
 print(
     f"{len(low_sal)} or {round((len(low_sal)/len(eyp_jobs_clean))*100, 2)}% of jobs pay less than £15,000 per year"
 )
+print("")
+# cleaned adverts are sorted by date, so periods are sliced by binary search
+eyp_time_index = TimeIndex(eyp_jobs_clean)
+for start_date, end_date in [oau.early_date_range, oau.late_date_range]:
+    print(
+        f"there are {eyp_time_index.count(start_date, end_date)} EYP job adverts from {start_date} to before {end_date}"
+    )
 
 
 # In[7]:
@@ -187,27 +216,27 @@ for profession, profession_info in all_jobs_clean.groupby("profession"):
 # In[8]:
 
 
+# Build an aggregate cube of advert counts and salary quantiles per profession,
+# qualification level, month, region and job title. The report tables and
+# charts below are slices of the cube rather than groupbys over all adverts.
+
+report_cube = stages["report_cube"]
+
+report_cube_path = os.path.join(oau.output_table_path, "report_cube.parquet")
+save_to_s3(BUCKET_NAME, report_cube, report_cube_path)
+
+median_salary_cols = {
+    "inflation_adj_min_salary_q50": "Median Minimum Annualised Salary (£, March 2023 prices)",
+    "inflation_adj_max_salary_q50": "Median Maximum Annualised Salary (£, March 2023 prices)",
+    "advert_count": "Number of Job Adverts",
+}
+
+
 # Median annualised salary and advertisement count per profession table
 
-median_salary_profession = (
-    all_jobs_clean.groupby("profession")
-    .agg(
-        {
-            "id": "count",
-            "inflation_adj_min_salary": "median",
-            "inflation_adj_max_salary": "median",
-        }
-    )
-    .reset_index()
-    .rename(
-        columns={
-            "inflation_adj_min_salary": "Median Minimum Annualised Salary (£, March 2023 prices)",
-            "inflation_adj_max_salary": "Median Maximum Annualised Salary (£, March 2023 prices)",
-            "id": "Number of Job Adverts",
-            "profession": "Profession",
-        }
-    )
-)
+median_salary_profession = ac.slice_cube(report_cube, ["profession"])[
+    ["profession"] + list(median_salary_cols)
+].rename(columns={**median_salary_cols, "profession": "Profession"})
 
 # save table to s3
 median_salary_profession = median_salary_profession.astype(
@@ -229,23 +258,17 @@ save_to_s3(BUCKET_NAME, median_salary_profession, median_salary_profession_path)
 # Median annualised salary per qualification level table
 
 median_salary_qualification = (
-    eyp_jobs_clean.groupby("qualification_level")
-    .agg(
-        {
-            "id": "count",
-            "inflation_adj_min_salary": "median",
-            "inflation_adj_max_salary": "median",
-        }
-    )
-    .reset_index()
-    .rename(
-        columns={
-            "inflation_adj_min_salary": "Median Minimum Annualised Salary (£, March 2023 prices)",
-            "inflation_adj_max_salary": "Median Maximum Annualised Salary (£, March 2023 prices)",
-            "id": "Number of Job Adverts",
-            "profession": "Profession",
-        }
+    ac.slice_cube(
+        report_cube,
+        ["profession", "qualification_level"],
+        filters={"profession": ["Early Years Practitioner"]},
     )
+    # make sure qualifications are only up to level 6
+    .query("qualification_level <= '6'")[
+        ["qualification_level"] + list(median_salary_cols)
+    ]
+    .rename(columns=median_salary_cols)
+    .reset_index(drop=True)
 )
 
 median_salary_qualification_path = os.path.join(
@@ -260,13 +283,12 @@ save_to_s3(BUCKET_NAME, median_salary_qualification, median_salary_qualification
 # Top 10 most common job titles per profession table
 
 top_10_titles = (
-    all_jobs_clean.groupby("profession")
-    .agg({"job_title_raw": "value_counts"})
-    .rename(columns={"job_title_raw": "count"})
-    .groupby(level=0)
-    .head(10)
-    .reset_index()
-    .rename(columns={"job_title_raw": "job_title"})
+    ac.slice_cube(report_cube, ["profession", "job_title_raw"])
+    .sort_values(["profession", "advert_count"], ascending=[True, False])
+    .groupby("profession")
+    .head(10)[["profession", "job_title_raw", "advert_count"]]
+    .rename(columns={"job_title_raw": "job_title", "advert_count": "count"})
+    .reset_index(drop=True)
 )
 
 top_10_titles_path = os.path.join(
@@ -275,6 +297,20 @@ top_10_titles_path = os.path.join(
 save_to_s3(BUCKET_NAME, top_10_titles, top_10_titles_path)
 
 
+# In[ ]:
+
+
+# Percent change in advert counts and median salaries per profession from the
+# early to the late period, with 95% bootstrap confidence intervals
+
+demand_change_profession = stages["demand_change"]
+
+demand_change_profession_path = os.path.join(
+    oau.output_table_path, "demand_change_per_profession.csv"
+)
+save_to_s3(BUCKET_NAME, demand_change_profession, demand_change_profession_path)
+
+
 # ## 2. Generate Graphs
 #
 # ### 2.1 Graphs related to salaries
@@ -333,9 +369,7 @@ wage_ratio_df = (
     .reset_index()
     .rename(columns={"id": "count"})
 )
-wage_ratio_df["requires_degree"] = wage_ratio_df.qualification_level.apply(
-    lambda x: True if x == "6" else False
-)
+wage_ratio_df["requires_degree"] = wage_ratio_df.qualification_level.eq("6")
 wage_ratio_df = wage_ratio_df[wage_ratio_df.qualification_level.isin(["2", "3", "6"])]
 
 qual_sorted = ["6", "3", "2"]
@@ -378,7 +412,7 @@ qual_wage_ratio_line = qual_wage_ratio + wage_line
 
 qual_graph = qual_count | qual_wage_ratio_line
 
-au.configure_plots(
+qual_wage_ratio_graph = au.configure_plots(
     qual_graph,
     chart_title="Wage Ratio by Qualification Level",
     chart_subtitle=[
@@ -386,6 +420,7 @@ au.configure_plots(
         "level to the median salary for all EYP job adverts.",
     ],
 )
+qual_wage_ratio_graph
 
 
 # In[13]:
@@ -421,16 +456,13 @@ sal_sect_boxplot
 
 
 # Generate Median Salary by profession Over Time Graph
-monthly_profession_sal_count = (
-    all_jobs_clean.groupby(["profession", "month_year"])
-    .agg({"inflation_adj_min_salary": "median", "inflation_adj_max_salary": "median"})
-    .reset_index()
-    .rename(
-        columns={
-            "inflation_adj_min_salary": "Median Minimum Annualised Salary (£)",
-            "inflation_adj_max_salary": "Median Maximum Annualised Salary (£)",
-        }
-    )
+monthly_profession_sal_count = ac.slice_cube(
+    report_cube, ["profession", "month_year"]
+).rename(
+    columns={
+        "inflation_adj_min_salary_q50": "Median Minimum Annualised Salary (£)",
+        "inflation_adj_max_salary_q50": "Median Maximum Annualised Salary (£)",
+    }
 )
 
 monthly_profession_sal_count_melt = monthly_profession_sal_count.melt(
@@ -491,9 +523,9 @@ sal_sect_ts
 
 # Generate Rolling Average of Job Adverts Over time by profession Graph
 
-profession_count_created = (
-    all_jobs_clean.groupby(["profession", "created"]).size().reset_index(name="count")
-)
+profession_count_created = ac.slice_cube(report_cube, ["profession", "created"])[
+    ["profession", "created", "advert_count"]
+].rename(columns={"advert_count": "count"})
 
 profession_count_created["created"] = pd.to_datetime(
     profession_count_created["created"]
@@ -551,7 +583,7 @@ skill_profile_sims = (
 )
 skill_profile_sims[
     "skill_profile_similarity"
-] = skill_profile_sims.skill_profile_similarity.apply(lambda x: round(x[0][0], 2))
+] = skill_profile_sims.skill_profile_similarity.round(2)
 
 
 # In[18]:
@@ -673,43 +705,11 @@ sim_skills
 # In[20]:
 
 
-# Generate top skills at the skill level for all jobs
-
-skill2name_mapper = all_skills.set_index("esco_id").esco_label.to_dict()
-all_skills_count = (
-    all_skills.query("esco_id.str.len() > 10")
-    .groupby(["profession", "esco_id"])
-    .size()
-    .reset_index()
-    .rename(columns={0: "count"})
-)
-
-top_skills_per_profession = []
-for profession, profession_info in all_skills_count.groupby("profession"):
-    profession_info["job_ad_percent"] = (
-        profession_info["count"]
-        / all_skills.query(f"profession == '{profession}'").id.nunique()
-    ) * 100
-    top_skills_count = profession_info.sort_values(
-        by="job_ad_percent", ascending=False
-    ).head(10)
-    top_skills_per_profession.append(top_skills_count)
-top_skills_per_profession_df = pd.concat(top_skills_per_profession).reset_index(
-    drop=True
-)
-top_skills_per_profession_df["esco_label"] = top_skills_per_profession_df.esco_id.map(
-    skill2name_mapper
-)
+# Generate top skills at the skill level for all jobs, flagging whether each
+# skill is in the top 10 EYP skills
 
-# create flag for whether the skill is in the top 10 EYP skills for the profession
-top_skills_per_profession_df["in_eyp_top_skills"] = top_skills_per_profession_df.apply(
-    lambda x: True
-    if x.esco_label
-    in top_skills_per_profession_df[
-        top_skills_per_profession_df.profession == "Early Years Practitioner"
-    ].esco_label.unique()
-    else False,
-    axis=1,
+top_skills_per_profession_df = sa.get_top_skills_per_profession(
+    all_skills, k=10, reference_profession="Early Years Practitioner"
 )
 
 charts = []
@@ -727,7 +727,7 @@ for i in range(len(professions)):
             ),
             x=alt.X("job_ad_percent", title="% of Job Adverts"),
             color=alt.Color(
-                "in_eyp_top_skills",
+                "in_reference_top_skills",
                 title="In EYP Top Skills?",
                 scale=alt.Scale(
                     domain=[True, False],
@@ -740,7 +740,7 @@ for i in range(len(professions)):
 
 top_skills_barchart = alt.vconcat(*charts[:3]) | alt.vconcat(*charts[3:])
 
-au.configure_plots(
+top_skills_graph = au.configure_plots(
     top_skills_barchart,
     chart_title="Top Skills in Each Profession",
     chart_subtitle=[
@@ -749,3 +749,26 @@ au.configure_plots(
         " ",
     ],
 )
+top_skills_graph
+
+
+# ## 3. Export Graphs
+#
+# Save report graphs as images, skipping graphs that are unchanged since the
+# last export.
+
+# In[21]:
+
+
+report_charts = {
+    "eyp_sal_qual": sal_qual_boxplot,
+    "eyp_qual_wage_ratio": qual_wage_ratio_graph,
+    "sector_sal": sal_sect_boxplot,
+    "sector_sal_ts": sal_sect_ts,
+    "sector_count_ts": sect_count_ts,
+    "sector_skill_sim": sim_skills,
+    "top_skills_per_sector": top_skills_graph,
+}
+
+chart_exports = ce.export_charts(report_charts, oau.image_path)
+chart_exports
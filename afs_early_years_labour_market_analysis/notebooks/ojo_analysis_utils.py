@@ -1,7 +1,7 @@
 """
 Functions and variables for use in the OJO analysis notebook.
 """
-import re
+import numpy as np
 import pandas as pd
 from typing import Dict, Union
 import os
@@ -10,15 +10,65 @@ from zipfile import ZipFile
 import geopandas as gpd
 import altair as alt
 from typing import List, Dict
-from collections import Counter
-from sklearn.metrics.pairwise import cosine_similarity
 
 from afs_early_years_labour_market_analysis import PROJECT_DIR
+import afs_early_years_labour_market_analysis.analysis.analysis_utils as au
+import afs_early_years_labour_market_analysis.getters.data_getters as dg
+import afs_early_years_labour_market_analysis.getters.geo_store as gs
+import afs_early_years_labour_market_analysis.getters.ojd_daps as od
+import afs_early_years_labour_market_analysis.analysis.skills_analysis as sa
+import afs_early_years_labour_market_analysis.utils.advert_cleaning as cl
+import afs_early_years_labour_market_analysis.utils.geography as geo
+import afs_early_years_labour_market_analysis.utils.inflation as inf
+import afs_early_years_labour_market_analysis.utils.sampling as sp
 
 output_table_path = "outputs/ojo_analysis/report_tables/"
 
+# outputs of the notebook's data stages are cached locally
+stage_cache_path = str(PROJECT_DIR) + "/outputs/ojo_analysis/stage_cache/"
+
+# fraction of job adverts to sample, stratified by profession and month, for
+# fast development runs. Set to 1 to use all job adverts
+sample_fraction = 1.0
+
+# build the report cube with DuckDB over enriched parquet files cached here.
+# The DuckDB cube covers all job adverts, so needs sample_fraction = 1
+use_duckdb_report_cube = False
+enriched_cache_path = str(PROJECT_DIR) + "/outputs/ojo_analysis/enriched_cache/"
+
+image_path = (
+    str(PROJECT_DIR) + "/afs_early_years_labour_market_analysis/notebooks/images/"
+)
+
+professions_to_include = [
+    "Early Years Practitioner",
+    "Primary School Teacher",
+    "Secondary School Teacher",
+    "Retail Assistant",
+    "Waiter",
+]
+
+# job adverts are only analysed from april 2021, given feedback
+min_date = "2021-04-01"
+
+# deduplicate adverts by location and near duplicate id (shared by adverts with
+# near duplicate titles and descriptions, e.g. agency reposts) rather than by
+# location, title and date
+near_duplicate_dedupe = False
+dedupe_cols = (
+    ["location", "near_duplicate_id"] if near_duplicate_dedupe else cl.dedupe_cols
+)
+
 early_date_range = ("2021-07-01", "2022-07-01")
 late_date_range = ("2022-07-01", "2023-07-01")
+# periods to compare demand between, changes are from the first period
+demand_periods = {"early": early_date_range, "late": late_date_range}
+
+# salary columns to inflation adjust, mapped to their inflation adjusted column
+inflation_salary_cols = {
+    "min_annualised_salary": "inflation_adj_min_salary",
+    "max_annualised_salary": "inflation_adj_max_salary",
+}
 
 # for any qualification above 6, map to 6 as everything 6 and above is a degree
 salary_mapper = {"inflation_adj_min_salary": "Min", "inflation_adj_max_salary": "Max"}
@@ -38,32 +88,28 @@ shape_url = "https://gisco-services.ec.europa.eu/distribution/v2/nuts/download/r
 
 full_shapefile_path = str(PROJECT_DIR) + shapefile_path
 
+# Processed England NUTS geo data is cached in a local store
+geo_store_dir = "geo_store/"
+nuts_geo_version = "2021-v1"
+
 map_color_range = ["darkred", "orange", "green"]
 
 
 def is_england_geo(itl_3_code: str) -> bool:
     """Flag whether an itl 3 code is in England or not
 
+    To flag a whole column of codes use utils.geography.is_england instead.
+
     Args:
         itl_3_code (str): itl 3 code
 
     Returns:
         bool: True if in England, False otherwise
     """
-
-    england_codes = "|".join(
-        ["TLC", "TLD", "TLE", "TLF", "TLG", "TLH", "TLI", "TLJ", "TLK"]
-    )
-    england_codes_regex = f"^({england_codes})"
-
     if isinstance(itl_3_code, str) == False:
         return False
 
-    matches = re.match(england_codes_regex, itl_3_code)
-    if matches:
-        return True
-    else:
-        return False
+    return geo.itl_1_countries.get(itl_3_code[:3]) == "England"
 
 
 def calculate_inflation_adjusted_salary(
@@ -73,6 +119,9 @@ def calculate_inflation_adjusted_salary(
 ) -> Union[int, None]:
     """Calculate the inflation adjusted salary for a given year
 
+    To adjust a whole column of salaries use
+        utils.inflation.inflation_adjust_salaries instead.
+
     Args:
         original_salary (int): Original salary
         original_year (int): Original year
@@ -83,20 +132,13 @@ def calculate_inflation_adjusted_salary(
         Union[int, None]: If original salary,
             return inflation adjusted salary, else return None.
     """
-    if isinstance(original_year, str):
-        original_year = int(original_year)
-
     if not isinstance(original_salary, float):
         original_salary = float(original_salary)
 
-    inflation_data = {
-        k: v for k, v in inflation_rate_dict.items() if int(k) > original_year
-    }
-    inflation_data = dict(sorted(inflation_data.items()))
-
-    cumulative_inflation = 1.0
-    for year in inflation_data.keys():
-        cumulative_inflation *= 1 + inflation_data.get(year)
+    cumulative_inflation = inf.gather_yearly_factors(
+        inf.get_yearly_inflation_factors(inflation_rate_dict),
+        np.array([int(original_year)]),
+    )[0]
 
     if original_salary:
         inflated_salary = original_salary * cumulative_inflation
@@ -107,12 +149,141 @@ def calculate_inflation_adjusted_salary(
         return None
 
 
-def get_nuts_geo_data(
+def get_enriched_filters(
+    professions_to_include: List[str] = professions_to_include,
+    min_date: str = min_date,
+) -> List[List[tuple]]:
+    """Get filters selecting the enriched dataset partitions used in the analysis
+
+    Args:
+        professions_to_include (List[str], optional): Professions to load.
+            Defaults to professions_to_include.
+        min_date (str, optional): Earliest date to load. Defaults to min_date.
+
+    Returns:
+        List[List[tuple]]: Parquet filters in disjunctive normal form
+    """
+    return [
+        [("sector", "in", professions_to_include)] + date_filter
+        for date_filter in dg.get_date_partition_filters(min_date)
+    ]
+
+
+def load_job_adverts(
+    sample_fraction: float = sample_fraction,
+    professions_to_include: List[str] = professions_to_include,
+    min_date: str = min_date,
+) -> pd.DataFrame:
+    """Load and concatenate the enriched EYP and similar job adverts, only
+        reading the partitions of the professions and months analysed
+
+    Args:
+        sample_fraction (float, optional): Fraction of job adverts to sample,
+            stratified by profession and month. Defaults to sample_fraction.
+        professions_to_include (List[str], optional): Professions to load.
+            Defaults to professions_to_include.
+        min_date (str, optional): Earliest date to load. Defaults to min_date.
+
+    Returns:
+        pd.DataFrame: All (or sampled) enriched job adverts
+    """
+    filters = get_enriched_filters(professions_to_include, min_date)
+    eyp_jobs = od.get_eyp_relevant_enriched_job_adverts(filters)
+    sim_jobs = od.get_similar_enriched_job_adverts(filters)
+    all_jobs = pd.concat([eyp_jobs, sim_jobs]).rename(columns={"sector": "profession"})
+    # partition columns load as categoricals of each dataset's values
+    all_jobs["profession"] = all_jobs["profession"].astype(str)
+
+    return sp.stratified_sample(all_jobs, sample_fraction, strata_cols=["profession"])
+
+
+def load_skills(all_jobs: pd.DataFrame) -> pd.DataFrame:
+    """Load and concatenate the skills of EYP and similar job adverts
+
+    Args:
+        all_jobs (pd.DataFrame): All (or sampled) enriched job adverts
+
+    Returns:
+        pd.DataFrame: Skills of the job adverts
+    """
+    filters = get_enriched_filters(all_jobs["profession"].unique().tolist())
+    all_skills = pd.concat(
+        [od.get_eyp_relevant_skills(filters), od.get_similar_skills(filters)]
+    )
+
+    return sp.filter_to_ids(all_skills, all_jobs["id"])
+
+
+def inflation_adjust_job_adverts(
+    all_jobs_clean: pd.DataFrame,
+    inflation_rate_dict: Dict[str, float] = inflation_rate_dict,
+) -> pd.DataFrame:
+    """Convert all salaries of cleaned job adverts to March 2023 prices
+
+    Args:
+        all_jobs_clean (pd.DataFrame): Cleaned job adverts
+        inflation_rate_dict (Dict[str, float], optional): Inflation data dictionary.
+            Defaults to inflation_rate_dict.
+
+    Returns:
+        pd.DataFrame: Cleaned job adverts with inflation adjusted salaries
+    """
+    return inf.inflation_adjust_salaries(
+        all_jobs_clean,
+        salary_cols=inflation_salary_cols,
+        inflation_rate_dict=inflation_rate_dict,
+    )
+
+
+def split_job_adverts(all_jobs_clean: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Re-split cleaned job adverts into EYP and similar job adverts
+
+    Args:
+        all_jobs_clean (pd.DataFrame): Cleaned job adverts
+
+    Returns:
+        Dict[str, pd.DataFrame]: EYP job adverts, with qualifications only up to
+            level 6, and similar job adverts
+    """
+    eyp_jobs_clean = (
+        all_jobs_clean.query("profession == 'Early Years Practitioner'")
+        # make sure qualifications are only up to level 6
+        .query("qualification_level <= '6' | qualification_level.isna()").reset_index(
+            drop=True
+        )
+    )
+    sim_jobs_clean = all_jobs_clean.query(
+        "profession != 'Early Years Practitioner'"
+    ).reset_index(drop=True)
+
+    return {"eyp": eyp_jobs_clean, "sim": sim_jobs_clean}
+
+
+def clean_skills(
+    all_skills: pd.DataFrame, all_jobs_clean: pd.DataFrame
+) -> pd.DataFrame:
+    """Add the profession of each skill's advert, dropping skills of adverts
+        that were cleaned out
+
+    Args:
+        all_skills (pd.DataFrame): Skills of all job adverts
+        all_jobs_clean (pd.DataFrame): Cleaned job adverts
+
+    Returns:
+        pd.DataFrame: Skills of cleaned job adverts with their profession
+    """
+    id_2_profession_mapper = all_jobs_clean.set_index("id").profession.to_dict()
+    all_skills = all_skills.assign(profession=all_skills.id.map(id_2_profession_mapper))
+
+    return all_skills.dropna(subset=["profession"])
+
+
+def download_nuts_file(
     nuts_file: str = nuts_file,
     full_shapefile_path: str = full_shapefile_path,
     shape_url: str = shape_url,
-) -> pd.DataFrame:
-    """Get NUTS geo data for England
+) -> str:
+    """Download and extract the NUTS file, unless it has already been extracted
 
     Args:
         nuts_file (str, optional): Nuts file. Defaults to nuts_file.
@@ -120,107 +291,143 @@ def get_nuts_geo_data(
         shape_url (str, optional): Shape URL. Defaults to shape_url.
 
     Returns:
-        pd.DataFrame: NUTS geo data for England
+        str: Path to the extracted NUTS file
     """
-    ##first get nuts shapefiles for the UK
-    # get nutsfile
-    if not os.path.exists(full_shapefile_path):
+    nuts_path = full_shapefile_path + nuts_file
+    if not os.path.exists(nuts_path):
         os.makedirs(full_shapefile_path, exist_ok=True)
+        zip_path, _ = urlretrieve(shape_url)
+        with ZipFile(zip_path, "r") as zip_files:
+            zip_files.extract(nuts_file, path=full_shapefile_path)
 
-    zip_path, _ = urlretrieve(shape_url)
-    with ZipFile(zip_path, "r") as zip_files:
-        for zip_names in zip_files.namelist():
-            if zip_names == nuts_file:
-                zip_files.extract(zip_names, path=full_shapefile_path)
-                nuts_geo = gpd.read_file(full_shapefile_path + nuts_file)
-                nuts_geo = nuts_geo[nuts_geo["CNTR_CODE"] == "UK"].reset_index(
-                    drop=True
-                )
+    return nuts_path
+
+
+def build_nuts_geo_data(
+    nuts_file: str = nuts_file,
+    full_shapefile_path: str = full_shapefile_path,
+    shape_url: str = shape_url,
+) -> gpd.GeoDataFrame:
+    """Build NUTS geo data for England from the NUTS file
+
+    Args:
+        nuts_file (str, optional): Nuts file. Defaults to nuts_file.
+        full_shapefile_path (str, optional): Full shape file path. Defaults to full_shapefile_path.
+        shape_url (str, optional): Shape URL. Defaults to shape_url.
+
+    Returns:
+        gpd.GeoDataFrame: NUTS geo data for England
+    """
+    ##first get nuts shapefiles for the UK
+    nuts_geo = gpd.read_file(
+        download_nuts_file(nuts_file, full_shapefile_path, shape_url)
+    )
+    nuts_geo = nuts_geo[nuts_geo["CNTR_CODE"] == "UK"].reset_index(drop=True)
 
     # replace NUTS to ITL 3 code and only get England
     nuts_geo = (
         nuts_geo
         # convert to ITL 3 code
-        .assign(id=lambda x: x["id"].str.replace("UK", "TL"))
-        .assign(NUTS_ID=lambda x: x["NUTS_ID"].str.replace("UK", "TL"))
+        .assign(
+            id=lambda x: x["id"].str.replace("UK", "TL"),
+            NUTS_ID=lambda x: x["NUTS_ID"].str.replace("UK", "TL"),
+        )
         # Make sure its only England
-        .assign(is_england_geo=lambda x: x["NUTS_ID"].apply(is_england_geo))
-        .query("is_england_geo == True")
+        .loc[lambda x: geo.is_england(x["NUTS_ID"])]
     ).reset_index(drop=True)
 
-    # Manually merge london nuts codes
-    nuts_geo.loc[
-        nuts_geo[nuts_geo["NUTS_ID"].str.startswith("TLI")].index, "NAME_LATN"
-    ] = "London"
-    nuts_geo.loc[
-        nuts_geo[nuts_geo["NUTS_ID"].str.startswith("TLI")].index, "NUTS_NAME"
-    ] = "London"
-    nuts_geo.loc[
-        nuts_geo[nuts_geo["NUTS_ID"].str.startswith("TLI")].index, "NUTS_ID"
-    ] = "TLI"
+    # Merge london nuts codes
+    is_london = nuts_geo["NUTS_ID"].str.startswith(geo.london_itl_code)
+    nuts_geo.loc[is_london, ["NAME_LATN", "NUTS_NAME"]] = "London"
+    nuts_geo["NUTS_ID"] = geo.merge_london_codes(nuts_geo["NUTS_ID"])
 
     return nuts_geo
 
 
+def get_nuts_geo_data(
+    nuts_file: str = nuts_file,
+    full_shapefile_path: str = full_shapefile_path,
+    shape_url: str = shape_url,
+    version: str = nuts_geo_version,
+    refresh: bool = False,
+) -> gpd.GeoDataFrame:
+    """Get NUTS geo data for England
+
+    The processed geo data is cached in a local GeoParquet store keyed by
+    shape_url and version, so it is only downloaded and processed once.
+
+    Args:
+        nuts_file (str, optional): Nuts file. Defaults to nuts_file.
+        full_shapefile_path (str, optional): Full shape file path. Defaults to full_shapefile_path.
+        shape_url (str, optional): Shape URL. Defaults to shape_url.
+        version (str, optional): Version of the processed geo data. Bump when
+            build_nuts_geo_data changes. Defaults to nuts_geo_version.
+        refresh (bool, optional): Whether to rebuild the cached geo data.
+            Defaults to False.
+
+    Returns:
+        gpd.GeoDataFrame: NUTS geo data for England
+    """
+    return gs.get_stored_geometries(
+        lambda: build_nuts_geo_data(nuts_file, full_shapefile_path, shape_url),
+        store_path=full_shapefile_path + geo_store_dir,
+        name=nuts_file.split(".")[0] + "_england",
+        source_url=shape_url,
+        version=version,
+        refresh=refresh,
+    )
+
+
 def generate_boxplot(
     box_plot_df: pd.DataFrame, facet_type: str, columns: int
-) -> alt.Chart:
+) -> alt.FacetChart:
     """Generate boxplot of salary by different categorical variables
 
+    Quartiles and whiskers are computed in pandas, so the chart only embeds a
+    row per facet and salary type.
+
     Args:
         box_plot_df (pd.DataFrame): DataFrame to generate boxplot from
         facet_type (str): Type of facet to generate boxplot by
         columns (int): Number of columns to facet by
     """
-    boxplot_graph = (
-        alt.Chart(box_plot_df)
-        .mark_boxplot(size=50, extent=0.5, outliers=False)
-        .encode(
-            alt.Y(
-                "salary:Q", title="Annualised Salary (£)", scale=alt.Scale(zero=False)
-            ),
-            alt.X("salary_type:N", title="Salary Type"),
-            alt.Color("salary_type:N", title="Salary Type"),
-        )
-        .facet(facet_type, columns=columns)
+    box_plot_summary = au.get_boxplot_summary(
+        box_plot_df, [facet_type, "salary_type"], "salary", extent=0.5
     )
+    boxplot_graph = au.summary_boxplot(
+        box_plot_summary,
+        "salary_type",
+        y_title="Annualised Salary (£)",
+        x_title="Salary Type",
+    ).facet(facet_type, columns=columns)
 
     return boxplot_graph
 
 
-def get_skill_similarity_scores(all_skills: pd.DataFrame) -> List[Dict[str, float]]:
+def get_skill_similarity_scores(
+    all_skills: pd.DataFrame,
+    reference_profession: str = "Early Years Practitioner",
+    tfidf: bool = False,
+) -> List[Dict[str, float]]:
     """Calculates the cosine similarity between the skill count
         vectors of an EYP and other professions.
 
     Args:
         all_skills (pd.DataFrame): DataFrame of all skills
+        reference_profession (str, optional): Profession to compare other
+            professions to. Defaults to "Early Years Practitioner".
+        tfidf (bool, optional): Whether to TF-IDF weight skill counts.
+            Defaults to False.
 
     Returns:
         List[Dict[str, float]]: List of dictionaries containing the profession and
             skill profile similarity score (cosine similarity)
     """
-    # create count vectors of skills for each profession
-    esco_id_2_id = all_skills.set_index("esco_id").esco_label.to_dict()
-    profession_skill_dict = dict()
-    for profession, skills in all_skills.groupby("profession"):
-        skill_count = dict(Counter(skills.esco_id))
-        for skill_id, indx in esco_id_2_id.items():
-            if not skill_count.get(skill_id):
-                skill_count[skill_id] = 0
-        # sort the dictionary by skill id
-        skill_count = dict(sorted(skill_count.items(), key=lambda item: item[0]))
-        profession_skill_dict[profession] = skill_count
-
-    # calculate cosine similarity between EYP and other profession skill count vectors
-    eyp_count_vector = list(profession_skill_dict["Early Years Practitioner"].values())
-    profession_sim = []
-    for profession, skill_count in profession_skill_dict.items():
-        if profession != "Early Years Practitioner":
-            count_vector = list(skill_count.values())
-            # calculate cosine similarity
-            cosine_sim = cosine_similarity([eyp_count_vector], [count_vector])
-            profession_sim.append(
-                {"profession": profession, "skill_profile_similarity": cosine_sim}
-            )
-
-    return profession_sim
+    profession_sim = sa.get_skill_similarity_matrix(
+        all_skills, group_col="profession", tfidf=tfidf
+    )[reference_profession].drop(reference_profession)
+
+    return [
+        {"profession": profession, "skill_profile_similarity": cosine_sim}
+        for profession, cosine_sim in profession_sim.items()
+    ]
@@ -4,11 +4,21 @@ A flow to parse relevant Early Years jobs and similar jobs from the OJO dataset.
 python afs_early_years_labour_market_analysis/pipeline/data_collection/refine_relevant_jobs.py run
 """
 from metaflow import FlowSpec, step, Parameter
+import pandas as pd
+from typing import Optional
 
 from afs_early_years_labour_market_analysis.getters.ojd_daps import get_job_adverts
 from afs_early_years_labour_market_analysis.getters.data_getters import load_s3_data
-from afs_early_years_labour_market_analysis import BUCKET_NAME
+from afs_early_years_labour_market_analysis import BUCKET_NAME, logger
 from afs_early_years_labour_market_analysis.utils.text_cleaning import clean_job_title
+from afs_early_years_labour_market_analysis.utils.parallel import parallel_apply
+from afs_early_years_labour_market_analysis.utils.sampling import stratified_sample
+from afs_early_years_labour_market_analysis.utils.step_metrics import instrument_step
+from afs_early_years_labour_market_analysis.utils.title_classifier import (
+    JobTitleClassifier,
+    load_canonical_job_titles,
+    title_similarity_threshold,
+)
 
 import re
 
@@ -24,72 +34,24 @@ eyp_occupation_titles = [
     "Early Teacher",
 ]
 
-# Suggested job titles
-eyp_job_titles = [
-    "early years teacher",
-    "early years practitioners",
-    "early years educator",
-    "early years early career teacher (ect)",
-    "early years assessor",
-    "early years assistant",
-    "nursery practitioner",
-    "nursery nurse",
-    "nursery manager",
-    "nursery assistant",
-    "preschool assistant",
-    "preschool manager",
-    "nursery preschool assistant",
-    "nursery senior room leader",
-    "baby room teacher",
-    "level 3 childcare practitioner",
-    "early years apprentice",
-    "early years deputy manager",
-    "nursery school classroom teacher",
-    "nursery officer",
-    "early years and family practitioner",
-    "deputy nursery manager",
-    "room leader",
-    "qualified practitioner",
-    "early years teaching assistant",
-]
+# Suggested job titles of each profession, see config/job_titles.yaml
+canonical_job_titles, _, _ = load_canonical_job_titles()
 
-# ------------------------------------------------ SIMILAR JOB ADVERT QUERIES ---------------------------------------------------
+eyp_profession = "Early Years Practitioner"
 
-job_titles_to_match_on = [
-    "teaching assistant",
-    "sen teaching assistant",
-    "sen teacher assistant" "primary school teacher",
-    "primary teacher",
-    "special needs teacher",
-    "sen teacher",
-    "secondary school teacher",
-    "secondary teacher",
-    "waiter",
-    "waitress",
-    "retail assistant",
-    "store assistant",
-    "shop assistant",
-    "supply teacher",
-]
+eyp_job_titles = canonical_job_titles[eyp_profession]
+
+# ------------------------------------------------ SIMILAR JOB ADVERT QUERIES ---------------------------------------------------
 
 job_title_group_mapper = {
-    "teaching assistant": "Teaching Assistant",
-    "sen teaching assistant": "Teaching Assistant",
-    "sen teacher assistant": "Teaching Assistant",
-    "primary school teacher": "Primary School Teacher",
-    "primary teacher": "Primary School Teacher",
-    "special needs teacher": "Special Needs Teacher",
-    "sen teacher": "Special Needs Teacher",
-    "secondary school teacher": "Secondary School Teacher",
-    "secondary teacher": "Secondary School Teacher",
-    "waiter": "Waiter",
-    "waitress": "Waiter",
-    "retail assistant": "Retail Assistant",
-    "store assistant": "Retail Assistant",
-    "shop assistant": "Retail Assistant",
-    "supply teacher": "Supply Teacher",
+    job_title: profession
+    for profession, job_titles in canonical_job_titles.items()
+    if profession != eyp_profession
+    for job_title in job_titles
 }
 
+job_titles_to_match_on = list(job_title_group_mapper)
+
 # manually removed headteacher, deputy head or assistant headteacher from occupation titles related to teaching
 relevant_occupations = [
     "Teacher Assistant",
@@ -194,82 +156,184 @@ relevant_sectors = [
 ]
 
 
+def refine_eyp_job_adverts(
+    job_adverts: pd.DataFrame, title_classifier: Optional[JobTitleClassifier] = None
+) -> pd.DataFrame:
+    """Get EYP job adverts by their job title, occupation or sector.
+
+    Args:
+        job_adverts (pd.DataFrame): OJO job adverts.
+        title_classifier (Optional[JobTitleClassifier], optional): Classifier
+            to also match cleaned job titles to EYP job titles with, when
+            their lower cased title is not an EYP job title. Defaults to None,
+            to only match lower cased job titles exactly.
+
+    Returns:
+        pd.DataFrame: EYP job adverts, with their sector set to
+            "Early Years Practitioner".
+    """
+    is_eyp_job_title = job_adverts["job_title_raw"].str.lower().isin(eyp_job_titles)
+    if title_classifier is not None:
+        # only titles that are not matched exactly are classified
+        clean_job_titles = parallel_apply(
+            job_adverts.loc[~is_eyp_job_title, "job_title_raw"], clean_job_title
+        )
+        is_eyp_job_title[~is_eyp_job_title] = (
+            title_classifier.classify(clean_job_titles)["profession"] == eyp_profession
+        ).values & ~clean_job_titles.str.contains("trainee|aspiring", na=False).values
+    relevant_job_adverts_eyp = job_adverts[
+        is_eyp_job_title
+        | (job_adverts["occupation"].isin(eyp_occupation_titles))
+        | (job_adverts["sector"].str.lower().str.contains("nursery"))
+        | (job_adverts["job_title_raw"].str.lower().str.contains("early years"))
+    ].copy()
+    relevant_job_adverts_eyp["sector"] = "Early Years Practitioner"
+
+    return relevant_job_adverts_eyp
+
+
+def refine_similar_job_adverts(
+    job_adverts: pd.DataFrame,
+    relevant_job_adverts_eyp: pd.DataFrame,
+    title_classifier: Optional[JobTitleClassifier] = None,
+) -> pd.DataFrame:
+    """Get job adverts similar to EYP job adverts by their occupation, domain or
+    sector and job title.
+
+    Args:
+        job_adverts (pd.DataFrame): OJO job adverts.
+        relevant_job_adverts_eyp (pd.DataFrame): EYP job adverts, which are
+            excluded from similar job adverts.
+        title_classifier (Optional[JobTitleClassifier], optional): Classifier
+            to match cleaned job titles that do not contain a similar job title
+            with. Defaults to None, to only match job titles containing a
+            similar job title.
+
+    Returns:
+        pd.DataFrame: Similar job adverts, with their sector set to the group of
+            their matched job title.
+    """
+    # 1 -- query job adverts to make sure they are in relevant domains and sectors
+    sim_job_adverts = job_adverts[
+        (job_adverts["occupation"].isin(relevant_occupations))
+        | (job_adverts["knowledge_domain"].isin(relevant_knowledge_domains))
+        | (job_adverts["sector"].isin(relevant_sectors))
+        | (job_adverts["parent_sector"].isin(relevant_parent_sectors))
+    ].copy()
+    sim_job_adverts["clean_job_title"] = parallel_apply(
+        sim_job_adverts.job_title_raw, clean_job_title
+    )
+
+    # 2 -- query job adverts to make sure they are in relevant job titles
+    sim_job_adverts["matched_job_title"] = None
+    for matched_job_title in job_titles_to_match_on:
+        sim_job_adverts.loc[
+            sim_job_adverts.clean_job_title.str.contains(matched_job_title),
+            "matched_job_title",
+        ] = matched_job_title
+    if title_classifier is not None:
+        # titles that do not contain a similar job title are classified
+        is_unmatched = sim_job_adverts["matched_job_title"].isna()
+        title_matches = title_classifier.classify(
+            sim_job_adverts.loc[is_unmatched, "clean_job_title"]
+        )
+        # titles nearest to EYP or other titles are not similar job titles
+        sim_job_adverts.loc[is_unmatched, "matched_job_title"] = title_matches[
+            "matched_job_title"
+        ].where(title_matches["profession"].isin(job_title_group_mapper.values()))
+
+    # 3 -- tidy up relevant job adverts
+    sim_job_adverts = (
+        sim_job_adverts.query("matched_job_title.notnull()")
+        # clean up sector names with the job title group mapper - we're not really
+        # using sectors, we're just using job titles to compare EYP with.
+        .assign(sector=lambda x: x.matched_job_title.map(job_title_group_mapper))
+        # drop any job titles that have the word 'trainee' or 'aspiring' in
+        .query('clean_job_title.str.contains("trainee") == False').query(
+            'clean_job_title.str.contains("aspiring") == False'
+        )
+    ).reset_index(drop=True)
+
+    # 4 -- make sure eyp job ads are not in sim occ jobs
+    eyp_job_ids = relevant_job_adverts_eyp.id.astype(str).to_list()
+
+    return sim_job_adverts[~sim_job_adverts.id.astype(str).isin(eyp_job_ids)]
+
+
 class RefineRelevantJobs(FlowSpec):
+    sample = Parameter(
+        "sample",
+        help="Fraction of job adverts to sample, stratified by sector and month, for development runs. Sampled outputs are not saved.",
+        default=1.0,
+        type=float,
+    )
+    title_classifier = Parameter(
+        "title_classifier",
+        help="Whether to also assign job titles not matched exactly (EYP) or by substring (similar jobs) the profession of their most similar job title in config/job_titles.yaml. Off until validated on a labelled sample of real job titles.",
+        default=False,
+        type=bool,
+    )
+    title_similarity_threshold = Parameter(
+        "title_similarity_threshold",
+        help="Minimum character n-gram TF-IDF cosine similarity of a job title to its most similar job title to be assigned its profession.",
+        default=title_similarity_threshold,
+        type=float,
+    )
+
     @step
     def start(self):
         """Start the flow."""
         self.next(self.get_job_adverts)
 
     @step
+    @instrument_step(outputs=["job_adverts"])
     def get_job_adverts(self):
         """Get job adverts from OJO dataset."""
-        self.job_adverts = get_job_adverts()
+        self.job_adverts = stratified_sample(
+            get_job_adverts(), self.sample, strata_cols=["sector"]
+        )
         self.next(self.refine_relevant_jobs)
 
     @step
+    @instrument_step(
+        inputs=["job_adverts"],
+        outputs=["relevant_job_adverts_eyp", "relevant_job_adverts_sim_occs_no_eyp"],
+    )
     def refine_relevant_jobs(self):
         """Refine relevant jobs from OJO dataset."""
-        self.relevant_job_adverts_eyp = self.job_adverts[
-            (self.job_adverts["job_title_raw"].str.lower().isin(eyp_job_titles))
-            | (self.job_adverts["occupation"].isin(eyp_occupation_titles))
-            | (self.job_adverts["sector"].str.lower().str.contains("nursery"))
-            | (
-                self.job_adverts["job_title_raw"]
-                .str.lower()
-                .str.contains("early years")
+        if self.title_classifier:
+            title_classifier = JobTitleClassifier.from_config(
+                threshold=self.title_similarity_threshold
             )
-        ]
-        self.relevant_job_adverts_eyp["sector"] = "Early Years Practitioner"
-        print(f"the shape of the EYP data is: {self.relevant_job_adverts_eyp.shape}")
-
-        # 1 -- query job adverts to make sure they are in relevant domains and sectors
-        sim_job_adverts = self.job_adverts[
-            (self.job_adverts["occupation"].isin(relevant_occupations))
-            | (self.job_adverts["knowledge_domain"].isin(relevant_knowledge_domains))
-            | (self.job_adverts["sector"].isin(relevant_sectors))
-            | (self.job_adverts["parent_sector"].isin(relevant_parent_sectors))
-        ]
-        sim_job_adverts["clean_job_title"] = sim_job_adverts.job_title_raw.apply(
-            clean_job_title
-        )
+        else:
+            title_classifier = None
 
-        # 2 -- query job adverts to make sure they are in relevant job titles
-        for matched_job_title in job_titles_to_match_on:
-            sim_job_adverts.loc[
-                sim_job_adverts.clean_job_title.str.contains(matched_job_title),
-                "matched_job_title",
-            ] = matched_job_title
-
-        # 3 -- tidy up relevant job adverts
-        sim_job_adverts = (
-            sim_job_adverts.query("matched_job_title.notnull()")
-            # clean up sector names with the job title group mapper - we're not really
-            # using sectors, we're just using job titles to compare EYP with.
-            .assign(sector=lambda x: x.matched_job_title.map(job_title_group_mapper))
-            # drop any job titles that have the word 'trainee' or 'aspiring' in
-            .query('clean_job_title.str.contains("trainee") == False').query(
-                'clean_job_title.str.contains("aspiring") == False'
-            )
-        ).reset_index(drop=True)
+        self.relevant_job_adverts_eyp = refine_eyp_job_adverts(
+            self.job_adverts, title_classifier
+        )
+        logger.info(
+            f"the shape of the EYP data is: {self.relevant_job_adverts_eyp.shape}"
+        )
 
-        # 4 -- make sure eyp job ads are not in sim occ jobs
-        eyp_job_ids = self.relevant_job_adverts_eyp.id.astype(str).to_list()
-        self.relevant_job_adverts_sim_occs_no_eyp = sim_job_adverts[
-            ~sim_job_adverts.id.astype(str).isin(eyp_job_ids)
-        ]
+        self.relevant_job_adverts_sim_occs_no_eyp = refine_similar_job_adverts(
+            self.job_adverts, self.relevant_job_adverts_eyp, title_classifier
+        )
 
-        print(
+        logger.info(
             f"the shape of similar jobs data is: {self.relevant_job_adverts_sim_occs_no_eyp.shape}"
         )
 
-        self.relevant_job_adverts_eyp.to_parquet(
-            "s3://afs-early-years-labour-market-analysis/inputs/ojd_daps_extract/relevant_job_adverts_eyp.parquet",
-            index=False,
-        )
-        self.relevant_job_adverts_sim_occs_no_eyp.to_parquet(
-            "s3://afs-early-years-labour-market-analysis/inputs/ojd_daps_extract/relevant_job_adverts_sim_occs.parquet",
-            index=False,
-        )
+        if self.sample < 1:
+            logger.info("Not saving sampled relevant job adverts")
+        else:
+            self.relevant_job_adverts_eyp.to_parquet(
+                "s3://afs-early-years-labour-market-analysis/inputs/ojd_daps_extract/relevant_job_adverts_eyp.parquet",
+                index=False,
+            )
+            self.relevant_job_adverts_sim_occs_no_eyp.to_parquet(
+                "s3://afs-early-years-labour-market-analysis/inputs/ojd_daps_extract/relevant_job_adverts_sim_occs.parquet",
+                index=False,
+            )
         self.next(self.end)
 
     @step
@@ -8,6 +8,8 @@ Adds:
 - Birth rate
 - Skills (as a separate table)
 
+- Near duplicate id, shared by adverts with near duplicate titles and descriptions
+
 For EYP jobs, we also add Qualification level
 
 python afs_early_years_labour_market_analysis/pipeline/data_enrichment/enrich_relevant_jobs.py run
@@ -15,15 +17,432 @@ python afs_early_years_labour_market_analysis/pipeline/data_enrichment/enrich_re
 
 from metaflow import FlowSpec, step, Parameter
 import pandas as pd
+from typing import List, Optional
+
+from afs_early_years_labour_market_analysis import BUCKET_NAME, logger
+from afs_early_years_labour_market_analysis.utils.sampling import (
+    filter_to_ids,
+    stratified_sample,
+)
+from afs_early_years_labour_market_analysis.utils.step_metrics import instrument_step
+
+# where production runs checkpoint extracted qualification levels
+production_qualification_checkpoint_path = (
+    f"s3://{BUCKET_NAME}/outputs/checkpoints/qualification_levels/"
+)
+
+
+def prepare_rural_urban_nuts(rural_urban_nuts: pd.DataFrame) -> pd.DataFrame:
+    """Prepare the rural/urban classification of NUTS 3 regions.
+
+    Args:
+        rural_urban_nuts (pd.DataFrame): Raw rural/urban classification.
+
+    Returns:
+        pd.DataFrame: Rural/urban classification with an itl_3_code column.
+    """
+    return (
+        rural_urban_nuts[["NUTS315CD", "RUC11CD", "RUC11", "Broad_RUC11"]]
+        .assign(itl_3_code=lambda x: x["NUTS315CD"].str.replace("UK", "TL"))
+        .rename(
+            columns={
+                "RUC11CD": "ruc11_code",
+                "RUC11": "ruc11",
+                "Broad_RUC11": "broad_ruc11",
+            }
+        )
+    )
+
+
+def clean_job_descriptions(
+    descriptions: pd.DataFrame, job_ids: List[int], n_workers: Optional[int] = None
+) -> pd.DataFrame:
+    """Clean the descriptions of a subset of job adverts.
+
+    Args:
+        descriptions (pd.DataFrame): Job advert ids and descriptions.
+        job_ids (List[int]): Ids of job adverts to clean descriptions of.
+        n_workers (Optional[int], optional): Number of worker processes.
+            Defaults to the number of CPUs.
+
+    Returns:
+        pd.DataFrame: Job advert ids and clean descriptions.
+    """
+    import afs_early_years_labour_market_analysis.utils.text_cleaning as tc
+    from afs_early_years_labour_market_analysis.utils.parallel import parallel_apply
+
+    return (
+        descriptions.query("id in @job_ids")
+        .assign(
+            clean_description=lambda x: parallel_apply(
+                x.description, tc.clean_text, n_workers
+            )
+        )
+        .drop(columns=["description"])
+    )
+
+
+def add_salaries_and_locations(
+    job_adverts: pd.DataFrame, salaries: pd.DataFrame, locations: pd.DataFrame
+) -> pd.DataFrame:
+    """Add salary and location information to job adverts.
+
+    Args:
+        job_adverts (pd.DataFrame): Job adverts.
+        salaries (pd.DataFrame): Salaries of job adverts.
+        locations (pd.DataFrame): Locations of job adverts.
+
+    Returns:
+        pd.DataFrame: Job adverts with salaries and locations.
+    """
+    return (
+        job_adverts.merge(
+            salaries,
+            on="id",
+            how="left",
+        )
+        .merge(locations, on="id", how="left")
+        .drop(columns=["job_location_raw_x"])
+        .rename(columns={"job_location_raw_y": "job_location_raw"})
+    )
+
+
+def add_rural_urban_classification(
+    job_adverts: pd.DataFrame, rural_urban_nuts: pd.DataFrame
+) -> pd.DataFrame:
+    """Classify the itl 3 codes, with london codes merged, of job adverts as
+    rural or urban.
+
+    Args:
+        job_adverts (pd.DataFrame): Job adverts with an itl_3_code column.
+        rural_urban_nuts (pd.DataFrame): Rural/urban classification.
+
+    Returns:
+        pd.DataFrame: Job adverts with rural/urban classification columns.
+    """
+    import afs_early_years_labour_market_analysis.utils.geography as geo
+
+    return job_adverts.join(
+        geo.classify_itl_3_codes(
+            job_adverts["itl_3_code"],
+            rural_urban_nuts=rural_urban_nuts,
+            columns=geo.rural_urban_cols,
+        )
+    )
+
+
+def add_near_duplicate_ids(
+    job_adverts: List[pd.DataFrame],
+    descriptions: pd.DataFrame,
+    threshold: float,
+) -> List[pd.DataFrame]:
+    """Add the near duplicate id of each job advert, the smallest id of the
+    adverts with a near duplicate title and description.
+
+    Adverts of every dataset are clustered together, so reposts across
+    datasets share a near duplicate id.
+
+    Args:
+        job_adverts (List[pd.DataFrame]): Job adverts of each dataset, e.g.
+            EYP and similar job adverts.
+        descriptions (pd.DataFrame): Job advert ids and descriptions.
+        threshold (float): Minimum estimated Jaccard similarity of the title
+            and description shingles of near duplicate adverts.
+
+    Returns:
+        List[pd.DataFrame]: Job adverts of each dataset with a
+            near_duplicate_id column.
+    """
+    from afs_early_years_labour_market_analysis.utils.near_duplicates import (
+        get_near_duplicate_ids,
+    )
+
+    titles = pd.concat(
+        [dataset_adverts[["id", "job_title_raw"]] for dataset_adverts in job_adverts]
+    ).drop_duplicates("id")
+    texts = titles.merge(
+        descriptions.loc[descriptions["id"].isin(titles["id"]), ["id", "description"]],
+        on="id",
+        how="left",
+    ).drop_duplicates("id")
+    near_duplicate_ids = pd.Series(
+        get_near_duplicate_ids(
+            texts, ["job_title_raw", "description"], threshold=threshold
+        ).values,
+        index=texts["id"].values,
+    )
+
+    return [
+        dataset_adverts.assign(
+            near_duplicate_id=dataset_adverts["id"].map(near_duplicate_ids).values
+        )
+        for dataset_adverts in job_adverts
+    ]
+
+
+def get_qualification_levels(
+    clean_descriptions: pd.Series,
+    checkpoint_path: Optional[str] = None,
+    near_duplicate_ids: Optional[pd.Series] = None,
+) -> pd.Series:
+    """Extract the qualification level of each unique clean description.
+
+    Args:
+        clean_descriptions (pd.Series): Clean job descriptions.
+        checkpoint_path (Optional[str], optional): Local or s3 directory to
+            checkpoint extracted levels to, and resume from. Checkpoints are
+            kept per version of the extraction rules. Defaults to None, to not
+            checkpoint.
+        near_duplicate_ids (Optional[pd.Series], optional): Near duplicate id
+            of each description, aligned with clean_descriptions. If given,
+            levels are only extracted from the first description of each near
+            duplicate cluster and shared with the rest. Defaults to None.
+
+    Returns:
+        pd.Series: Qualification level of each description, aligned with
+            clean_descriptions.
+    """
+    import afs_early_years_labour_market_analysis.utils.data_enrichment as de
+    from afs_early_years_labour_market_analysis.utils.checkpoint import (
+        checkpointed_map,
+    )
+    from afs_early_years_labour_market_analysis.utils.stage_runner import (
+        get_function_fingerprint,
+    )
+
+    if checkpoint_path is not None:
+        # levels extracted with other rules are not reused
+        rules_version = get_function_fingerprint(de)[:16]
+        checkpoint_path = f"{checkpoint_path.rstrip('/')}/{rules_version}/"
+
+    if near_duplicate_ids is not None:
+        clean_descriptions = clean_descriptions.groupby(
+            near_duplicate_ids.values
+        ).transform("first")
+
+    clean_desc2qual = checkpointed_map(
+        de.get_qualification_level,
+        clean_descriptions.dropna().unique(),
+        checkpoint_path,
+        description="Extracting qualification level for EYP data",
+        n_workers=None,
+    )
+
+    return clean_descriptions.map(clean_desc2qual)
+
+
+def get_relevant_skills(
+    job_adverts: pd.DataFrame, skills: pd.DataFrame
+) -> pd.DataFrame:
+    """Get the skills of job adverts.
+
+    Args:
+        job_adverts (pd.DataFrame): Job adverts.
+        skills (pd.DataFrame): Skills of all job adverts.
+
+    Returns:
+        pd.DataFrame: Skills of the job adverts.
+    """
+    return job_adverts[["id"]].merge(skills, on="id", how="inner")
+
+
+def add_source_hash(
+    job_adverts: pd.DataFrame, sources: List[pd.DataFrame] = []
+) -> pd.DataFrame:
+    """Add a hash of each relevant job advert's columns and of its rows in the
+    enrichment sources, to detect adverts that have changed since they were
+    enriched.
+
+    Args:
+        job_adverts (pd.DataFrame): Relevant job adverts.
+        sources (List[pd.DataFrame], optional): Data joined onto the adverts by
+            id when enriching them, e.g. salaries, locations, descriptions and
+            skills. Adverts may have any number of rows in each source.
+            Defaults to [].
+
+    Returns:
+        pd.DataFrame: job_adverts with a source_hash column.
+    """
+    import numpy as np
+
+    source_cols = sorted(job_adverts.columns.drop("source_hash", errors="ignore"))
+    source_hash = pd.util.hash_pandas_object(
+        job_adverts[source_cols], index=False
+    ).values
+    for source in sources:
+        source = source[source["id"].isin(job_adverts["id"])].sort_values("id")
+        row_hashes = pd.util.hash_pandas_object(
+            source[sorted(source.columns)], index=False
+        ).values
+        # summing row hashes (modulo 2**64) ignores the order of an id's rows
+        ids, id_starts = np.unique(source["id"].values, return_index=True)
+        id_hashes = np.add.reduceat(row_hashes, id_starts) if len(ids) else row_hashes
+        # adverts without rows in the source (-1) gather the trailing 0
+        advert_source_hashes = np.append(id_hashes, np.uint64(0))[
+            pd.Index(ids).get_indexer(job_adverts["id"])
+        ]
+        source_hash = (source_hash ^ advert_source_hashes) * np.uint64(0x100000001B3)
+
+    return job_adverts.assign(source_hash=source_hash)
+
+
+def get_new_or_changed_adverts(
+    job_adverts: pd.DataFrame, enriched_path: str
+) -> pd.DataFrame:
+    """Get the relevant job adverts that are not in an enriched dataset yet, or
+    that have changed since they were enriched.
+
+    Args:
+        job_adverts (pd.DataFrame): Relevant job adverts with a source_hash
+            column.
+        enriched_path (str): Directory of the enriched job adverts dataset.
+
+    Returns:
+        pd.DataFrame: New or changed job adverts.
+    """
+    import fsspec
+    import pyarrow.dataset as ds
+    from afs_early_years_labour_market_analysis.getters.data_getters import (
+        load_parquet_dataset,
+    )
+
+    fs, path = fsspec.core.url_to_fs(enriched_path)
+    if (
+        not fs.exists(path)
+        or "source_hash"
+        not in ds.dataset(
+            path, filesystem=fs, format="parquet", partitioning="hive"
+        ).schema.names
+    ):
+        logger.info(f"No source hashes in {enriched_path}, enriching all adverts")
+        return job_adverts
+
+    enriched_hashes = load_parquet_dataset(
+        enriched_path, columns=["id", "source_hash"]
+    ).drop_duplicates()
+    is_enriched = pd.MultiIndex.from_frame(job_adverts[["id", "source_hash"]]).isin(
+        pd.MultiIndex.from_frame(enriched_hashes)
+    )
+    logger.info(
+        f"{(~is_enriched).sum()} of {len(job_adverts)} adverts are new or changed "
+        f"since {enriched_path} was enriched"
+    )
+
+    return job_adverts[~is_enriched]
+
+
+def save_enriched_datasets(
+    job_adverts: pd.DataFrame,
+    skills: pd.DataFrame,
+    job_adverts_path: str,
+    skills_path: str,
+    upsert: bool = False,
+):
+    """Save enriched job adverts and their skills as parquet datasets
+    partitioned by sector, year and month.
+
+    Only the partitions of the job adverts are rewritten, so newly enriched
+    months can be appended to the datasets.
+
+    Args:
+        job_adverts (pd.DataFrame): Enriched job adverts.
+        skills (pd.DataFrame): Skills of the job adverts.
+        job_adverts_path (str): Directory of the job adverts dataset.
+        skills_path (str): Directory of the skills dataset.
+        upsert (bool, optional): Whether to insert or replace job_adverts and
+            their skills by id, keeping other adverts in their partitions,
+            rather than overwriting the partitions. Defaults to False.
+    """
+    from afs_early_years_labour_market_analysis.getters.data_getters import (
+        add_date_partition_cols,
+        save_parquet_dataset,
+        upsert_parquet_dataset,
+    )
+    from afs_early_years_labour_market_analysis.getters.ojd_daps import (
+        enriched_partition_cols,
+    )
+
+    job_adverts = add_date_partition_cols(job_adverts)
+    # skills are partitioned like the adverts they come from
+    skills = skills.merge(
+        job_adverts[["id"] + enriched_partition_cols].drop_duplicates("id"),
+        on="id",
+        how="inner",
+    )
+    if upsert:
+        upsert_parquet_dataset(
+            job_adverts,
+            job_adverts_path,
+            enriched_partition_cols,
+            sort_cols=["created", "id"],
+        )
+        # replace the skills of every upserted advert, even if it has none now
+        upsert_parquet_dataset(
+            skills,
+            skills_path,
+            enriched_partition_cols,
+            sort_cols=["id"],
+            keys=job_adverts["id"],
+        )
+    else:
+        save_parquet_dataset(
+            job_adverts,
+            job_adverts_path,
+            enriched_partition_cols,
+            sort_cols=["created", "id"],
+        )
+        save_parquet_dataset(
+            skills, skills_path, enriched_partition_cols, sort_cols=["id"]
+        )
 
 
 class EnrichRelevantJobs(FlowSpec):
+    production = Parameter(
+        "production",
+        help="Whether to save the enriched datasets to s3.",
+        default=False,
+        type=bool,
+    )
+    sample = Parameter(
+        "sample",
+        help="Fraction of relevant job adverts to sample, stratified by sector and month, for development runs. Sampled outputs are not saved.",
+        default=1.0,
+        type=float,
+    )
+    qualification_checkpoint_path = Parameter(
+        "qualification_checkpoint_path",
+        help="Local or s3 directory to checkpoint extracted qualification levels to, so an interrupted run resumes where it left off. Defaults to an s3 directory for unsampled production runs, and to no checkpoints otherwise.",
+        default=None,
+        type=str,
+    )
+    incremental = Parameter(
+        "incremental",
+        help="Whether to only enrich adverts that are new, or whose advert, salary, location, description or skills rows changed, since the saved enriched datasets, and upsert them into the datasets. Changes to the rural/urban lookup or to the enrichment code need a full run.",
+        default=False,
+        type=bool,
+    )
+    near_duplicate_threshold = Parameter(
+        "near_duplicate_threshold",
+        help="Minimum estimated Jaccard similarity of the title and description of near duplicate adverts, which share a near duplicate id and an extracted qualification level.",
+        default=0.8,
+        type=float,
+    )
+
     @step
     def start(self):
         """Start the flow."""
         self.next(self.get_data)
 
     @step
+    @instrument_step(
+        outputs=[
+            "relevant_job_adverts_eyp",
+            "relevant_job_adverts_sim_occ",
+            "salaries",
+            "locations",
+            "skills",
+        ]
+    )
     def get_data(self):
         """Get and prepare relevant datasets."""
         from afs_early_years_labour_market_analysis.getters.ojd_daps import (
@@ -33,30 +452,21 @@ class EnrichRelevantJobs(FlowSpec):
             get_locations,
             get_skills,
         )
-        import afs_early_years_labour_market_analysis.utils.text_cleaning as tc
 
         # get relevant job adverts
-        print("Loading relevant job adverts...")
+        logger.info("Loading relevant job adverts...")
         self.relevant_job_adverts_eyp = get_eyp_relevant_job_adverts()
         self.relevant_job_adverts_sim_occ = get_similar_job_adverts()
 
         # get enrichement data
-        print("Loading enrichment data...")
+        logger.info("Loading enrichment data...")
         self.salaries = get_salaries()
         self.locations = get_locations()
         self.skills = get_skills()
 
-        self.rural_urban_nuts = (
+        self.rural_urban_nuts = prepare_rural_urban_nuts(
             pd.read_csv(
                 "s3://afs-early-years-labour-market-analysis/inputs/rural_urban_nuts.csv"
-            )[["NUTS315CD", "RUC11CD", "RUC11", "Broad_RUC11"]]
-            .assign(itl_3_code=lambda x: x["NUTS315CD"].str.replace("UK", "TL"))
-            .rename(
-                columns={
-                    "RUC11CD": "ruc11_code",
-                    "RUC11": "ruc11",
-                    "Broad_RUC11": "broad_ruc11",
-                }
             )
         )
 
@@ -68,124 +478,148 @@ class EnrichRelevantJobs(FlowSpec):
         ]:
             df["id"] = df["id"].astype(int)
 
-        print("Loading job description data...")
+        if self.sample < 1:
+            # sample adverts, then keep the enrichment data of sampled adverts
+            self.relevant_job_adverts_eyp = stratified_sample(
+                self.relevant_job_adverts_eyp, self.sample, strata_cols=["sector"]
+            )
+            self.relevant_job_adverts_sim_occ = stratified_sample(
+                self.relevant_job_adverts_sim_occ, self.sample, strata_cols=["sector"]
+            )
+            sampled_ids = pd.concat(
+                [
+                    self.relevant_job_adverts_eyp["id"],
+                    self.relevant_job_adverts_sim_occ["id"],
+                ]
+            )
+            self.salaries = filter_to_ids(self.salaries, sampled_ids)
+            self.locations = filter_to_ids(self.locations, sampled_ids)
+            self.skills = filter_to_ids(self.skills, sampled_ids)
+
+        logger.info("Loading job description data...")
         ojd_jobs = pd.read_parquet(
             "s3://open-jobs-lake/latest_output_tables/descriptions.parquet"
         )
-        print("Subsetting OJO job descriptions for EYP relevant job adverts...")
 
-        eyp_job_ids = self.relevant_job_adverts_eyp.id.unique()
+        # near duplicates are found among all relevant adverts, before any are
+        # filtered out as already enriched, so new adverts join the clusters of
+        # enriched ones and enriched adverts whose cluster changes are updated
+        logger.info("Finding near duplicate EYP and similar jobs...")
+        (
+            self.relevant_job_adverts_eyp,
+            self.relevant_job_adverts_sim_occ,
+        ) = add_near_duplicate_ids(
+            [self.relevant_job_adverts_eyp, self.relevant_job_adverts_sim_occ],
+            ojd_jobs,
+            self.near_duplicate_threshold,
+        )
 
-        self.eyp_jobs = (
-            ojd_jobs.query("id in @eyp_job_ids")
-            .assign(clean_description=lambda x: x.description.apply(tc.clean_text))
-            .drop(columns=["description"])
+        # adverts are re-enriched when any data joined onto them changes
+        sources = [self.salaries, self.locations, self.skills, ojd_jobs]
+        self.relevant_job_adverts_eyp = add_source_hash(
+            self.relevant_job_adverts_eyp, sources
         )
+        self.relevant_job_adverts_sim_occ = add_source_hash(
+            self.relevant_job_adverts_sim_occ, sources
+        )
+        if self.incremental:
+            import afs_early_years_labour_market_analysis.getters.ojd_daps as od
+
+            self.relevant_job_adverts_eyp = get_new_or_changed_adverts(
+                self.relevant_job_adverts_eyp,
+                f"s3://{BUCKET_NAME}/{od.enriched_eyp_job_adverts_path}",
+            )
+            self.relevant_job_adverts_sim_occ = get_new_or_changed_adverts(
+                self.relevant_job_adverts_sim_occ,
+                f"s3://{BUCKET_NAME}/{od.enriched_sim_job_adverts_path}",
+            )
+
+        logger.info("Subsetting OJO job descriptions for EYP relevant job adverts...")
+
+        eyp_job_ids = self.relevant_job_adverts_eyp.id.unique()
+
+        self.eyp_jobs = clean_job_descriptions(ojd_jobs, eyp_job_ids)
 
         self.next(self.enrich_data)
 
     @step
+    @instrument_step(
+        inputs=["relevant_job_adverts_eyp", "relevant_job_adverts_sim_occ"],
+        outputs=[
+            "eyp_enriched_relevant_job_adverts_locmetadata",
+            "sim_enriched_relevant_job_adverts_locmetadata",
+        ],
+    )
     def enrich_data(self):
         """Add location, salary and qualification levels to relevant job adverts."""
-        import afs_early_years_labour_market_analysis.utils.data_enrichment as de
-
-        print("Adding location and salaries information...")
-        print("adding itl code and salary information for EYP jobs...")
-        self.eyp_enriched_relevant_job_adverts = (
-            self.relevant_job_adverts_eyp.merge(
-                self.salaries,
-                on="id",
-                how="left",
-            )
-            .merge(self.locations, on="id", how="left")
-            .drop(columns=["job_location_raw_x"])
-            .rename(columns={"job_location_raw_y": "job_location_raw"})
+        logger.info("Adding location and salaries information...")
+        logger.info("adding itl code and salary information for EYP jobs...")
+        self.eyp_enriched_relevant_job_adverts = add_salaries_and_locations(
+            self.relevant_job_adverts_eyp, self.salaries, self.locations
         )
         # add clean descriptions here from eyp_jobs by merging the two dataframes on id
-        print("adding clean descriptions for EYP jobs...")
+        logger.info("adding clean descriptions for EYP jobs...")
         self.eyp_enriched_relevant_job_adverts = (
             self.eyp_enriched_relevant_job_adverts.merge(
                 self.eyp_jobs, on="id", how="left"
             )
         )
-        print("adding itl code and salary information for similar jobs...")
-        self.sim_enriched_relevant_job_adverts = (
-            self.relevant_job_adverts_sim_occ.merge(
-                self.salaries,
-                on="id",
-                how="left",
-            )
-            .merge(self.locations, on="id", how="left")
-            .drop(columns=["job_location_raw_x"])
-            .rename(columns={"job_location_raw_y": "job_location_raw"})
+        logger.info("adding itl code and salary information for similar jobs...")
+        self.sim_enriched_relevant_job_adverts = add_salaries_and_locations(
+            self.relevant_job_adverts_sim_occ, self.salaries, self.locations
         )
 
-        # replace old nuts 3 codes for london to merged TL code
-        print(
+        # classify itl 3 codes, with london codes merged, as rural or urban
+        logger.info(
             "adding rural/urban classification information for EYP and similar jobs..."
         )
-        itl_london_codes = self.rural_urban_nuts[
-            self.rural_urban_nuts["NUTS315CD"].isin(de.london_nuts_3)
-        ]["itl_3_code"].to_list()
-
-        self.rural_urban_nuts["itl_3_code"] = self.rural_urban_nuts[
-            "itl_3_code"
-        ].replace(itl_london_codes, "TLI")
-        # this is where the bug was - drop duplicates on itl_3_code
-        self.rural_urban_nuts.drop_duplicates(subset=["itl_3_code"], inplace=True)
-
-        self.eyp_enriched_relevant_job_adverts_locmetadata = pd.merge(
-            self.eyp_enriched_relevant_job_adverts,
-            self.rural_urban_nuts,
-            on="itl_3_code",
-            how="left",
-        ).drop(columns=["NUTS315CD"])
+        self.eyp_enriched_relevant_job_adverts_locmetadata = (
+            add_rural_urban_classification(
+                self.eyp_enriched_relevant_job_adverts, self.rural_urban_nuts
+            )
+        )
 
-        print("Extracting qualification level for EYP data...")
-        clean_descs = (
-            self.eyp_enriched_relevant_job_adverts_locmetadata.query(
-                "~clean_description.isna()"
+        self.sim_enriched_relevant_job_adverts_locmetadata = (
+            add_rural_urban_classification(
+                self.sim_enriched_relevant_job_adverts, self.rural_urban_nuts
             )
-            .clean_description.unique()
-            .tolist()
-        )
-        clean_desc2qual = {}
-        for i, desc in enumerate(clean_descs):
-            if i % 500 == 0:
-                print(
-                    "Extracting qualification level for EYP data... {}/{}".format(
-                        i, len(clean_descs)
-                    )
-                )
-            clean_desc2qual[desc] = de.get_qualification_level(desc)
+        )
 
+        logger.info("Extracting qualification level for EYP data...")
+        # only runs whose outputs are saved checkpoint to s3 by default
+        qualification_checkpoint_path = self.qualification_checkpoint_path or (
+            production_qualification_checkpoint_path
+            if self.production and self.sample == 1
+            else None
+        )
         self.eyp_enriched_relevant_job_adverts_locmetadata[
             "qualification_level"
-        ] = self.eyp_enriched_relevant_job_adverts_locmetadata.clean_description.map(
-            clean_desc2qual
+        ] = get_qualification_levels(
+            self.eyp_enriched_relevant_job_adverts_locmetadata.clean_description,
+            qualification_checkpoint_path,
+            self.eyp_enriched_relevant_job_adverts_locmetadata.near_duplicate_id,
         )
 
-        self.sim_enriched_relevant_job_adverts_locmetadata = pd.merge(
-            self.sim_enriched_relevant_job_adverts,
-            self.rural_urban_nuts,
-            on="itl_3_code",
-            how="left",
-        ).drop(columns=["NUTS315CD"])
-
-        print("getting skills for EYP and similar jobs...")
+        logger.info("getting skills for EYP and similar jobs...")
 
-        self.eyp_relevant_skills = self.relevant_job_adverts_eyp[["id"]].merge(
-            self.skills, on="id", how="inner"
+        self.eyp_relevant_skills = get_relevant_skills(
+            self.relevant_job_adverts_eyp, self.skills
         )
-        self.sim_relevant_skills = self.relevant_job_adverts_sim_occ[["id"]].merge(
-            self.skills, on="id", how="inner"
+        self.sim_relevant_skills = get_relevant_skills(
+            self.relevant_job_adverts_sim_occ, self.skills
         )
 
-        print("enrichment complete!")
+        logger.info("enrichment complete!")
 
         self.next(self.save_data)
 
     @step
+    @instrument_step(
+        inputs=[
+            "eyp_enriched_relevant_job_adverts_locmetadata",
+            "sim_enriched_relevant_job_adverts_locmetadata",
+        ]
+    )
     def save_data(self):
         """Save enriched datasets to s3."""
         # save to s3
@@ -193,24 +627,33 @@ class EnrichRelevantJobs(FlowSpec):
             columns=["clean_description"], inplace=True
         )
 
-        if self.production:
-            print("saving data...")
-            self.eyp_enriched_relevant_job_adverts_locmetadata.to_parquet(
-                "s3://afs-early-years-labour-market-analysis/inputs/ojd_daps_extract/enriched_relevant_job_adverts_eyp.parquet",
-                index=False,
-            )
-            self.eyp_relevant_skills.to_parquet(
-                "s3://afs-early-years-labour-market-analysis/inputs/ojd_daps_extract/relevant_skills_eyp.parquet",
-                index=False,
-            )
-            self.sim_enriched_relevant_job_adverts_locmetadata.to_parquet(
-                "s3://afs-early-years-labour-market-analysis/inputs/ojd_daps_extract/enriched_relevant_job_adverts_sim_occs.parquet",
-                index=False,
-            )
-            self.sim_relevant_skills.to_parquet(
-                "s3://afs-early-years-labour-market-analysis/inputs/ojd_daps_extract/relevant_skills_sim_occs.parquet",
-                index=False,
-            )
+        if self.production and self.sample < 1:
+            logger.info("Not saving sampled enriched datasets")
+        elif self.production:
+            import afs_early_years_labour_market_analysis.getters.ojd_daps as od
+
+            logger.info("saving data...")
+            for job_adverts, skills, job_adverts_path, skills_path in [
+                (
+                    self.eyp_enriched_relevant_job_adverts_locmetadata,
+                    self.eyp_relevant_skills,
+                    od.enriched_eyp_job_adverts_path,
+                    od.eyp_skills_path,
+                ),
+                (
+                    self.sim_enriched_relevant_job_adverts_locmetadata,
+                    self.sim_relevant_skills,
+                    od.enriched_sim_job_adverts_path,
+                    od.sim_skills_path,
+                ),
+            ]:
+                save_enriched_datasets(
+                    job_adverts,
+                    skills,
+                    f"s3://{BUCKET_NAME}/{job_adverts_path}",
+                    f"s3://{BUCKET_NAME}/{skills_path}",
+                    upsert=self.incremental,
+                )
 
         else:
             pass
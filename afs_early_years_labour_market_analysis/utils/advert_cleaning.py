@@ -0,0 +1,153 @@
+"""
+Functions to deduplicate and clean the combined EYP and similar job adverts.
+
+Duplicate adverts are found with a 64-bit hash of each row's normalised key
+columns. Key columns are factorized so text is only normalised and hashed
+once per unique value. Every filter is combined into a single row mask, so
+the adverts are copied once, and time columns are derived from datetime64
+arithmetic rather than string round trips. Cleaned adverts are sorted by date,
+so periods can be sliced with utils.time_index.TimeIndex.
+"""
+import time
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from afs_early_years_labour_market_analysis import logger
+import afs_early_years_labour_market_analysis.utils.geography as geo
+
+# adverts posted on the same day, with the same title in the same location
+dedupe_cols = ["location", "job_title_raw", "created"]
+
+# repetitive text columns stored as categoricals once cleaned
+categorical_cols = ["location", "job_title_raw", "itl_3_name", "year"]
+
+# multiplier to combine the hashes of several columns (64-bit FNV prime)
+_hash_prime = np.uint64(0x100000001B3)
+
+
+def normalise_keys(keys: pd.Series) -> pd.Series:
+    """Normalise text keys by lower casing and collapsing whitespace.
+
+    Args:
+        keys (pd.Series): Text keys.
+
+    Returns:
+        pd.Series: Normalised keys.
+    """
+    return keys.str.lower().str.strip().str.replace(r"\s+", " ", regex=True)
+
+
+def get_row_hashes(df: pd.DataFrame, key_cols: List[str]) -> np.ndarray:
+    """Hash each row's (normalised) key columns into a 64-bit integer.
+
+    Args:
+        df (pd.DataFrame): DataFrame to hash.
+        key_cols (List[str]): Columns to hash. Text columns are normalised.
+
+    Returns:
+        np.ndarray: uint64 hash of each row.
+    """
+    row_hashes = np.zeros(len(df), dtype=np.uint64)
+    for key_col in key_cols:
+        codes, uniques = pd.factorize(df[key_col])
+        uniques = pd.Series(uniques)
+        if uniques.dtype == object:
+            uniques = normalise_keys(uniques.astype(str))
+        # missing keys (-1 codes) gather the trailing hash
+        unique_hashes = np.append(pd.util.hash_array(uniques.values), np.uint64(0))
+        row_hashes = (row_hashes ^ unique_hashes[codes]) * _hash_prime
+
+    return row_hashes
+
+
+def add_time_columns(df: pd.DataFrame, date_col: str = "created"):
+    """Add year and month_year columns in place.
+
+    Args:
+        df (pd.DataFrame): DataFrame with a datetime64 date_col column.
+        date_col (str, optional): Date column. Defaults to "created".
+    """
+    dates = df[date_col].values
+    years = dates.astype("datetime64[Y]").astype(int) + 1970
+    df["year"] = pd.Categorical(years).rename_categories(str)
+    df["month_year"] = dates.astype("datetime64[M]").astype("datetime64[ns]")
+
+
+def clean_job_adverts(
+    all_jobs: pd.DataFrame,
+    professions_to_include: List[str],
+    min_date: str = "2021-04-01",
+    key_cols: List[str] = dedupe_cols,
+    categorical_cols: List[str] = categorical_cols,
+    log_memory: bool = True,
+) -> pd.DataFrame:
+    """Clean job adverts by dropping duplicates, early adverts, adverts outside
+    England and other professions, and adding time variables.
+
+    Args:
+        all_jobs (pd.DataFrame): All enriched job adverts.
+        professions_to_include (List[str]): Professions to keep.
+        min_date (str, optional): Earliest date to keep adverts from.
+            Defaults to "2021-04-01".
+        key_cols (List[str], optional): Columns identifying duplicate adverts,
+            of which the first is kept. Defaults to dedupe_cols.
+        categorical_cols (List[str], optional): Columns to store as
+            categoricals. Defaults to categorical_cols.
+        log_memory (bool, optional): Whether to log the memory used by the
+            adverts before and after cleaning. Defaults to True.
+
+    Returns:
+        pd.DataFrame: Cleaned job adverts, sorted by date.
+    """
+    start = time.perf_counter()
+    created = pd.to_datetime(all_jobs["created"])
+
+    # make sure its after april given feedback
+    is_recent = (created >= pd.Timestamp(min_date)).values
+    # adverts are deduplicated within the analysed period, but other professions
+    # must count as duplicates
+    keys = pd.DataFrame(
+        {
+            col: (created if col == "created" else all_jobs[col]).values[is_recent]
+            for col in key_cols
+        }
+    )
+    is_first_advert = np.zeros(len(all_jobs), dtype=bool)
+    is_first_advert[is_recent] = ~pd.Series(get_row_hashes(keys, key_cols)).duplicated()
+    is_clean = (
+        is_first_advert
+        # only keep adverts in england
+        & geo.is_england(all_jobs["itl_3_code"]).values
+        & all_jobs["profession"].isin(professions_to_include).values
+    )
+
+    # sort clean adverts by date as they are copied, keeping the order of
+    # adverts posted on the same day
+    clean_positions = np.flatnonzero(is_clean)
+    clean_positions = clean_positions[
+        np.argsort(created.values[clean_positions], kind="stable")
+    ]
+    all_jobs_clean = all_jobs.iloc[
+        clean_positions, np.flatnonzero(all_jobs.columns != "is_large_geo")
+    ]
+    all_jobs_clean["created"] = created.values[clean_positions]
+    # Create a series of time variables to help with analysis
+    add_time_columns(all_jobs_clean)
+    for col in categorical_cols:
+        all_jobs_clean[col] = all_jobs_clean[col].astype("category")
+
+    logger.info(
+        f"Cleaned {len(all_jobs)} job adverts into {len(all_jobs_clean)} "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    if log_memory:
+        memory_before = all_jobs.memory_usage(deep=True).sum() / 1e6
+        memory_after = all_jobs_clean.memory_usage(deep=True).sum() / 1e6
+        logger.info(
+            f"Job adverts used {memory_before:.1f}MB before cleaning and "
+            f"{memory_after:.1f}MB after"
+        )
+
+    return all_jobs_clean
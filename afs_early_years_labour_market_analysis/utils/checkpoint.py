@@ -0,0 +1,222 @@
+"""
+Functions to checkpoint long-running maps over many items, so they can resume
+after a crash or preemption rather than starting again.
+
+Results are keyed by a hash of each item and periodically flushed as small
+jsonl part files to a local or s3 checkpoint directory. Each part is written
+in full before it appears under its final name, so a run interrupted mid-write
+never leaves a partial part behind. On restart, every part is loaded and only
+items without a checkpointed result are processed.
+"""
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import hashlib
+import itertools
+import json
+import os
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from afs_early_years_labour_market_analysis import logger
+from afs_early_years_labour_market_analysis.utils.parallel import apply_chunk
+from afs_early_years_labour_market_analysis.utils.progress import log_progress
+
+
+# items sent to a worker process at a time
+worker_batch_size = 100
+
+
+def get_checkpoint_key(item: str) -> str:
+    """Get the checkpoint key of an item from a hash of its text.
+
+    Args:
+        item (str): Item, e.g. a job description.
+
+    Returns:
+        str: Checkpoint key.
+    """
+    return hashlib.sha1(str(item).encode()).hexdigest()
+
+
+def load_checkpoint(checkpoint_path: str) -> Dict[str, Any]:
+    """Load every checkpointed result.
+
+    Args:
+        checkpoint_path (str): Local or s3 checkpoint directory.
+
+    Returns:
+        Dict[str, Any]: Results keyed by checkpoint key.
+    """
+    import fsspec
+
+    fs, path = fsspec.core.url_to_fs(checkpoint_path)
+    results = {}
+    for part_path in sorted(fs.glob(f"{path.rstrip('/')}/part-*.jsonl")):
+        with fs.open(part_path, "r") as f:
+            for line in f:
+                result = json.loads(line)
+                results[result["key"]] = result["value"]
+
+    return results
+
+
+def save_checkpoint_part(results: Dict[str, Any], checkpoint_path: str):
+    """Save results as a new checkpoint part.
+
+    Args:
+        results (Dict[str, Any]): Json serialisable results keyed by
+            checkpoint key.
+        checkpoint_path (str): Local or s3 checkpoint directory.
+    """
+    import fsspec
+
+    fs, path = fsspec.core.url_to_fs(checkpoint_path)
+    fs.makedirs(path, exist_ok=True)
+    part_path = f"{path.rstrip('/')}/part-{time.time_ns()}.jsonl"
+    # s3 objects only appear once fully written, local files once renamed
+    write_path = part_path if "s3" in fs.protocol else f"{part_path}.tmp"
+    with fs.open(write_path, "w") as f:
+        for key, value in results.items():
+            f.write(json.dumps({"key": key, "value": value}) + "\n")
+    if write_path != part_path:
+        fs.mv(write_path, part_path)
+
+
+def map_in_batches(
+    func: Callable[[Hashable], Any],
+    items: List[Hashable],
+    batch_size: int,
+    n_workers: Optional[int] = 1,
+) -> Iterator[Tuple[Hashable, Any]]:
+    """Apply func to items in a single process pool, a batch per task,
+    yielding results as their batches complete.
+
+    Workers are started once for the whole map, so expensive per process
+    state (e.g. a spacy model) is only loaded once per worker. Only a few
+    batches per worker are in flight at a time, so results can be flushed as
+    they arrive.
+
+    Args:
+        func (Callable[[Hashable], Any]): Picklable function to apply to each
+            item.
+        items (List[Hashable]): Items to apply func to.
+        batch_size (int): Items per task sent to a worker. Ignored when
+            n_workers is 1, where items are processed one at a time.
+        n_workers (Optional[int], optional): Number of worker processes, or
+            None for the number of CPUs. Defaults to 1.
+
+    Yields:
+        Iterator[Tuple[Hashable, Any]]: Each item and its result, in order of
+            completion.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    if n_workers == 1:
+        for item in items:
+            yield item, func(item)
+        return
+
+    batches = iter(
+        items[start : start + batch_size] for start in range(0, len(items), batch_size)
+    )
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        in_flight = {}
+        for batch in itertools.islice(batches, n_workers * 2):
+            in_flight[executor.submit(apply_chunk, func, batch)] = batch
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = in_flight.pop(future)
+                yield from zip(batch, future.result())
+                next_batch = next(batches, None)
+                if next_batch is not None:
+                    in_flight[
+                        executor.submit(apply_chunk, func, next_batch)
+                    ] = next_batch
+
+
+def checkpointed_map(
+    func: Callable[[Hashable], Any],
+    items: Iterable[Hashable],
+    checkpoint_path: Optional[str] = None,
+    flush_every: int = 1_000,
+    flush_seconds: float = 300.0,
+    description: str = "Processing items",
+    n_workers: Optional[int] = 1,
+) -> Dict[Hashable, Any]:
+    """Apply func to every item, resuming from and flushing results to a
+    checkpoint.
+
+    Results are flushed every flush_every items or flush_seconds seconds,
+    whichever comes first, and when the map finishes or is interrupted. With
+    more than one worker, items are sent to a single process pool in batches
+    of worker_batch_size, and results are flushed as batches complete.
+
+    Args:
+        func (Callable[[Hashable], Any]): Function with json serialisable
+            results to apply to each item.
+        items (Iterable[Hashable]): Unique items, e.g. job descriptions.
+        checkpoint_path (Optional[str], optional): Local or s3 checkpoint
+            directory. Defaults to None, to not checkpoint.
+        flush_every (int, optional): Items between flushes. Defaults to 1_000.
+        flush_seconds (float, optional): Seconds between flushes.
+            Defaults to 300.0.
+        description (str, optional): Description of the map to log progress
+            with. Defaults to "Processing items".
+        n_workers (Optional[int], optional): Number of worker processes, or
+            None for the number of CPUs. func must then be picklable.
+            Defaults to 1, to process items serially.
+
+    Returns:
+        Dict[Hashable, Any]: Result of each item.
+    """
+    items = list(items)
+    if checkpoint_path is None:
+        return dict(
+            log_progress(
+                map_in_batches(func, items, worker_batch_size, n_workers),
+                description,
+                total=len(items),
+            )
+        )
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    item_keys = {item: get_checkpoint_key(item) for item in items}
+    results = {
+        item: checkpoint[key] for item, key in item_keys.items() if key in checkpoint
+    }
+    todo = [item for item in items if item not in results]
+    logger.info(
+        f"Resuming from {len(results)} checkpointed results in {checkpoint_path}, "
+        f"{len(todo)} items to go"
+    )
+
+    unflushed, last_flush = {}, time.monotonic()
+    try:
+        for item, result in log_progress(
+            map_in_batches(func, todo, worker_batch_size, n_workers),
+            description,
+            total=len(todo),
+        ):
+            results[item] = result
+            unflushed[item_keys[item]] = results[item]
+            if (
+                len(unflushed) >= flush_every
+                or time.monotonic() - last_flush >= flush_seconds
+            ):
+                save_checkpoint_part(unflushed, checkpoint_path)
+                unflushed, last_flush = {}, time.monotonic()
+    finally:
+        # keep completed results even if the map is interrupted
+        if unflushed:
+            save_checkpoint_part(unflushed, checkpoint_path)
+
+    return results
@@ -0,0 +1,143 @@
+"""
+Variables and functions to classify ITL 3 geographies.
+
+Rather than matching every advert's ITL 3 code against a regex, each unique
+code is classified once into a small lookup table. Whole columns are then
+classified by gathering rows of that table with the codes' factorized indices.
+"""
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# ITL 1 regions, which make up the first three characters of an ITL 3 code
+itl_1_regions = {
+    "TLC": "North East",
+    "TLD": "North West",
+    "TLE": "Yorkshire and The Humber",
+    "TLF": "East Midlands",
+    "TLG": "West Midlands",
+    "TLH": "East of England",
+    "TLI": "London",
+    "TLJ": "South East",
+    "TLK": "South West",
+    "TLL": "Wales",
+    "TLM": "Scotland",
+    "TLN": "Northern Ireland",
+}
+
+itl_1_countries = {
+    **{itl_1_code: "England" for itl_1_code in list(itl_1_regions)[:9]},
+    "TLL": "Wales",
+    "TLM": "Scotland",
+    "TLN": "Northern Ireland",
+}
+
+# all London ITL 3 codes are merged into a single London code
+london_itl_code = "TLI"
+
+rural_urban_cols = ["ruc11_code", "ruc11", "broad_ruc11"]
+
+
+def build_itl_3_lookup(
+    itl_3_codes: Iterable[str], rural_urban_nuts: Optional[pd.DataFrame] = None
+) -> pd.DataFrame:
+    """Build a lookup table classifying each unique ITL 3 code.
+
+    Args:
+        itl_3_codes (Iterable[str]): Unique ITL 3 (or old NUTS 3) codes.
+        rural_urban_nuts (Optional[pd.DataFrame], optional): Rural/urban
+            classification with an itl_3_code column. Defaults to None.
+
+    Returns:
+        pd.DataFrame: Lookup table with the ITL 1 code, country, region,
+            London merged ITL 3 code and, if rural_urban_nuts is passed,
+            rural/urban classification of each code.
+    """
+    lookup = pd.DataFrame({"itl_3_code": pd.Series(list(itl_3_codes), dtype=object)})
+    itl_3_code = lookup["itl_3_code"].str.replace("^UK", "TL", regex=True)
+
+    lookup["itl_1_code"] = itl_3_code.str[:3]
+    lookup["country"] = lookup["itl_1_code"].map(itl_1_countries)
+    lookup["region"] = lookup["itl_1_code"].map(itl_1_regions)
+    lookup["is_england"] = lookup["country"].eq("England")
+    lookup["itl_3_code_merged"] = itl_3_code.where(
+        lookup["itl_1_code"] != london_itl_code, london_itl_code
+    )
+
+    if rural_urban_nuts is not None:
+        rural_urban = (
+            rural_urban_nuts.assign(
+                itl_3_code_merged=lambda x: merge_london_codes(x["itl_3_code"])
+            )
+            .drop_duplicates(subset=["itl_3_code_merged"])
+            .set_index("itl_3_code_merged")[rural_urban_cols]
+        )
+        lookup = lookup.join(rural_urban, on="itl_3_code_merged")
+
+    return lookup
+
+
+def classify_itl_3_codes(
+    itl_3_codes: pd.Series,
+    rural_urban_nuts: Optional[pd.DataFrame] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Classify a column of ITL 3 codes in one vectorised gather.
+
+    Args:
+        itl_3_codes (pd.Series): ITL 3 codes, possibly missing.
+        rural_urban_nuts (Optional[pd.DataFrame], optional): Rural/urban
+            classification with an itl_3_code column. Defaults to None.
+        columns (Optional[List[str]], optional): Lookup columns to return.
+            Defaults to all of them.
+
+    Returns:
+        pd.DataFrame: Classification of each code, aligned with itl_3_codes.
+            String columns are returned as categoricals.
+    """
+    codes, uniques = pd.factorize(itl_3_codes)
+    lookup = build_itl_3_lookup(uniques, rural_urban_nuts).drop(columns="itl_3_code")
+
+    classified = {}
+    for col in columns or lookup.columns:
+        if lookup[col].dtype == bool:
+            # missing codes (-1) gather the trailing False
+            classified[col] = np.append(lookup[col].values, False)[codes]
+        else:
+            col_codes, categories = pd.factorize(lookup[col])
+            classified[col] = pd.Categorical.from_codes(
+                np.append(col_codes, -1)[codes], categories=categories
+            )
+
+    return pd.DataFrame(classified, index=itl_3_codes.index)
+
+
+def is_england(itl_3_codes: pd.Series) -> pd.Series:
+    """Flag whether each ITL 3 code is in England.
+
+    Args:
+        itl_3_codes (pd.Series): ITL 3 codes, possibly missing.
+
+    Returns:
+        pd.Series: True if in England, False otherwise.
+    """
+    return classify_itl_3_codes(itl_3_codes, columns=["is_england"])["is_england"]
+
+
+def merge_london_codes(itl_3_codes: pd.Series) -> pd.Series:
+    """Replace all London ITL 3 codes with the merged London code.
+
+    Args:
+        itl_3_codes (pd.Series): ITL 3 (or old NUTS 3) codes.
+
+    Returns:
+        pd.Series: ITL 3 codes with London codes merged.
+    """
+    return (
+        classify_itl_3_codes(itl_3_codes, columns=["itl_3_code_merged"])[
+            "itl_3_code_merged"
+        ]
+        .astype(object)
+        .rename(itl_3_codes.name)
+    )
@@ -0,0 +1,156 @@
+"""
+Functions to inflation adjust salaries in bulk.
+
+Cumulative inflation factors are precomputed once per year (or per month when
+a full CPI series is available) and then gathered for every advert with a
+single NumPy index lookup, rather than recomputing them row by row.
+"""
+
+from typing import Dict, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+
+def get_yearly_inflation_factors(
+    inflation_rate_dict: Dict[Union[str, int], float],
+) -> pd.Series:
+    """Precompute cumulative inflation factors per year.
+
+    The factor for a year compounds the inflation rates of every later year in
+    inflation_rate_dict, so salaries are converted to the prices of the most
+    recent year. An extra entry for the year before the earliest rate covers
+    every earlier year.
+
+    Args:
+        inflation_rate_dict (Dict[Union[str, int], float]): Annual inflation
+            rates keyed by year.
+
+    Returns:
+        pd.Series: Cumulative inflation factor indexed by (int) year.
+    """
+    rates = pd.Series(inflation_rate_dict, dtype=float)
+    rates.index = rates.index.astype(int)
+    rates = rates.sort_index()
+
+    # factor[i] is the product of (1 + rate) for all years after year i
+    growth = np.append(1 + rates.values, 1.0)
+    factors = np.cumprod(growth[::-1])[::-1]
+    years = np.append(rates.index.min() - 1, rates.index.values)
+
+    return pd.Series(factors, index=years, name="inflation_factor")
+
+
+def get_monthly_inflation_factors(
+    cpi: pd.Series, base_month: Optional[str] = None
+) -> pd.Series:
+    """Precompute inflation factors per month from a CPI index series.
+
+    Args:
+        cpi (pd.Series): Monthly CPI index values indexed by date or month period.
+        base_month (Optional[str], optional): Month whose prices salaries are
+            converted to. Defaults to the latest month in cpi.
+
+    Returns:
+        pd.Series: Inflation factor indexed by month period.
+    """
+    cpi = cpi.copy()
+    cpi.index = pd.PeriodIndex(cpi.index, freq="M")
+    cpi = cpi.sort_index().astype(float)
+
+    base_cpi = cpi.iloc[-1] if base_month is None else cpi.loc[pd.Period(base_month)]
+
+    return (base_cpi / cpi).rename("inflation_factor")
+
+
+def gather_yearly_factors(factors: pd.Series, years: np.ndarray) -> np.ndarray:
+    """Look up the cumulative inflation factor for every year in years.
+
+    Args:
+        factors (pd.Series): Output of get_yearly_inflation_factors.
+        years (np.ndarray): Integer years to look up.
+
+    Returns:
+        np.ndarray: Inflation factor per year.
+    """
+    # the latest year in the table that is not after the year being adjusted
+    position = np.searchsorted(factors.index.values, years, side="right") - 1
+    return factors.values[np.clip(position, 0, len(factors) - 1)]
+
+
+def gather_monthly_factors(factors: pd.Series, dates: pd.Series) -> np.ndarray:
+    """Look up the inflation factor for the month of every date in dates.
+
+    Args:
+        factors (pd.Series): Output of get_monthly_inflation_factors.
+        dates (pd.Series): Dates to look up.
+
+    Returns:
+        np.ndarray: Inflation factor per date, NaN for months not in factors.
+    """
+    # consecutive integer month ordinals index straight into a dense array
+    month_ordinals = factors.index.year * 12 + factors.index.month - 1
+    first_month = month_ordinals.min()
+    dense_factors = np.full(month_ordinals.max() - first_month + 2, np.nan)
+    dense_factors[month_ordinals - first_month] = factors.values
+
+    dates = pd.to_datetime(dates)
+    position = (dates.dt.year * 12 + dates.dt.month - 1 - first_month).values
+    # months outside the CPI series (and missing dates) point at the NaN slot
+    position = np.where(
+        (position >= 0) & (position < len(dense_factors) - 1),
+        position,
+        len(dense_factors) - 1,
+    ).astype(int)
+
+    return dense_factors[position]
+
+
+def inflation_adjust_salaries(
+    df: pd.DataFrame,
+    salary_cols: Dict[str, str],
+    year_col: str = "year",
+    date_col: str = "created",
+    inflation_rate_dict: Optional[Dict[Union[str, int], float]] = None,
+    cpi: Optional[pd.Series] = None,
+) -> pd.DataFrame:
+    """Inflation adjust many salary columns at once.
+
+    Uses monthly factors when a CPI series is passed, and annual factors from
+    inflation_rate_dict otherwise. Salaries of 0 are treated as missing.
+
+    Args:
+        df (pd.DataFrame): DataFrame of job adverts.
+        salary_cols (Dict[str, str]): Salary columns to adjust, mapped to the
+            name of their inflation adjusted column.
+        year_col (str, optional): Column with the year of the advert.
+            Defaults to "year".
+        date_col (str, optional): Column with the advert date, used with cpi.
+            Defaults to "created".
+        inflation_rate_dict (Optional[Dict[Union[str, int], float]], optional):
+            Annual inflation rates keyed by year. Defaults to None.
+        cpi (Optional[pd.Series], optional): Monthly CPI series. Defaults to None.
+
+    Returns:
+        pd.DataFrame: df with an inflation adjusted column per salary column.
+    """
+    if cpi is not None:
+        factors = gather_monthly_factors(
+            get_monthly_inflation_factors(cpi), df[date_col]
+        )
+    elif inflation_rate_dict is not None:
+        years = pd.to_numeric(df[year_col]).values.astype(int)
+        factors = gather_yearly_factors(
+            get_yearly_inflation_factors(inflation_rate_dict), years
+        )
+    else:
+        raise ValueError("Either inflation_rate_dict or cpi must be passed.")
+
+    salaries = df[list(salary_cols)].apply(pd.to_numeric).values.astype(float)
+    salaries[salaries == 0] = np.nan
+    adjusted = np.round(salaries * factors[:, None], 2)
+
+    for i, output_col in enumerate(salary_cols.values()):
+        df[output_col] = adjusted[:, i]
+
+    return df
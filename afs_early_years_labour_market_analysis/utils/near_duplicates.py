@@ -0,0 +1,335 @@
+"""
+Functions to find near duplicate job adverts, e.g. agency reposts with
+slightly altered titles or dates, with MinHash and locality sensitive hashing.
+
+Each advert's text (its title and clean description) is split into word
+shingles, and the Jaccard similarity of two adverts' shingle sets is estimated
+by the fraction of MinHash signature values they share. Signatures are split
+into bands, and adverts sharing every value of any band become candidate near
+duplicates. Candidates are kept if their estimated similarity is at least a
+threshold, and clusters are the connected components of the kept pairs.
+
+Every step is vectorised with numpy and linear in the number of shingles, and
+identical texts are only signed once, so millions of adverts can be clustered
+in batches. Clusters are labelled with the smallest advert id they contain,
+so labels are stable across runs. Labels are only comparable between adverts
+clustered together, so cluster every dataset to compare at once.
+"""
+import functools
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from afs_early_years_labour_market_analysis import logger
+from afs_early_years_labour_market_analysis.utils.parallel import parallel_map
+
+# minimum estimated Jaccard similarity of near duplicate adverts
+near_duplicate_threshold = 0.8
+
+# multiplier to combine hashes (64-bit FNV prime)
+_hash_prime = np.uint64(0x100000001B3)
+
+
+def get_optimal_bands(
+    threshold: float, num_perm: int, false_negative_weight: float = 0.9
+) -> Tuple[int, int]:
+    """Get the number of LSH bands, and rows per band, that minimise the
+    weighted probabilities of missing pairs above the threshold and of
+    candidate pairs below it.
+
+    Candidates are verified against the threshold, so missed pairs are weighted
+    above false candidates, which only cost time.
+
+    Args:
+        threshold (float): Jaccard similarity threshold.
+        num_perm (int): Number of MinHash permutations.
+        false_negative_weight (float, optional): Weight of missed pairs, where
+            false candidates have weight 1 - false_negative_weight.
+            Defaults to 0.9.
+
+    Returns:
+        Tuple[int, int]: Number of bands and rows per band.
+    """
+    similarities = np.linspace(0, 1, 1001)
+    best_error, best_bands = np.inf, (1, num_perm)
+    for bands in range(1, num_perm + 1):
+        rows = num_perm // bands
+        is_candidate = 1 - (1 - similarities**rows) ** bands
+        below = similarities < threshold
+        error = (1 - false_negative_weight) * np.trapz(
+            is_candidate[below], similarities[below]
+        ) + false_negative_weight * np.trapz(
+            1 - is_candidate[~below], similarities[~below]
+        )
+        if error < best_error:
+            best_error, best_bands = error, (bands, rows)
+
+    return best_bands
+
+
+def get_shingle_hashes(
+    texts: pd.Series, shingle_size: int = 3
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Hash the word shingles of each text.
+
+    Texts with fewer words than shingle_size get a single shingle of all their
+    words.
+
+    Args:
+        texts (pd.Series): Texts, with a default RangeIndex.
+        shingle_size (int, optional): Words per shingle. Defaults to 3.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: uint64 hash of every shingle, and the
+            position of the text of each shingle, in ascending order.
+    """
+    words = texts.str.lower().str.split(r"\W+", regex=True).explode()
+    words = words[words.notna() & (words != "")]
+    word_hashes = pd.util.hash_array(words.values.astype(str))
+    text_positions = words.index.values
+    if len(words) == 0:
+        return word_hashes, text_positions
+
+    # position of the last word of each word's text
+    is_last = np.append(text_positions[1:] != text_positions[:-1], True)
+    last_words = np.flatnonzero(is_last)
+    text_ends = last_words[np.searchsorted(last_words, np.arange(len(words)))]
+
+    # combine the hashes of each word and the words following it in its text
+    shingle_hashes = word_hashes * _hash_prime
+    for offset in range(1, shingle_size):
+        next_positions = np.arange(len(words)) + offset
+        in_text = next_positions <= text_ends
+        next_hashes = word_hashes[np.minimum(next_positions, len(words) - 1)]
+        shingle_hashes = np.where(
+            in_text, (shingle_hashes ^ next_hashes) * _hash_prime, shingle_hashes
+        )
+
+    # keep shingles of shingle_size words, or the first word of texts with fewer
+    words_left = text_ends - np.arange(len(words))
+    is_first = np.insert(text_positions[1:] != text_positions[:-1], 0, True)
+    is_shingle = (words_left >= shingle_size - 1) | (
+        is_first & (words_left < shingle_size - 1)
+    )
+
+    return shingle_hashes[is_shingle], text_positions[is_shingle]
+
+
+def get_minhash_signatures(
+    texts: pd.Series, num_perm: int = 128, shingle_size: int = 3, seed: int = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the MinHash signature of each text's word shingles.
+
+    Args:
+        texts (pd.Series): Texts, with a default RangeIndex.
+        num_perm (int, optional): Number of MinHash permutations.
+            Defaults to 128.
+        shingle_size (int, optional): Words per shingle. Defaults to 3.
+        seed (int, optional): Seed of the MinHash permutations. Signatures are
+            only comparable if they share a seed. Defaults to 0.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: uint32 signatures of shape
+            (len(texts), num_perm), and whether each text has any words to
+            sign. Texts without words have meaningless signatures.
+    """
+    shingle_hashes, text_positions = get_shingle_hashes(texts, shingle_size)
+    is_signed = np.zeros(len(texts), dtype=bool)
+    is_signed[text_positions] = True
+    text_starts = np.flatnonzero(
+        np.insert(text_positions[1:] != text_positions[:-1], 0, True)
+    )
+
+    # universal hashes (a * x + b) >> 32 with random odd a, one per permutation
+    rng = np.random.default_rng(seed)
+    a = rng.integers(0, 2**64, num_perm, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 2**64, num_perm, dtype=np.uint64)
+    signatures = np.full((len(texts), num_perm), np.iinfo(np.uint32).max, np.uint32)
+    if len(shingle_hashes):
+        for perm in range(num_perm):
+            permuted = ((a[perm] * shingle_hashes + b[perm]) >> np.uint64(32)).astype(
+                np.uint32
+            )
+            signatures[is_signed, perm] = np.minimum.reduceat(permuted, text_starts)
+
+    return signatures, is_signed
+
+
+def get_connected_components(
+    n_nodes: int, sources: np.ndarray, targets: np.ndarray
+) -> np.ndarray:
+    """Label the connected components of an undirected graph.
+
+    Each node is repeatedly pointed to the smallest node it is connected to,
+    until every edge joins nodes with the same label.
+
+    Args:
+        n_nodes (int): Number of nodes.
+        sources (np.ndarray): First node of each edge.
+        targets (np.ndarray): Second node of each edge.
+
+    Returns:
+        np.ndarray: Smallest node of each node's component.
+    """
+    labels = np.arange(n_nodes)
+    while True:
+        source_labels, target_labels = labels[sources], labels[targets]
+        if np.array_equal(source_labels, target_labels):
+            return labels
+        # hook the larger label of each edge onto the smaller
+        min_labels = np.minimum(source_labels, target_labels)
+        np.minimum.at(labels, source_labels, min_labels)
+        np.minimum.at(labels, target_labels, min_labels)
+        # point every node straight at its label's root
+        while True:
+            root_labels = labels[labels]
+            if np.array_equal(root_labels, labels):
+                break
+            labels = root_labels
+
+
+def get_near_duplicate_clusters(
+    texts: pd.Series,
+    threshold: float = near_duplicate_threshold,
+    num_perm: int = 128,
+    shingle_size: int = 3,
+    batch_size: int = 50_000,
+    seed: int = 0,
+    n_workers: Optional[int] = None,
+) -> np.ndarray:
+    """Cluster near duplicate texts.
+
+    Args:
+        texts (pd.Series): Texts, e.g. job titles and clean descriptions.
+        threshold (float, optional): Minimum estimated Jaccard similarity of
+            the shingles of near duplicate texts. Defaults to
+            near_duplicate_threshold.
+        num_perm (int, optional): Number of MinHash permutations.
+            Defaults to 128.
+        shingle_size (int, optional): Words per shingle. Defaults to 3.
+        batch_size (int, optional): Unique texts to shingle and sign at once,
+            to limit memory use. Defaults to 50_000.
+        seed (int, optional): Seed of the MinHash permutations. Defaults to 0.
+        n_workers (Optional[int], optional): Number of processes to sign
+            batches in. Defaults to the number of CPUs.
+
+    Returns:
+        np.ndarray: Cluster of each text, labelled by the position of its
+            first text. Missing and empty texts are clusters of their own.
+    """
+    start = time.perf_counter()
+    codes, uniques = pd.factorize(texts)
+    uniques = pd.Series(uniques, dtype=object)
+
+    batches = [
+        uniques.iloc[batch_start : batch_start + batch_size].reset_index(drop=True)
+        for batch_start in range(0, len(uniques), batch_size)
+    ]
+    batch_signatures = parallel_map(
+        functools.partial(
+            get_minhash_signatures,
+            num_perm=num_perm,
+            shingle_size=shingle_size,
+            seed=seed,
+        ),
+        batches,
+        n_workers,
+        chunk_size=1,
+        min_parallel_size=2,
+    )
+    signatures = np.concatenate(
+        [signatures for signatures, _ in batch_signatures]
+        or [np.empty((0, num_perm), np.uint32)]
+    )
+    is_signed = np.concatenate(
+        [is_signed for _, is_signed in batch_signatures] or [np.empty(0, bool)]
+    )
+    signed = np.flatnonzero(is_signed)
+
+    # texts sharing a band are candidates, and are linked to the first text
+    # in the band if their signatures agree on at least threshold of values
+    bands, rows = get_optimal_bands(threshold, num_perm)
+    sources, targets = [], []
+    for band in range(bands):
+        band_values = signatures[signed, band * rows : (band + 1) * rows]
+        band_codes, _ = pd.factorize(
+            pd.util.hash_pandas_object(pd.DataFrame(band_values), index=False).values
+        )
+        _, first_positions = np.unique(band_codes, return_index=True)
+        band_sources = signed[first_positions[band_codes]]
+        is_candidate = band_sources != signed
+        band_sources, band_targets = band_sources[is_candidate], signed[is_candidate]
+        similarities = (signatures[band_sources] == signatures[band_targets]).mean(1)
+        is_near_duplicate = similarities >= threshold
+        sources.append(band_sources[is_near_duplicate])
+        targets.append(band_targets[is_near_duplicate])
+
+    unique_clusters = get_connected_components(
+        len(uniques),
+        np.concatenate(sources).astype(int) if sources else np.array([], dtype=int),
+        np.concatenate(targets).astype(int) if targets else np.array([], dtype=int),
+    )
+
+    # relabel clusters by the position of their first text, leaving missing
+    # texts and texts without words in clusters of their own
+    positions = np.arange(len(texts))
+    is_clustered = (codes >= 0) & is_signed[np.maximum(codes, 0)]
+    unique_first_positions = np.full(len(uniques), len(texts))
+    np.minimum.at(unique_first_positions, codes[is_clustered], positions[is_clustered])
+    cluster_first_positions = np.full(len(uniques), len(texts))
+    np.minimum.at(cluster_first_positions, unique_clusters, unique_first_positions)
+    clusters = np.where(
+        is_clustered,
+        cluster_first_positions[unique_clusters[np.maximum(codes, 0)]],
+        positions,
+    )
+
+    logger.info(
+        f"Clustered {len(texts)} texts into {len(np.unique(clusters))} near "
+        f"duplicate clusters (threshold {threshold}, {bands} bands of {rows} "
+        f"rows) in {time.perf_counter() - start:.2f}s"
+    )
+
+    return clusters
+
+
+def get_near_duplicate_ids(
+    job_adverts: pd.DataFrame,
+    text_cols: List[str],
+    id_col: str = "id",
+    threshold: float = near_duplicate_threshold,
+    num_perm: int = 128,
+    shingle_size: int = 3,
+) -> pd.Series:
+    """Get the near duplicate cluster of each job advert, labelled by the
+    smallest advert id in the cluster.
+
+    Args:
+        job_adverts (pd.DataFrame): Job adverts.
+        text_cols (List[str]): Text columns to compare adverts on, e.g.
+            ["job_title_raw", "clean_description"].
+        id_col (str, optional): Advert id column. Defaults to "id".
+        threshold (float, optional): Minimum estimated Jaccard similarity of
+            near duplicate adverts. Defaults to near_duplicate_threshold.
+        num_perm (int, optional): Number of MinHash permutations.
+            Defaults to 128.
+        shingle_size (int, optional): Words per shingle. Defaults to 3.
+
+    Returns:
+        pd.Series: Near duplicate id of each advert, aligned with job_adverts.
+    """
+    texts = job_adverts[text_cols[0]].fillna("").astype(str)
+    for text_col in text_cols[1:]:
+        texts = texts + " " + job_adverts[text_col].fillna("").astype(str)
+    clusters = get_near_duplicate_clusters(
+        texts.reset_index(drop=True), threshold, num_perm, shingle_size
+    )
+
+    return (
+        job_adverts[id_col]
+        .groupby(clusters)
+        .transform("min")
+        .rename("near_duplicate_id")
+    )
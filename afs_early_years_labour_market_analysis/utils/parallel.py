@@ -0,0 +1,100 @@
+"""
+A process pool apply for slow, Python level functions over text Series.
+
+Inputs are deduplicated before dispatch, since job titles and descriptions
+repeat a lot across adverts, and only the unique values are split into chunks
+and mapped over a process pool. Results are gathered back into the order and
+index of the input. Small inputs are mapped serially, as starting a process
+pool costs more than it saves.
+
+func must be picklable, i.e. a module level function, for it to be sent to
+the worker processes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# below this many unique values, functions are applied serially
+min_parallel_size = 5_000
+
+
+def apply_chunk(func: Callable, chunk: List) -> List:
+    """Apply a function to every value of a chunk."""
+    return [func(value) for value in chunk]
+
+
+def parallel_map(
+    func: Callable,
+    values: List,
+    n_workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    min_parallel_size: int = min_parallel_size,
+) -> List[Any]:
+    """Map a function over values in a process pool, preserving order.
+
+    Args:
+        func (Callable): Picklable function to apply to each value.
+        values (List): Values to map over.
+        n_workers (Optional[int], optional): Number of worker processes.
+            Defaults to the number of CPUs.
+        chunk_size (Optional[int], optional): Values per chunk sent to a
+            worker. Defaults to splitting values into 4 chunks per worker.
+        min_parallel_size (int, optional): Minimum number of values to map in
+            parallel. Defaults to min_parallel_size.
+
+    Returns:
+        List[Any]: Result of func for each value.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    if len(values) < min_parallel_size or n_workers == 1:
+        return [func(value) for value in values]
+
+    chunk_size = chunk_size or -(-len(values) // (n_workers * 4))
+    chunks = [values[i : i + chunk_size] for i in range(0, len(values), chunk_size)]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        chunk_results = executor.map(apply_chunk, [func] * len(chunks), chunks)
+
+    return [result for chunk_result in chunk_results for result in chunk_result]
+
+
+def parallel_apply(
+    series: pd.Series,
+    func: Callable,
+    n_workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    min_parallel_size: int = min_parallel_size,
+) -> pd.Series:
+    """Apply a function to every value of a Series in a process pool, only
+    once per unique value.
+
+    Args:
+        series (pd.Series): Series to apply func to.
+        func (Callable): Picklable function to apply to each value.
+        n_workers (Optional[int], optional): Number of worker processes.
+            Defaults to the number of CPUs.
+        chunk_size (Optional[int], optional): Unique values per chunk sent to a
+            worker. Defaults to splitting them into 4 chunks per worker.
+        min_parallel_size (int, optional): Minimum number of unique values to
+            apply func to in parallel. Defaults to min_parallel_size.
+
+    Returns:
+        pd.Series: Result of func for each value, with the index and name of
+            series.
+    """
+    codes, uniques = pd.factorize(series)
+    unique_results = parallel_map(
+        func, list(uniques), n_workers, chunk_size, min_parallel_size
+    )
+    results = np.empty(len(series), dtype=object)
+    is_missing = codes < 0
+    results[~is_missing] = pd.Series(unique_results, dtype=object).values[
+        codes[~is_missing]
+    ]
+    # missing values (None, nan, ...) are passed on as they are, as with
+    # Series.apply, but are not deduplicated
+    results[is_missing] = [func(value) for value in series.values[is_missing]]
+
+    return pd.Series(results, index=series.index, name=series.name).infer_objects()
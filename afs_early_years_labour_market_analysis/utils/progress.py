@@ -0,0 +1,55 @@
+"""
+Rate-limited progress logging for long loops.
+
+Logging every iteration (or every n iterations) of a loop over many items
+floods the logs on fast loops and goes quiet on slow ones, so progress is
+instead logged at most once every min_interval seconds.
+"""
+import logging
+import time
+from typing import Iterable, Iterator, Optional, TypeVar
+
+from afs_early_years_labour_market_analysis import logger as package_logger
+
+T = TypeVar("T")
+
+
+def log_progress(
+    iterable: Iterable[T],
+    description: str,
+    total: Optional[int] = None,
+    min_interval: float = 10.0,
+    logger: logging.Logger = package_logger,
+) -> Iterator[T]:
+    """Iterate over an iterable, logging progress at most every min_interval
+    seconds and once on completion.
+
+    Args:
+        iterable (Iterable[T]): Items to iterate over.
+        description (str): Description of the loop to log.
+        total (Optional[int], optional): Number of items. Defaults to the length
+            of iterable, if it has one.
+        min_interval (float, optional): Minimum seconds between progress logs.
+            Defaults to 10.0.
+        logger (logging.Logger, optional): Logger to log to. Defaults to the
+            package logger.
+
+    Yields:
+        Iterator[T]: Items of iterable.
+    """
+    if total is None and hasattr(iterable, "__len__"):
+        total = len(iterable)
+    of_total = f"/{total}" if total is not None else ""
+
+    start = last_log = time.monotonic()
+    i = 0
+    for i, item in enumerate(iterable, 1):
+        yield item
+        now = time.monotonic()
+        if now - last_log >= min_interval:
+            logger.info(
+                f"{description}... {i}{of_total} ({i / (now - start):.1f} per second)"
+            )
+            last_log = now
+
+    logger.info(f"{description}... {i}{of_total} in {time.monotonic() - start:.1f}s")
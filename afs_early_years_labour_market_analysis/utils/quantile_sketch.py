@@ -0,0 +1,354 @@
+"""
+Mergeable quantile sketches to compute salary medians and quartiles without
+materialising or globally sorting every job advert.
+
+KLLSketch implements the KLL sketch (Karnin, Lang and Liberty, 2016). Values
+are ingested in batches, sketches built on different chunks or shards of the
+adverts can be merged, and sketches serialise to json.
+
+Error bounds: a sketch with accuracy parameter k answers quantile queries
+with a normalised rank error of roughly 2 / k with 99% confidence, e.g. the
+"median" returned by a k=200 sketch is a value whose rank is within about 1%
+of n of the true median rank. The error does not depend on the number of
+values ingested, and merging sketches keeps the same bound. Sketches hold
+O(k log(n / k)) values, and are exact while n is at most k.
+
+GroupedQuantileSketch keeps one KLLSketch per group, e.g. per profession,
+qualification level, region or month.
+"""
+from datetime import datetime
+import json
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+import fsspec
+import numpy as np
+import pandas as pd
+
+# capacity of each compactor decays geometrically with its depth
+_capacity_decay = 2 / 3
+_min_capacity = 2
+
+
+class KLLSketch:
+    """KLL quantile sketch.
+
+    Args:
+        k (int, optional): Accuracy parameter, see the module docstring for
+            error bounds. Defaults to 200.
+        seed (Optional[int], optional): Seed for the random compactions.
+            Defaults to None.
+    """
+
+    def __init__(self, k: int = 200, seed: Optional[int] = None):
+        self.k = k
+        self.seed = seed
+        self.n = 0
+        self.min = np.nan
+        self.max = np.nan
+        self.compactors = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        """Capacity of the compactor at a level."""
+        depth = len(self.compactors) - level - 1
+        return max(int(np.ceil(self.k * _capacity_decay**depth)), _min_capacity)
+
+    def _compress(self):
+        """Compact levels until every level is within its capacity."""
+        level = 0
+        while level < len(self.compactors):
+            if len(self.compactors[level]) > self._capacity(level):
+                is_new_level = level + 1 == len(self.compactors)
+                if is_new_level:
+                    self.compactors.append(np.empty(0))
+                items = np.sort(self.compactors[level])
+                # an odd item out stays at this level
+                if len(items) % 2 == 1:
+                    self.compactors[level], items = items[:1], items[1:]
+                else:
+                    self.compactors[level] = np.empty(0)
+                # keep every other item, each now representing twice the weight
+                promoted = items[self._rng.integers(2) :: 2]
+                self.compactors[level + 1] = np.concatenate(
+                    [self.compactors[level + 1], promoted]
+                )
+                # adding a level shrinks the capacity of lower levels
+                level = 0 if is_new_level else level + 1
+            else:
+                level += 1
+
+    def update(self, values: Iterable[float]) -> "KLLSketch":
+        """Ingest a batch of values, ignoring missing values.
+
+        Args:
+            values (Iterable[float]): Values to ingest.
+
+        Returns:
+            KLLSketch: The updated sketch.
+        """
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+
+        self.n += len(values)
+        self.min = np.nanmin([self.min, values.min()])
+        self.max = np.nanmax([self.max, values.max()])
+        self.compactors[0] = np.concatenate([self.compactors[0], values])
+        self._compress()
+
+        return self
+
+    def merge(self, other: "KLLSketch") -> "KLLSketch":
+        """Merge another sketch into this one.
+
+        Args:
+            other (KLLSketch): Sketch to merge, e.g. from another shard.
+
+        Returns:
+            KLLSketch: The merged sketch.
+        """
+        if other.n == 0:
+            return self
+
+        self.n += other.n
+        self.min = np.nanmin([self.min, other.min])
+        self.max = np.nanmax([self.max, other.max])
+        for level, items in enumerate(other.compactors):
+            if level == len(self.compactors):
+                self.compactors.append(np.empty(0))
+            self.compactors[level] = np.concatenate([self.compactors[level], items])
+        self._compress()
+
+        return self
+
+    def quantiles(self, quantiles: List[float]) -> np.ndarray:
+        """Estimate quantiles of the ingested values.
+
+        Args:
+            quantiles (List[float]): Quantiles to estimate, between 0 and 1.
+
+        Returns:
+            np.ndarray: Estimated quantiles, NaN if the sketch is empty.
+        """
+        if self.n == 0:
+            return np.full(len(quantiles), np.nan)
+
+        items = np.concatenate(self.compactors)
+        # an item at level h stands in for 2^h ingested values
+        weights = np.concatenate(
+            [
+                np.full(len(level_items), 2.0**level)
+                for level, level_items in enumerate(self.compactors)
+            ]
+        )
+        order = np.argsort(items, kind="stable")
+        items, cumulative_weights = items[order], np.cumsum(weights[order])
+
+        ranks = np.asarray(quantiles) * cumulative_weights[-1]
+        positions = np.searchsorted(cumulative_weights, ranks, side="left")
+        estimates = items[np.clip(positions, 0, len(items) - 1)]
+
+        # the extremes are tracked exactly
+        estimates = np.where(np.asarray(quantiles) <= 0, self.min, estimates)
+        return np.where(np.asarray(quantiles) >= 1, self.max, estimates)
+
+    def median(self) -> float:
+        """Estimate the median of the ingested values."""
+        return self.quantiles([0.5])[0]
+
+    def to_dict(self) -> Dict:
+        """Serialise the sketch to a json serialisable dict."""
+        return {
+            "k": self.k,
+            "seed": self.seed,
+            "n": self.n,
+            "min": None if np.isnan(self.min) else float(self.min),
+            "max": None if np.isnan(self.max) else float(self.max),
+            "compactors": [items.tolist() for items in self.compactors],
+        }
+
+    @classmethod
+    def from_dict(cls, sketch_dict: Dict) -> "KLLSketch":
+        """Load a sketch serialised with to_dict."""
+        sketch = cls(k=sketch_dict["k"], seed=sketch_dict["seed"])
+        sketch.n = sketch_dict["n"]
+        sketch.min = np.nan if sketch_dict["min"] is None else sketch_dict["min"]
+        sketch.max = np.nan if sketch_dict["max"] is None else sketch_dict["max"]
+        sketch.compactors = [
+            np.asarray(items, dtype=float) for items in sketch_dict["compactors"]
+        ]
+        return sketch
+
+
+def encode_group_value(value: Hashable) -> List:
+    """Encode a group value as json, tagged with its type.
+
+    Args:
+        value (Hashable): Group value, e.g. a profession or month.
+
+    Raises:
+        TypeError: If the value's type is not supported.
+
+    Returns:
+        List: Type tag and json serialisable value.
+    """
+    if value is None:
+        return ["none", None]
+    if isinstance(value, (pd.Timestamp, np.datetime64, datetime)):
+        return ["timestamp", pd.Timestamp(value).isoformat()]
+    # bools are ints, so are checked first
+    if isinstance(value, (bool, np.bool_)):
+        return ["bool", bool(value)]
+    if isinstance(value, (int, np.integer)):
+        return ["int", int(value)]
+    if isinstance(value, (float, np.floating)):
+        return ["float", float(value)]
+    if isinstance(value, str):
+        return ["str", value]
+    raise TypeError(f"Can't serialise group value {value!r} of type {type(value)}")
+
+
+def decode_group_value(tagged_value: List) -> Hashable:
+    """Decode a group value encoded with encode_group_value.
+
+    Args:
+        tagged_value (List): Type tag and json value.
+
+    Returns:
+        Hashable: Group value.
+    """
+    tag, value = tagged_value
+    if tag == "timestamp":
+        return pd.Timestamp(value)
+
+    return {"none": lambda _: None, "bool": bool, "int": int, "float": float}.get(
+        tag, str
+    )(value)
+
+
+class GroupedQuantileSketch:
+    """A KLLSketch per group, e.g. per profession and month.
+
+    Args:
+        group_cols (List[str]): Columns to group values by.
+        k (int, optional): Accuracy parameter of each sketch. Defaults to 200.
+        seed (Optional[int], optional): Seed for the random compactions.
+            Defaults to None.
+    """
+
+    def __init__(self, group_cols: List[str], k: int = 200, seed: Optional[int] = None):
+        self.group_cols = group_cols
+        self.k = k
+        self.seed = seed
+        self.sketches: Dict[Tuple[Hashable, ...], KLLSketch] = {}
+
+    def _get_sketch(self, group: Tuple[Hashable, ...]) -> KLLSketch:
+        """Get the sketch of a group, creating it if needed."""
+        if group not in self.sketches:
+            self.sketches[group] = KLLSketch(k=self.k, seed=self.seed)
+        return self.sketches[group]
+
+    def update(self, df: pd.DataFrame, value_col: str) -> "GroupedQuantileSketch":
+        """Ingest a batch of values, e.g. a chunk of job adverts.
+
+        Args:
+            df (pd.DataFrame): Batch with group_cols and value_col columns.
+            value_col (str): Column of values to sketch, e.g. a salary column.
+
+        Returns:
+            GroupedQuantileSketch: The updated sketches.
+        """
+        for group, values in df.groupby(self.group_cols, sort=False)[value_col]:
+            group = group if isinstance(group, tuple) else (group,)
+            self._get_sketch(group).update(values.values)
+
+        return self
+
+    def merge(self, other: "GroupedQuantileSketch") -> "GroupedQuantileSketch":
+        """Merge another set of grouped sketches, e.g. from another shard.
+
+        Args:
+            other (GroupedQuantileSketch): Grouped sketches to merge.
+
+        Returns:
+            GroupedQuantileSketch: The merged sketches.
+        """
+        for group, sketch in other.sketches.items():
+            self._get_sketch(group).merge(sketch)
+
+        return self
+
+    def quantiles(self, quantiles: List[float] = [0.25, 0.5, 0.75]) -> pd.DataFrame:
+        """Estimate quantiles per group.
+
+        Args:
+            quantiles (List[float], optional): Quantiles to estimate.
+                Defaults to [0.25, 0.5, 0.75].
+
+        Returns:
+            pd.DataFrame: Group columns, count of values and a column per
+                estimated quantile, e.g. q50 for the median.
+        """
+        groups = list(self.sketches)
+        group_quantiles = pd.DataFrame(
+            [self.sketches[group].quantiles(quantiles) for group in groups],
+            columns=[f"q{round(quantile * 100)}" for quantile in quantiles],
+        )
+        group_quantiles.insert(0, "count", [self.sketches[g].n for g in groups])
+        group_values = pd.DataFrame(groups, columns=self.group_cols)
+
+        return (
+            pd.concat([group_values, group_quantiles], axis=1)
+            .sort_values(self.group_cols)
+            .reset_index(drop=True)
+        )
+
+    def save(self, file_name: str):
+        """Save the sketches to a json file, locally or on s3.
+
+        Group values are saved with their types, so loaded sketches merge
+        with sketches of the same groups.
+
+        Args:
+            file_name (str): Path to the json file.
+        """
+        sketches = {
+            "group_cols": self.group_cols,
+            "k": self.k,
+            "seed": self.seed,
+            "sketches": [
+                {
+                    "typed_group": [encode_group_value(value) for value in group],
+                    "sketch": sketch.to_dict(),
+                }
+                for group, sketch in self.sketches.items()
+            ],
+        }
+        with fsspec.open(file_name, "w") as file:
+            json.dump(sketches, file)
+
+    @classmethod
+    def load(cls, file_name: str) -> "GroupedQuantileSketch":
+        """Load sketches saved with save.
+
+        Args:
+            file_name (str): Path to the json file.
+
+        Returns:
+            GroupedQuantileSketch: The loaded sketches.
+        """
+        with fsspec.open(file_name, "r") as file:
+            sketches = json.load(file)
+
+        grouped_sketch = cls(sketches["group_cols"], sketches["k"], sketches["seed"])
+        for group_sketch in sketches["sketches"]:
+            group = (
+                tuple(map(decode_group_value, group_sketch["typed_group"]))
+                if "typed_group" in group_sketch
+                # sketches saved before group types were kept, as strings
+                else tuple(group_sketch["group"])
+            )
+            grouped_sketch.sketches[group] = KLLSketch.from_dict(group_sketch["sketch"])
+
+        return grouped_sketch
@@ -0,0 +1,114 @@
+"""
+Functions to draw reproducible, stratified samples of job adverts for fast
+development runs.
+
+Whether an advert is sampled depends only on a hash of its id, so the same
+adverts are sampled on every run and in every table keyed by advert id. Any
+table can be sampled on its own, or filtered to the ids of sampled adverts,
+and joins between sampled tables stay valid.
+
+Sampling by hash is stratified: adverts are sampled at the same rate in every
+stratum (e.g. sector and month), and the adverts with the smallest hashes of
+small strata are kept so that no stratum is left empty.
+"""
+from typing import Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from afs_early_years_labour_market_analysis import logger
+
+
+def get_id_sample_keys(ids: pd.Series) -> np.ndarray:
+    """Map advert ids to uniformly distributed sample keys in [0, 1).
+
+    Ids are hashed as strings, so integer and string ids of the same advert
+    get the same key.
+
+    Args:
+        ids (pd.Series): Advert ids.
+
+    Returns:
+        np.ndarray: Sample key of each id.
+    """
+    codes, uniques = pd.factorize(ids)
+    unique_hashes = pd.util.hash_array(pd.Series(uniques).astype(str).values)
+    # missing ids (-1 codes) gather the trailing key, which is never sampled
+    unique_keys = np.append(unique_hashes / np.float64(2**64), 1.0)
+
+    return unique_keys[codes]
+
+
+def stratified_sample(
+    df: pd.DataFrame,
+    sample_fraction: float,
+    strata_cols: List[str] = [],
+    date_col: Optional[str] = "created",
+    id_col: str = "id",
+    min_per_stratum: int = 1,
+) -> pd.DataFrame:
+    """Draw a reproducible sample of adverts, stratified by strata_cols and the
+    month of date_col.
+
+    Args:
+        df (pd.DataFrame): Job adverts, or any table keyed by advert id.
+        sample_fraction (float): Fraction of adverts to sample. 1 or more
+            returns df unsampled.
+        strata_cols (List[str], optional): Columns to stratify by, e.g.
+            ["sector"]. Defaults to [].
+        date_col (Optional[str], optional): Date column whose month is also a
+            stratum, or None to not stratify by month. Defaults to "created".
+        id_col (str, optional): Advert id column. Defaults to "id".
+        min_per_stratum (int, optional): Minimum adverts to sample per stratum,
+            where it has that many. Defaults to 1.
+
+    Returns:
+        pd.DataFrame: Sampled rows of df.
+    """
+    if sample_fraction >= 1:
+        return df
+
+    sample_keys = get_id_sample_keys(df[id_col])
+    is_sampled = sample_keys < sample_fraction
+
+    strata = [df[col] for col in strata_cols]
+    if date_col is not None:
+        strata.append(
+            pd.to_datetime(df[date_col]).values.astype("datetime64[M]").astype(int)
+        )
+    if strata and min_per_stratum > 0:
+        # the min_per_stratum smallest keys of each stratum are always sampled
+        key_ranks = (
+            pd.Series(sample_keys, index=df.index)
+            .groupby(strata, dropna=False)
+            .rank(method="dense")
+        )
+        is_sampled |= (key_ranks <= min_per_stratum).values
+
+    sample = df[is_sampled]
+    strata_names = strata_cols + ([f"{date_col} month"] if date_col else [])
+    logger.info(
+        f"Sampled {len(sample)} of {len(df)} rows "
+        f"({sample_fraction:.2%} sample stratified by {strata_names})"
+    )
+
+    return sample
+
+
+def filter_to_ids(df: pd.DataFrame, ids: Iterable, id_col: str = "id") -> pd.DataFrame:
+    """Filter a table to the rows of the given (e.g. sampled) advert ids.
+
+    Args:
+        df (pd.DataFrame): Table keyed by advert id.
+        ids (Iterable): Advert ids to keep.
+        id_col (str, optional): Advert id column. Defaults to "id".
+
+    Returns:
+        pd.DataFrame: Rows of df with an id in ids.
+    """
+    ids = pd.Series(pd.unique(pd.Series(ids)))
+    if ids.dtype != df[id_col].dtype:
+        # ids are stored as strings in some tables and integers in others
+        return df[df[id_col].astype(str).isin(ids.astype(str))]
+
+    return df[df[id_col].isin(ids)]
@@ -0,0 +1,354 @@
+"""
+A small runner for a dependency graph of named, cached analysis stages.
+
+A stage is a function of the outputs of its upstream stages and some
+parameters. Each stage is keyed by a fingerprint of its code, its parameters
+and a content hash of its upstream stages' outputs, and its output is pickled
+to disk under that key. Rerunning the graph only recomputes stages whose code,
+parameters or upstream outputs have changed, so refreshing a load stage
+(run with refresh=True) reruns every stage downstream of it if, and only if,
+the loaded data changed.
+
+A stage's code fingerprint covers the source of its function and of every
+project function or class it references, directly or through other project
+functions, and the module level constants they read. Editing a helper
+invalidates only the stages that may call it, not every stage whose module
+imports the helper's module. Pass a fingerprint (e.g. a data version) to a
+stage to invalidate it for other changes, such as updated data it loads.
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from afs_early_years_labour_market_analysis import PROJECT_DIR, logger
+
+# module level constants read by stage functions are part of their fingerprint
+constant_types = (str, int, float, bool, list, tuple, dict, set, type(None))
+
+
+def is_project_module(module: ModuleType) -> bool:
+    """Check whether a module is a source file of this project, rather than an
+    installed package.
+
+    Args:
+        module (ModuleType): Module.
+
+    Returns:
+        bool: Whether the module's file is in the project directory.
+    """
+    module_path = getattr(module, "__file__", None)
+    if module_path is None:
+        return False
+    module_path = os.path.realpath(module_path)
+
+    return module_path.startswith(str(PROJECT_DIR) + os.sep) and (
+        "site-packages" not in module_path
+    )
+
+
+def get_project_callable(value: Any) -> Optional[Callable]:
+    """Get the project function or class behind a value, if any.
+
+    Args:
+        value (Any): Value, e.g. a global referenced by a function.
+
+    Returns:
+        Optional[Callable]: The unwrapped function or class, if it is defined
+            in a project module, else None.
+    """
+    if isinstance(value, functools.partial):
+        value = value.func
+    if not (inspect.isfunction(value) or inspect.isclass(value)):
+        return None
+    value = inspect.unwrap(value)
+    module = sys.modules.get(getattr(value, "__module__", None) or "")
+    if module is None or not is_project_module(module):
+        return None
+
+    return value
+
+
+def get_code_names(func: Callable) -> Set[str]:
+    """Get the global and attribute names used by a function's code, including
+    its nested functions, lambdas and comprehensions, or by a class's methods.
+
+    Args:
+        func (Callable): Function or class.
+
+    Returns:
+        Set[str]: Names used by the code.
+    """
+    if inspect.isclass(func):
+        names = set()
+        for value in vars(func).values():
+            value = getattr(value, "__func__", getattr(value, "fget", value))
+            if inspect.isfunction(value):
+                names |= get_code_names(value)
+        return names
+
+    names = set()
+    codes = [func.__code__] if hasattr(func, "__code__") else []
+    while codes:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(const for const in code.co_consts if inspect.iscode(const))
+
+    return names
+
+
+def get_function_dependencies(func: Callable) -> Tuple[List[Callable], Dict]:
+    """Get a function and the project functions and classes it references,
+    directly or through other project functions, and the module level
+    constants they read.
+
+    References are found from the names used by each function's code: its
+    globals, and attributes of the project modules it imports (e.g.
+    cl.clean_job_adverts). Functions that are in a referenced module but are
+    never referenced are left out, so editing them does not change the
+    fingerprint.
+
+    Args:
+        func (Callable): Function or class.
+
+    Returns:
+        Tuple[List[Callable], Dict]: The function and its project
+            dependencies, sorted by qualified name, and the values of the
+            json serialisable module level constants they read, by qualified
+            name.
+    """
+    dependencies, constants = {}, {}
+    funcs_to_visit = [get_project_callable(func) or func]
+    while funcs_to_visit:
+        func = funcs_to_visit.pop()
+        func_name = f"{func.__module__}.{func.__qualname__}"
+        if func_name in dependencies:
+            continue
+        dependencies[func_name] = func
+        module = sys.modules.get(func.__module__)
+        module_globals = vars(module) if module is not None else {}
+        names = get_code_names(func)
+        for name in names:
+            if name not in module_globals:
+                continue
+            value = module_globals[name]
+            if isinstance(value, ModuleType):
+                if is_project_module(value):
+                    funcs_to_visit.extend(
+                        get_project_callable(getattr(value, attr, None))
+                        for attr in names
+                    )
+            elif isinstance(value, constant_types):
+                constants[f"{func.__module__}.{name}"] = value
+            else:
+                funcs_to_visit.append(get_project_callable(value))
+        funcs_to_visit = [f for f in funcs_to_visit if f is not None]
+
+    return [dependencies[name] for name in sorted(dependencies)], constants
+
+
+def get_function_fingerprint(func: Callable) -> str:
+    """Fingerprint a function by its source code and the source of the project
+    functions it may call.
+
+    Args:
+        func (Callable): Function, or class, to fingerprint.
+
+    Returns:
+        str: Hash of the source, or of the bytecode if the source is not
+            available, of the function and its project dependencies, and of
+            the module level constants they read.
+    """
+    dependencies, constants = get_function_dependencies(func)
+    fingerprint = hashlib.sha1()
+    for dependency in dependencies:
+        try:
+            source = inspect.getsource(dependency).encode()
+        except (OSError, TypeError):
+            source = getattr(dependency, "__code__", None)
+            source = source.co_code if source is not None else b""
+        fingerprint.update(dependency.__qualname__.encode())
+        fingerprint.update(source)
+    fingerprint.update(json.dumps(constants, sort_keys=True, default=str).encode())
+
+    return fingerprint.hexdigest()
+
+
+def write_output_hash(hash_path: str, output_hash: str):
+    """Write the content hash of a stage's output next to it.
+
+    Args:
+        hash_path (str): Path to write the hash to.
+        output_hash (str): Hash of the pickled stage output.
+    """
+    with open(hash_path, "w") as f:
+        f.write(output_hash)
+
+
+class StageRunner:
+    """Run a graph of named stages, caching their outputs on disk.
+
+    Args:
+        cache_path (str): Directory to pickle stage outputs to.
+    """
+
+    def __init__(self, cache_path: str):
+        self.cache_path = cache_path
+        self.stages = {}
+        self._keys = {}
+        # outputs are held by stage key, so outputs of stale keys are not reused
+        self._outputs = {}
+
+    def add_stage(
+        self,
+        name: str,
+        func: Callable,
+        inputs: List[str] = [],
+        params: Optional[Dict[str, Any]] = None,
+        fingerprint: str = "",
+    ) -> "StageRunner":
+        """Add a stage to the graph.
+
+        Args:
+            name (str): Name of the stage.
+            func (Callable): Function computing the stage's output, called with
+                the outputs of the input stages followed by params as keyword
+                arguments.
+            inputs (List[str], optional): Names of upstream stages whose
+                outputs are passed to func. Defaults to [].
+            params (Optional[Dict[str, Any]], optional): Keyword arguments
+                passed to func. Must be json serialisable. Defaults to None.
+            fingerprint (str, optional): Extra value to key the stage by, e.g.
+                a version of data loaded by the stage. Defaults to "".
+
+        Returns:
+            StageRunner: The runner, to chain add_stage calls.
+        """
+        for input_name in inputs:
+            if input_name not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {input_name}")
+
+        self.stages[name] = {
+            "func": func,
+            "inputs": inputs,
+            "params": params or {},
+            "fingerprint": fingerprint,
+        }
+        # a redefined stage invalidates its own and downstream keys
+        self._keys = {}
+
+        return self
+
+    def get_stage_key(self, name: str) -> str:
+        """Get the key of a stage from its code, params and the content hashes
+        of its upstream outputs.
+
+        Upstream stages are run if their outputs are not cached.
+
+        Args:
+            name (str): Name of the stage.
+
+        Returns:
+            str: Stage key.
+        """
+        if name not in self._keys:
+            stage = self.stages[name]
+            stage_fingerprint = json.dumps(
+                {
+                    "name": name,
+                    "func": get_function_fingerprint(stage["func"]),
+                    "params": stage["params"],
+                    "fingerprint": stage["fingerprint"],
+                    "inputs": [self.get_output_hash(i) for i in stage["inputs"]],
+                },
+                sort_keys=True,
+                default=str,
+            )
+            self._keys[name] = hashlib.sha1(stage_fingerprint.encode()).hexdigest()
+
+        return self._keys[name]
+
+    def get_stage_path(self, name: str) -> str:
+        """Get the path a stage's output is cached to.
+
+        Args:
+            name (str): Name of the stage.
+
+        Returns:
+            str: Path to the pickled stage output.
+        """
+        return os.path.join(
+            self.cache_path, f"{name}_{self.get_stage_key(name)[:16]}.pkl"
+        )
+
+    def get_output_hash(self, name: str) -> str:
+        """Get the content hash of a stage's output, running the stage if its
+        output is not cached.
+
+        Args:
+            name (str): Name of the stage.
+
+        Returns:
+            str: Hash of the pickled stage output.
+        """
+        stage_path = self.get_stage_path(name)
+        hash_path = f"{stage_path}.sha1"
+        if not os.path.exists(stage_path):
+            self.run(name)
+        if not os.path.exists(hash_path):
+            with open(stage_path, "rb") as f:
+                write_output_hash(hash_path, hashlib.sha1(f.read()).hexdigest())
+
+        with open(hash_path) as f:
+            return f.read().strip()
+
+    def run(self, name: str, refresh: bool = False) -> Any:
+        """Get the output of a stage, running it and its upstream stages if
+        their outputs are not cached.
+
+        Args:
+            name (str): Name of the stage.
+            refresh (bool, optional): Whether to rerun the stage even if its
+                output is cached. Upstream stages are still loaded from the
+                cache, and downstream stages are rerun when next requested if
+                the stage's output changed. Defaults to False.
+
+        Returns:
+            Any: Output of the stage.
+        """
+        stage_key = self.get_stage_key(name)
+        if stage_key in self._outputs and not refresh:
+            return self._outputs[stage_key]
+
+        stage_path = self.get_stage_path(name)
+        if os.path.exists(stage_path) and not refresh:
+            logger.info(f"Loading cached {name} stage from {stage_path} ...")
+            with open(stage_path, "rb") as f:
+                output = pickle.load(f)
+        else:
+            stage = self.stages[name]
+            inputs = [self.run(input_name) for input_name in stage["inputs"]]
+            logger.info(f"Running {name} stage ...")
+            output = stage["func"](*inputs, **stage["params"])
+            output_bytes = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+            os.makedirs(self.cache_path, exist_ok=True)
+            with open(stage_path, "wb") as f:
+                f.write(output_bytes)
+            write_output_hash(
+                f"{stage_path}.sha1", hashlib.sha1(output_bytes).hexdigest()
+            )
+            # downstream keys depend on this output, so are recomputed
+            self._keys = {name: stage_key}
+
+        self._outputs[stage_key] = output
+
+        return output
+
+    def __getitem__(self, name: str) -> Any:
+        """Get the output of a stage."""
+        return self.run(name)
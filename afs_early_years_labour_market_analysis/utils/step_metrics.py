@@ -0,0 +1,126 @@
+"""
+A decorator to record the resources used by Metaflow flow steps.
+
+Each instrumented step records its wall time, CPU time, peak memory, the rows
+of its input and output DataFrame artifacts and the bytes it read and wrote.
+Metrics are logged through the package logger as json and accumulated in a
+step_metrics artifact keyed by step name, so they can be compared across runs
+with the Metaflow client.
+
+    @step
+    @instrument_step(inputs=["job_adverts"], outputs=["relevant_job_adverts_eyp"])
+    def refine_relevant_jobs(self):
+        ...
+
+Metaflow runs each step in its own process, so peak memory is the peak
+resident set size of the step's process. Bytes read and written count every
+read and write system call, including to S3, and are only available on Linux.
+"""
+import functools
+import json
+import resource
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+from afs_early_years_labour_market_analysis import logger
+
+
+def get_io_bytes() -> Optional[Dict[str, int]]:
+    """Get the bytes read and written by this process so far.
+
+    Returns:
+        Optional[Dict[str, int]]: Bytes read and written, or None where
+            /proc/self/io is not available.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            io_counts = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return None
+
+    return {"read": int(io_counts["rchar"]), "written": int(io_counts["wchar"])}
+
+
+def get_peak_rss_mb() -> float:
+    """Get the peak resident set size of this process in MB."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak_rss / 1e6 if sys.platform == "darwin" else peak_rss / 1e3
+
+
+def count_artifact_rows(flow, artifact_names: List[str]) -> int:
+    """Count the rows of a flow's DataFrame artifacts.
+
+    Args:
+        flow (FlowSpec): Flow being run.
+        artifact_names (List[str]): Names of artifacts to count. Artifacts that
+            are missing or not DataFrames are skipped.
+
+    Returns:
+        int: Total rows of the artifacts.
+    """
+    n_rows = 0
+    for artifact_name in artifact_names:
+        artifact = getattr(flow, artifact_name, None)
+        if isinstance(artifact, pd.DataFrame):
+            n_rows += len(artifact)
+
+    return n_rows
+
+
+def instrument_step(
+    inputs: List[str] = [], outputs: List[str] = []
+) -> Callable[[Callable], Callable]:
+    """Record the resources used by a flow step. Apply below @step.
+
+    Args:
+        inputs (List[str], optional): Names of the DataFrame artifacts the step
+            reads, to count rows in. Defaults to [].
+        outputs (List[str], optional): Names of the DataFrame artifacts the step
+            writes, to count rows out. Defaults to [].
+
+    Returns:
+        Callable[[Callable], Callable]: Decorator adding the step's metrics to
+            the flow's step_metrics artifact.
+    """
+
+    def decorator(step_func: Callable) -> Callable:
+        @functools.wraps(step_func)
+        def instrumented_step(self):
+            io_start = get_io_bytes()
+            cpu_start = time.process_time()
+            wall_start = time.perf_counter()
+
+            step_func(self)
+
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.process_time() - cpu_start
+            io_end = get_io_bytes()
+
+            metrics = {
+                "wall_seconds": round(wall_seconds, 3),
+                "cpu_seconds": round(cpu_seconds, 3),
+                "peak_rss_mb": round(get_peak_rss_mb(), 1),
+                "rows_in": count_artifact_rows(self, inputs),
+                "rows_out": count_artifact_rows(self, outputs),
+                "bytes_read": io_end["read"] - io_start["read"] if io_end else None,
+                "bytes_written": (
+                    io_end["written"] - io_start["written"] if io_end else None
+                ),
+            }
+            logger.info(
+                f"Step {step_func.__name__} metrics: "
+                f"{json.dumps({'step': step_func.__name__, **metrics})}"
+            )
+            # steps inherit their parent's artifacts, so accumulate per flow run
+            self.step_metrics = {
+                **getattr(self, "step_metrics", {}),
+                step_func.__name__: metrics,
+            }
+
+        return instrumented_step
+
+    return decorator
@@ -0,0 +1,161 @@
+"""
+A time index over job adverts sorted by date, to slice them by period without
+scanning or copying them.
+
+Cleaned adverts are sorted by their created date, so the adverts of any date
+range are a contiguous run of rows. TimeIndex finds the run's bounds by binary
+search of the sorted dates, in O(log n), and returns it as a positional slice,
+which pandas selects as a view rather than a copy.
+
+    time_index = TimeIndex(all_jobs_clean)
+    early_jobs = time_index.select(*early_date_range)
+    monthly_counts = {
+        month: rows.stop - rows.start
+        for month, rows in time_index.get_month_slices().items()
+    }
+
+Date ranges are half open, including their start and excluding their end, so
+consecutive ranges sharing a bound never count an advert twice.
+"""
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+Date = Union[str, pd.Timestamp]
+
+
+class TimeIndex:
+    """Binary search index of a DataFrame sorted by date.
+
+    Args:
+        df (pd.DataFrame): DataFrame sorted by date_col, without missing dates.
+        date_col (str, optional): Date column. Defaults to "created".
+
+    Raises:
+        ValueError: If df is not sorted by date_col, or has missing dates.
+    """
+
+    def __init__(self, df: pd.DataFrame, date_col: str = "created"):
+        dates = pd.DatetimeIndex(pd.to_datetime(df[date_col]))
+        if dates.hasnans or not dates.is_monotonic_increasing:
+            raise ValueError(
+                f"Rows must be sorted by {date_col}, without missing dates. "
+                "Use TimeIndex.from_unsorted to sort them."
+            )
+        self.df = df
+        self.date_col = date_col
+        self.dates = dates.values
+
+    @classmethod
+    def from_unsorted(cls, df: pd.DataFrame, date_col: str = "created") -> "TimeIndex":
+        """Sort a DataFrame by date, dropping rows with missing dates, and index
+        it.
+
+        Args:
+            df (pd.DataFrame): DataFrame.
+            date_col (str, optional): Date column. Defaults to "created".
+
+        Returns:
+            TimeIndex: Index of the sorted rows of df.
+        """
+        dates = pd.to_datetime(df[date_col]).values
+        order = np.argsort(dates, kind="stable")
+        # missing dates sort last
+        order = order[~np.isnat(dates[order])]
+
+        return cls(df.iloc[order], date_col)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def get_slice(
+        self, start: Optional[Date] = None, end: Optional[Date] = None
+    ) -> slice:
+        """Get the positions of rows dated from start up to, but excluding, end.
+
+        Args:
+            start (Optional[Date], optional): First date. Defaults to None, for
+                the first row.
+            end (Optional[Date], optional): Date after the last date. Defaults to
+                None, for the last row.
+
+        Returns:
+            slice: Positions of the rows.
+        """
+        start_position = (
+            0
+            if start is None
+            else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start)), "left")
+        )
+        end_position = (
+            len(self.dates)
+            if end is None
+            else np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end)), "left")
+        )
+
+        return slice(int(start_position), int(max(start_position, end_position)))
+
+    def select(
+        self, start: Optional[Date] = None, end: Optional[Date] = None
+    ) -> pd.DataFrame:
+        """Select rows dated from start up to, but excluding, end, without
+        copying them.
+
+        Args:
+            start (Optional[Date], optional): First date. Defaults to None.
+            end (Optional[Date], optional): Date after the last date.
+                Defaults to None.
+
+        Returns:
+            pd.DataFrame: Rows in the date range.
+        """
+        return self.df.iloc[self.get_slice(start, end)]
+
+    def count(self, start: Optional[Date] = None, end: Optional[Date] = None) -> int:
+        """Count rows dated from start up to, but excluding, end.
+
+        Args:
+            start (Optional[Date], optional): First date. Defaults to None.
+            end (Optional[Date], optional): Date after the last date.
+                Defaults to None.
+
+        Returns:
+            int: Number of rows in the date range.
+        """
+        rows = self.get_slice(start, end)
+
+        return rows.stop - rows.start
+
+    def get_period_slices(self, periods: List[Tuple[Date, Date]]) -> List[slice]:
+        """Get the positions of the rows of each (start, end) period.
+
+        Args:
+            periods (List[Tuple[Date, Date]]): Start and end of each period,
+                e.g. [early_date_range, late_date_range].
+
+        Returns:
+            List[slice]: Positions of the rows of each period.
+        """
+        return [self.get_slice(start, end) for start, end in periods]
+
+    def get_month_slices(self) -> Dict[pd.Timestamp, slice]:
+        """Get the positions of the rows of every month, from the first to the
+        last row's month.
+
+        Returns:
+            Dict[pd.Timestamp, slice]: Positions of the rows of each month,
+                keyed by the month's first day.
+        """
+        if len(self.dates) == 0:
+            return {}
+        months = np.arange(
+            self.dates[0].astype("datetime64[M]"),
+            self.dates[-1].astype("datetime64[M]") + 2,
+        )
+        bounds = np.searchsorted(self.dates, months.astype(self.dates.dtype), "left")
+
+        return {
+            pd.Timestamp(month): slice(int(start), int(end))
+            for month, start, end in zip(months[:-1], bounds[:-1], bounds[1:])
+        }
@@ -0,0 +1,219 @@
+"""
+A nearest neighbour classifier assigning job advert titles to professions.
+
+Canonical job titles of each profession (config/job_titles.yaml) are embedded
+as TF-IDF vectors of their character n-grams. Cleaned advert titles are
+embedded with the same vocabulary, so only n-grams of canonical titles count,
+and each title is assigned the profession of its most cosine similar canonical
+title if that similarity is at least a threshold. Unlike substring rules, this
+tolerates misspellings, word order and extra words ("nursery nurse level 3",
+"lvl 3 nursery nurse") without listing every variant.
+
+Words about seniority, hours or contracts ("senior", "part time") are removed
+from advert titles first, as they are shared by titles of every profession.
+
+Titles are deduplicated, then searched in batches with sparse matrix products,
+so classifying millions of adverts only costs one search per unique title.
+"""
+from pathlib import Path
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from afs_early_years_labour_market_analysis import get_yaml_config
+
+job_titles_config_path = Path(__file__).parents[1] / "config/job_titles.yaml"
+
+# minimum cosine similarity of an advert title to its nearest canonical title
+title_similarity_threshold = 0.7
+
+
+def load_canonical_job_titles(
+    config_path: Path = job_titles_config_path,
+) -> Tuple[Dict[str, List[str]], List[str], List[str]]:
+    """Load the canonical job titles of each profession.
+
+    Args:
+        config_path (Path, optional): Job titles config. Defaults to
+            job_titles_config_path.
+
+    Returns:
+        Tuple[Dict[str, List[str]], List[str], List[str]]: Canonical titles of
+            each profession, titles not assigned a profession and words
+            ignored in advert titles.
+    """
+    job_titles_config = get_yaml_config(config_path)
+
+    return (
+        job_titles_config["professions"],
+        job_titles_config.get("other_titles", []),
+        job_titles_config.get("ignored_words", []),
+    )
+
+
+class JobTitleClassifier:
+    """Assign job titles the profession of their nearest canonical title.
+
+    Args:
+        canonical_titles (Dict[str, List[str]]): Canonical titles of each
+            profession.
+        other_titles (List[str], optional): Titles close to, but not in, any
+            profession. Job titles nearest to these are not assigned a
+            profession. Defaults to [].
+        ignored_words (List[str], optional): Words to remove from job titles
+            before searching them. Defaults to [].
+        ngram_range (Tuple[int, int], optional): Lengths of character n-grams
+            to embed titles with. Defaults to (3, 5).
+        threshold (float, optional): Minimum cosine similarity of a job title
+            to its nearest canonical title to be assigned a profession.
+            Defaults to title_similarity_threshold.
+    """
+
+    def __init__(
+        self,
+        canonical_titles: Dict[str, List[str]],
+        other_titles: List[str] = [],
+        ignored_words: List[str] = [],
+        ngram_range: Tuple[int, int] = (3, 5),
+        threshold: float = title_similarity_threshold,
+    ):
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        self.threshold = threshold
+        self.ignored_words = (
+            re.compile(r"\b(?:{})\b".format("|".join(map(re.escape, ignored_words))))
+            if ignored_words
+            else None
+        )
+        self.titles = [
+            title for titles in canonical_titles.values() for title in titles
+        ] + list(other_titles)
+        self.professions = np.array(
+            [
+                profession
+                for profession, titles in canonical_titles.items()
+                for _ in titles
+            ]
+            + [None] * len(other_titles),
+            dtype=object,
+        )
+        self.vectorizer = TfidfVectorizer(
+            analyzer="char_wb", ngram_range=ngram_range, sublinear_tf=True
+        )
+        # (n_features, n_titles), so a batch of embedded titles is searched by
+        # a single sparse matrix product
+        self.index = self.vectorizer.fit_transform(
+            self._remove_ignored_words(self.titles)
+        ).T.tocsc()
+
+    def _remove_ignored_words(self, titles: List[str]) -> List[str]:
+        """Remove ignored words from titles."""
+        if self.ignored_words is None:
+            return titles
+
+        return [self.ignored_words.sub(" ", title) for title in titles]
+
+    @classmethod
+    def from_config(
+        cls,
+        config_path: Path = job_titles_config_path,
+        threshold: float = title_similarity_threshold,
+    ) -> "JobTitleClassifier":
+        """Build a classifier of the canonical titles in a job titles config.
+
+        Args:
+            config_path (Path, optional): Job titles config. Defaults to
+                job_titles_config_path.
+            threshold (float, optional): Minimum similarity to be assigned a
+                profession. Defaults to title_similarity_threshold.
+
+        Returns:
+            JobTitleClassifier: Classifier.
+        """
+        canonical_titles, other_titles, ignored_words = load_canonical_job_titles(
+            config_path
+        )
+
+        return cls(canonical_titles, other_titles, ignored_words, threshold=threshold)
+
+    def search(
+        self, titles: List[str], top_k: int = 1, batch_size: int = 10_000
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the top_k most similar canonical titles of each title.
+
+        Args:
+            titles (List[str]): Job titles.
+            top_k (int, optional): Number of canonical titles to find.
+                Defaults to 1.
+            batch_size (int, optional): Titles to search at once, to limit
+                memory use. Defaults to 10_000.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Positions in self.titles and cosine
+                similarities of the top_k canonical titles of each title, of
+                shape (len(titles), top_k), most similar first.
+        """
+        top_k = min(top_k, len(self.titles))
+        nearest = np.empty((len(titles), top_k), dtype=int)
+        similarities = np.empty((len(titles), top_k))
+        for start in range(0, len(titles), batch_size):
+            batch = titles[start : start + batch_size]
+            batch_similarities = (
+                self.vectorizer.transform(self._remove_ignored_words(batch))
+                @ self.index
+            ).toarray()
+            batch_nearest = np.argpartition(-batch_similarities, top_k - 1, axis=1)[
+                :, :top_k
+            ]
+            batch_top = np.take_along_axis(batch_similarities, batch_nearest, axis=1)
+            order = np.argsort(-batch_top, axis=1, kind="stable")
+            nearest[start : start + len(batch)] = np.take_along_axis(
+                batch_nearest, order, axis=1
+            )
+            similarities[start : start + len(batch)] = np.take_along_axis(
+                batch_top, order, axis=1
+            )
+
+        return nearest, similarities
+
+    def classify(self, titles: pd.Series, batch_size: int = 10_000) -> pd.DataFrame:
+        """Assign each job title the profession of its nearest canonical title.
+
+        Args:
+            titles (pd.Series): Cleaned job titles.
+            batch_size (int, optional): Unique titles to search at once.
+                Defaults to 10_000.
+
+        Returns:
+            pd.DataFrame: Nearest canonical title ("matched_job_title"), its
+                similarity ("title_similarity") and profession ("profession")
+                of each title, aligned with titles. Profession is missing where
+                the similarity is below the threshold, the nearest title is not
+                in a profession, or the title is missing.
+        """
+        codes, uniques = pd.factorize(titles)
+        nearest, similarities = self.search(
+            list(uniques.astype(str)), batch_size=batch_size
+        )
+        matched_titles = np.array(self.titles + [None], dtype=object)[
+            np.append(nearest[:, 0], len(self.titles))
+        ]
+        professions = np.append(
+            np.where(
+                similarities[:, 0] >= self.threshold,
+                self.professions[nearest[:, 0]],
+                None,
+            ),
+            None,
+        )
+        # missing titles (-1 codes) gather the trailing missing values
+        return pd.DataFrame(
+            {
+                "matched_job_title": matched_titles[codes],
+                "title_similarity": np.append(similarities[:, 0], np.nan)[codes],
+                "profession": professions[codes],
+            },
+            index=titles.index,
+        )
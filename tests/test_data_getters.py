@@ -0,0 +1,126 @@
+import os
+
+import pandas as pd
+import pytest
+
+from afs_early_years_labour_market_analysis.getters.data_getters import (
+    add_date_partition_cols,
+    load_parquet_dataset,
+    save_parquet_dataset,
+    upsert_parquet_dataset,
+)
+
+partition_cols = ["sector", "year", "month"]
+
+
+def make_job_adverts(ids, created, titles=None) -> pd.DataFrame:
+    return add_date_partition_cols(
+        pd.DataFrame(
+            {
+                "id": ids,
+                "sector": "Nanny",
+                "created": pd.to_datetime(created),
+                "job_title_raw": titles or [f"nanny {i}" for i in ids],
+            }
+        )
+    )
+
+
+def load_dataset(dataset_path: str) -> pd.DataFrame:
+    dataset = load_parquet_dataset(dataset_path)
+    for col in partition_cols:
+        dataset[col] = dataset[col].astype(str)
+    return dataset.sort_values("id").reset_index(drop=True)
+
+
+def get_partition_dirs(dataset_path: str) -> set:
+    return {
+        os.path.relpath(root, dataset_path)
+        for root, _, files in os.walk(dataset_path)
+        if files
+    }
+
+
+@pytest.fixture
+def dataset_path(tmp_path) -> str:
+    dataset_path = str(tmp_path / "job_adverts")
+    save_parquet_dataset(
+        make_job_adverts([1, 2], ["2022-01-10", "2022-02-10"]),
+        dataset_path,
+        partition_cols,
+        sort_cols=["id"],
+    )
+    return dataset_path
+
+
+def test_upsert_inserts_new_ids(dataset_path):
+    upsert_parquet_dataset(
+        make_job_adverts([3], ["2022-01-20"]), dataset_path, partition_cols, ["id"]
+    )
+
+    dataset = load_dataset(dataset_path)
+    assert dataset["id"].tolist() == [1, 2, 3]
+    assert dataset["month"].tolist() == ["1", "2", "1"]
+
+
+def test_upsert_moves_ids_whose_month_changed(dataset_path):
+    upsert_parquet_dataset(
+        make_job_adverts([2], ["2022-03-10"], ["senior nanny"]),
+        dataset_path,
+        partition_cols,
+        ["id"],
+    )
+
+    dataset = load_dataset(dataset_path)
+    assert dataset["id"].tolist() == [1, 2]
+    assert dataset["job_title_raw"].tolist() == ["nanny 1", "senior nanny"]
+    assert dataset["month"].tolist() == ["1", "3"]
+    # the emptied february partition is deleted
+    assert get_partition_dirs(dataset_path) == {
+        "sector=Nanny/year=2022/month=1",
+        "sector=Nanny/year=2022/month=3",
+    }
+
+
+def test_upsert_replaces_skills_of_keys_without_rows(tmp_path):
+    skills_path = str(tmp_path / "skills")
+    skills = make_job_adverts([1, 1, 2], ["2022-01-10"] * 2 + ["2022-02-10"])
+    save_parquet_dataset(skills, skills_path, partition_cols, sort_cols=["id"])
+
+    # advert 2 no longer has any skills, and advert 1 has one
+    upsert_parquet_dataset(
+        skills.iloc[:1], skills_path, partition_cols, ["id"], keys=[1, 2]
+    )
+
+    assert load_dataset(skills_path)["id"].tolist() == [1]
+    assert get_partition_dirs(skills_path) == {"sector=Nanny/year=2022/month=1"}
+
+
+def test_upsert_without_rows_or_keys_is_a_no_op(dataset_path):
+    before = load_dataset(dataset_path)
+
+    upsert_parquet_dataset(
+        make_job_adverts([], []), dataset_path, partition_cols, ["id"]
+    )
+
+    pd.testing.assert_frame_equal(load_dataset(dataset_path), before)
+
+
+def test_upsert_of_keys_not_stored_is_a_no_op(dataset_path):
+    before = load_dataset(dataset_path)
+
+    upsert_parquet_dataset(
+        make_job_adverts([], []), dataset_path, partition_cols, ["id"], keys=[99]
+    )
+
+    pd.testing.assert_frame_equal(load_dataset(dataset_path), before)
+
+
+def test_upsert_into_a_new_dataset_saves_it(tmp_path):
+    dataset_path = str(tmp_path / "job_adverts")
+
+    upsert_parquet_dataset(
+        make_job_adverts([1], ["2022-01-10"]), dataset_path, partition_cols
+    )
+
+    assert load_dataset(dataset_path)["id"].tolist() == [1]
@@ -0,0 +1,67 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import afs_early_years_labour_market_analysis.utils.quantile_sketch as qs
+
+
+@pytest.fixture
+def job_adverts() -> pd.DataFrame:
+    rng = np.random.default_rng(42)
+    n_adverts = 1_000
+    return pd.DataFrame(
+        {
+            "profession": rng.choice(["Early Years Practitioner", "Nanny"], n_adverts),
+            "month_year": pd.to_datetime(
+                rng.choice(["2022-01-01", "2022-02-01", "2022-03-01"], n_adverts)
+            ),
+            "qualification_level": rng.choice([2, 3, 6], n_adverts),
+            "is_remote": rng.choice([True, False], n_adverts),
+            "salary": rng.normal(25_000, 5_000, n_adverts),
+        }
+    )
+
+
+def test_saved_sketches_merge_into_the_same_groups(tmp_path, job_adverts):
+    group_cols = ["profession", "month_year", "qualification_level", "is_remote"]
+    shard_sketches = [
+        qs.GroupedQuantileSketch(group_cols, seed=42).update(shard, "salary")
+        for shard in np.array_split(job_adverts, 2)
+    ]
+    sketch_path = str(tmp_path / "quantile_sketch.json")
+    shard_sketches[1].save(sketch_path)
+    loaded = qs.GroupedQuantileSketch.load(sketch_path)
+
+    assert set(loaded.sketches) == set(shard_sketches[1].sketches)
+    merged = shard_sketches[0].merge(loaded)
+    assert len(merged.sketches) == job_adverts.groupby(group_cols).ngroups
+    assert merged.quantiles()["count"].sum() == len(job_adverts)
+
+
+def test_group_values_keep_their_types():
+    values = [None, pd.Timestamp("2022-01-01"), True, 3, 2.5, "Nanny"]
+    for value in values:
+        decoded = qs.decode_group_value(qs.encode_group_value(value))
+        assert decoded == value and type(decoded) is type(value)
+
+
+def test_unsupported_group_values_raise():
+    with pytest.raises(TypeError):
+        qs.encode_group_value(object())
+
+
+def test_legacy_sketches_load_with_string_groups(tmp_path):
+    sketch = qs.GroupedQuantileSketch(["profession"], seed=42)
+    sketch.update(pd.DataFrame({"profession": ["Nanny"], "salary": [1.0]}), "salary")
+    sketch_path = str(tmp_path / "quantile_sketch.json")
+    sketch.save(sketch_path)
+    with open(sketch_path) as f:
+        saved = json.load(f)
+    for group_sketch in saved["sketches"]:
+        group_sketch["group"] = [value for _, value in group_sketch.pop("typed_group")]
+    with open(sketch_path, "w") as f:
+        json.dump(saved, f)
+
+    assert list(qs.GroupedQuantileSketch.load(sketch_path).sketches) == [("Nanny",)]